@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from typing import Protocol
+import asyncio
+import threading
+
+
+class BackgroundServer(Protocol):
+
+    async def start(self, host: str, port: int) -> tuple[str, int]: ...
+
+    async def stop(self) -> None: ...
+
+
+def start_in_thread(
+    server: BackgroundServer,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    name: str = "server",
+) -> tuple[tuple[str, int], threading.Event]:
+    """Runs an asyncio server on its own event loop thread.
+
+    Returns the bound address and an event that stops the server when set.
+    Used by the blocking harness, which cannot share its caller's loop."""
+    started = threading.Event()
+    stop = threading.Event()
+    result: list = []
+
+    async def serve() -> None:
+        try:
+            result.append(await server.start(host, port))
+        except OSError as e:
+            result.append(e)
+            started.set()
+            return
+        started.set()
+        while not stop.is_set():
+            await asyncio.sleep(0.1)
+        await server.stop()
+
+    threading.Thread(target=asyncio.run, args=(serve(),), name=name, daemon=True).start()
+    started.wait()
+
+    if isinstance(result[0], OSError):
+        raise result[0]
+    return result[0], stop
@@ -0,0 +1,331 @@
+#!/usr/bin/python3
+
+# bench_clients.py - cost of tracking many distinct clients on the proxy side.
+#
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from bench_common import CMD_DOWNLOAD, process_cpu_seconds, run_echo, run_sink_source, spawn_script, start_server
+from dataclasses import dataclass, field
+from histogram import LatencyHistogram, format_ns
+from struct import pack
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import socks
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+_TCP_REPLY: int = 1024
+_UDP_PAYLOAD: int = 512
+
+
+def loopback_sources(count: int) -> list[str]:
+    """One 127.0.x.y address per client, all of them local on Linux.
+
+    Elsewhere only 127.0.0.1 is, the rest need adding as loopback aliases."""
+    return [f"127.0.{1 + i // 250}.{1 + i % 250}" for i in range(count)]
+
+
+@dataclass
+class ClientsResult:
+    clients: int
+    rounds: int
+    elapsed_seconds: float
+    connect: LatencyHistogram = field(default_factory=LatencyHistogram)
+    associate: LatencyHistogram = field(default_factory=LatencyHistogram)
+    udp_rtt: LatencyHistogram = field(default_factory=LatencyHistogram)
+    errors: int = 0
+    # From the proxy, None when it is not ours to ask
+    tracked_clients: int | None = None
+    client_lookups: int | None = None
+    client_lookup_ns: int | None = None
+    proxy_cpu_seconds: float | None = None
+
+    @property
+    def sessions(self) -> int:
+        return self.connect.total + self.associate.total
+
+    @property
+    def sessions_per_second(self) -> float:
+        return self.sessions / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    @property
+    def lookup_ns(self) -> float | None:
+        if not self.client_lookups:
+            return None
+        return self.client_lookup_ns / self.client_lookups
+
+    @property
+    def proxy_cpu_per_session(self) -> float | None:
+        if self.proxy_cpu_seconds is None or not self.sessions:
+            return None
+        return self.proxy_cpu_seconds / self.sessions
+
+    def to_dict(self) -> dict:
+        return {
+            "clients": self.clients,
+            "rounds": self.rounds,
+            "elapsed_seconds": self.elapsed_seconds,
+            "sessions": self.sessions,
+            "sessions_per_second": self.sessions_per_second,
+            "connect_ns": self.connect.summary(),
+            "associate_ns": self.associate.summary(),
+            "udp_rtt_ns": self.udp_rtt.summary(),
+            "errors": self.errors,
+            "tracked_clients": self.tracked_clients,
+            "client_lookups": self.client_lookups,
+            "lookup_ns": self.lookup_ns,
+            "proxy_cpu_seconds": self.proxy_cpu_seconds,
+            "proxy_cpu_per_session": self.proxy_cpu_per_session,
+        }
+
+
+def _client(
+    result: ClientsResult,
+    lock: threading.Lock,
+    ready: threading.Barrier,
+    proxy: tuple[str, int],
+    tcp_target: tuple[str, int],
+    udp_target: tuple[str, int],
+    source: str,
+    rounds: int,
+    datagrams: int,
+) -> None:
+    connect = LatencyHistogram()
+    associate = LatencyHistogram()
+    udp_rtt = LatencyHistogram()
+    errors = 0
+    request = CMD_DOWNLOAD + pack(">Q", _TCP_REPLY)
+    ready.wait()
+
+    for _ in range(rounds):
+        # A short CONNECT, the way a browser opens and drops connections
+        s = socks.socksocket(socket.AF_INET, socket.SOCK_STREAM)
+        s.set_proxy(socks.SOCKS5, proxy[0], proxy[1], True)
+        try:
+            s.settimeout(10)
+            s.bind((source, 0))
+            start = time.perf_counter_ns()
+            s.connect(tcp_target)
+            connect.record(time.perf_counter_ns() - start)
+            s.sendall(request)
+            received = 0
+            while received < _TCP_REPLY:
+                data = s.recv(_TCP_REPLY - received)
+                if not data:
+                    raise ConnectionResetError("Short reply")
+                received += len(data)
+        except (socks.ProxyError, OSError):
+            errors += 1
+        finally:
+            s.close()
+
+        # And a UDP ASSOCIATE from the same address, for DNS and the like
+        u = socks.socksocket(socket.AF_INET, socket.SOCK_DGRAM)
+        u.set_proxy(socks.SOCKS5, proxy[0], proxy[1], True)
+        try:
+            u.settimeout(2)
+            start = time.perf_counter_ns()
+            u.bind((source, 0))
+            associate.record(time.perf_counter_ns() - start)
+            for sequence in range(datagrams):
+                start = time.perf_counter_ns()
+                u.sendto(b"D" + pack(">QI", sequence, _UDP_PAYLOAD), udp_target)
+                u.recvfrom(_UDP_PAYLOAD + 64)
+                udp_rtt.record(time.perf_counter_ns() - start)
+        except (socks.ProxyError, OSError):
+            errors += 1
+        finally:
+            u.close()
+
+    with lock:
+        result.connect.merge(connect)
+        result.associate.merge(associate)
+        result.udp_rtt.merge(udp_rtt)
+        result.errors += errors
+
+
+def measure(
+    clients: int,
+    rounds: int,
+    datagrams: int,
+    proxy: tuple[str, int],
+    tcp_target: tuple[str, int],
+    udp_target: tuple[str, int],
+    sources: list[str],
+    proxy_pid: int | None,
+) -> ClientsResult:
+    """Runs every client at once, each from its own source address."""
+    result = ClientsResult(clients=clients, rounds=rounds, elapsed_seconds=0.0)
+    lock = threading.Lock()
+    ready = threading.Barrier(clients + 1)
+    threads = [
+        threading.Thread(
+            target=_client,
+            args=(result, lock, ready, proxy, tcp_target, udp_target, sources[i % len(sources)], rounds, datagrams),
+            daemon=True,
+        )
+        for i in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+
+    proxy_cpu_start = process_cpu_seconds(proxy_pid) if proxy_pid else None
+    start = time.perf_counter()
+    ready.wait()
+    for thread in threads:
+        thread.join()
+    result.elapsed_seconds = time.perf_counter() - start
+
+    if proxy_cpu_start is not None:
+        proxy_cpu_end = process_cpu_seconds(proxy_pid)
+        if proxy_cpu_end is not None:
+            result.proxy_cpu_seconds = proxy_cpu_end - proxy_cpu_start
+    return result
+
+
+def print_results(results: list[ClientsResult]) -> None:
+    print(
+        f"{'CLIENTS':>8}{'TRACKED':>9}{'SESSIONS/s':>12}{'CONNECT p50':>13}{'p99':>11}"
+        f"{'ASSOC p50':>11}{'p99':>11}{'UDP RTT p50':>13}{'LOOKUP':>10}{'CPU/SESSION':>13}{'ERRORS':>8}"
+    )
+    for r in results:
+        cpu = r.proxy_cpu_per_session
+        print(
+            f"{r.clients:>8}{'-' if r.tracked_clients is None else r.tracked_clients:>9}"
+            f"{r.sessions_per_second:>12.0f}"
+            f"{format_ns(r.connect.percentile(50)):>13}{format_ns(r.connect.percentile(99)):>11}"
+            f"{format_ns(r.associate.percentile(50)):>11}{format_ns(r.associate.percentile(99)):>11}"
+            f"{format_ns(r.udp_rtt.percentile(50)):>13}"
+            f"{'-' if r.lookup_ns is None else format_ns(r.lookup_ns):>10}"
+            f"{'-' if cpu is None else format_ns(cpu * 1e9):>13}{r.errors:>8}"
+        )
+
+
+def _stop_proxy(proxy_process: subprocess.Popen, stats_path: str, result: ClientsResult) -> None:
+    # SIGINT so it shuts down cleanly and writes its stats
+    proxy_process.send_signal(signal.SIGINT)
+    try:
+        proxy_process.wait(10)
+    except subprocess.TimeoutExpired:
+        proxy_process.kill()
+        proxy_process.wait()
+        return
+    try:
+        with open(stats_path) as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        return
+    result.tracked_clients = stats["clients"]
+    result.client_lookups = stats["client_lookups"]
+    result.client_lookup_ns = stats["client_lookup_ns"]
+
+
+def main(args: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark a proxy against many clients, each from its own address")
+    parser.add_argument(
+        "--proxy",
+        metavar="HOST:PORT",
+        help="SOCKS5 proxy to test, default spawns a fresh reference_proxy.py for every client count",
+    )
+    parser.add_argument(
+        "--target",
+        metavar="HOST:PORT",
+        help="Sink/source server as seen from the proxy, default starts one on 127.0.0.1."
+             " UDP uses the echo server on the next port up",
+    )
+    parser.add_argument("-c", "--clients", default="5,50,200,500", help="Comma separated client counts")
+    parser.add_argument("-r", "--rounds", type=int, default=5, help="CONNECT and ASSOCIATE sessions per client")
+    parser.add_argument("-d", "--datagrams", type=int, default=4, help="UDP echoes per ASSOCIATE")
+    parser.add_argument(
+        "--sources",
+        help="Comma separated local addresses to give the clients, default one 127.0.x.y each."
+             " Fewer addresses than clients are shared round robin",
+    )
+    parser.add_argument("--json", metavar="FILE", help="Also write the results here")
+    options = parser.parse_args(args)
+
+    client_counts = [int(n) for n in options.clients.split(",")]
+    sources = options.sources.split(",") if options.sources else loopback_sources(max(client_counts))
+
+    children: list = []
+    results: list[ClientsResult] = []
+    try:
+        if options.target:
+            host, _, port = options.target.rpartition(":")
+            tcp_target = (host, int(port))
+            udp_target = (host, int(port) + 1)
+        else:
+            sink, tcp_target = start_server(run_sink_source, "127.0.0.1", socket.SOCK_STREAM)
+            children.append(sink)
+            echo, udp_target = start_server(run_echo, "127.0.0.1", socket.SOCK_DGRAM)
+            children.append(echo)
+
+        with tempfile.TemporaryDirectory() as scratch:
+            for clients in client_counts:
+                proxy_process = None
+                stats_path = os.path.join(scratch, f"stats-{clients}.json")
+                if options.proxy:
+                    host, _, port = options.proxy.rpartition(":")
+                    proxy = (host, int(port))
+                else:
+                    # A new proxy each time, so it only knows this run's clients
+                    proxy_process, proxy = spawn_script("reference_proxy.py", "--host", "0.0.0.0", "--stats", stats_path)
+                    children.append(proxy_process)
+
+                result = measure(
+                    clients,
+                    options.rounds,
+                    options.datagrams,
+                    proxy,
+                    tcp_target,
+                    udp_target,
+                    sources,
+                    proxy_process.pid if proxy_process else None,
+                )
+                if proxy_process is not None:
+                    children.remove(proxy_process)
+                    _stop_proxy(proxy_process, stats_path, result)
+                results.append(result)
+                print(
+                    f"  {clients} clients: {result.sessions_per_second:.0f} sessions/s, {result.errors} errors",
+                    file=sys.stderr,
+                )
+
+        print_results(results)
+        if options.json:
+            with open(options.json, "w") as f:
+                json.dump([r.to_dict() for r in results], f, indent=2)
+    finally:
+        for child in children:
+            child.terminate()
+            if isinstance(child, multiprocessing.Process):
+                child.join()
+            else:
+                child.wait()
+
+    return 0 if all(r.errors == 0 for r in results) else 1
+
+
+if __name__ == "__main__":
+    exit_code = main(sys.argv[1:])
+    sys.exit(exit_code)
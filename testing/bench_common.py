@@ -0,0 +1,220 @@
+#!/usr/bin/python3
+
+# bench_common.py - servers and process helpers shared by the benchmarks.
+#
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from collections.abc import Callable
+from http_wire import HEADER_END, encode_head, keep_alive, parse_head
+from struct import pack, unpack, unpack_from
+import asyncio
+import multiprocessing
+import os
+import re
+import select
+import socket
+import subprocess
+import sys
+
+# Each TCP stream starts with one command byte: upload streams are drained
+# and answered with the byte count on EOF, download streams get as many
+# bytes as the 8 byte length that follows asks for.
+#
+# Every UDP request starts with the same command byte and an 8 byte sequence
+# number. Upload requests carry the payload and are answered with the
+# sequence number alone, download requests carry a 4 byte size and are
+# answered with the sequence number and that many bytes.
+CMD_UPLOAD: bytes = b"U"
+CMD_DOWNLOAD: bytes = b"D"
+
+UDP_REQUEST_HEADER: int = 9
+MAX_DATAGRAM: int = 65507
+
+_CHUNK: int = 256 * 1024
+_MAX_BODY: int = 64 * 1024 * 1024
+# Room for a full window of the biggest datagrams, so losses are the relay's
+_RCVBUF: int = 4 * 1024 * 1024
+_LISTENING: re.Pattern = re.compile(r" on \S+:(\d+)")
+
+
+async def _serve_sink_source(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        command = await reader.readexactly(1)
+        if command == CMD_UPLOAD:
+            total = 0
+            while data := await reader.read(_CHUNK):
+                total += len(data)
+            writer.write(pack(">Q", total))
+        elif command == CMD_DOWNLOAD:
+            (remaining,) = unpack(">Q", await reader.readexactly(8))
+            block = bytes(_CHUNK)
+            view = memoryview(block)
+            while remaining > 0:
+                size = min(remaining, _CHUNK)
+                writer.write(view[:size])
+                remaining -= size
+                await writer.drain()
+        await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def run_sink_source(host: str, port: int, ready: multiprocessing.Event) -> None:
+    """TCP sink/source server, meant to be the target of a Process."""
+    async def serve() -> None:
+        server = await asyncio.start_server(_serve_sink_source, host, port)
+        ready.set()
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+def run_echo(host: str, port: int, ready: multiprocessing.Event) -> None:
+    """UDP echo server, meant to be the target of a Process."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, _RCVBUF)
+    s.bind((host, port))
+    ready.set()
+    buffer = bytearray(MAX_DATAGRAM + 1)
+    try:
+        while True:
+            received, addr = s.recvfrom_into(buffer)
+            if received < UDP_REQUEST_HEADER:
+                continue
+            seq = bytes(buffer[1:UDP_REQUEST_HEADER])
+            if buffer[0] == CMD_UPLOAD[0]:
+                s.sendto(seq, addr)
+            elif buffer[0] == CMD_DOWNLOAD[0] and received >= UDP_REQUEST_HEADER + 4:
+                (size,) = unpack_from(">I", buffer, UDP_REQUEST_HEADER)
+                s.sendto(seq + bytes(min(size, MAX_DATAGRAM - 8)), addr)
+    except KeyboardInterrupt:
+        pass
+
+
+async def _serve_origin(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    # GET /bytes/N answers with N zero bytes, /chunked/N with the same in
+    # chunks. Request bodies are never expected.
+    try:
+        while True:
+            method, target, version, headers = parse_head(await reader.readuntil(HEADER_END))
+            kind, _, size = target.lstrip("/").partition("/")
+            open_after = keep_alive(version, headers)
+            connection = ("Connection", "keep-alive" if open_after else "close")
+            if kind in ("bytes", "chunked") and size.isdigit() and int(size) <= _MAX_BODY:
+                body = bytes(int(size)) if method != "HEAD" else b""
+                if kind == "bytes":
+                    writer.write(encode_head(
+                        "HTTP/1.1 200 OK", [("Content-Length", size), connection]) + body)
+                else:
+                    writer.write(encode_head(
+                        "HTTP/1.1 200 OK", [("Transfer-Encoding", "chunked"), connection]))
+                    for offset in range(0, len(body), 16384):
+                        chunk = body[offset:offset + 16384]
+                        writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                    writer.write(b"0\r\n\r\n")
+            else:
+                writer.write(encode_head("HTTP/1.1 404 Not Found", [("Content-Length", "0"), connection]))
+            await writer.drain()
+            if not open_after:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+def run_origin(host: str, port: int, ready: multiprocessing.Event) -> None:
+    """HTTP origin server, meant to be the target of a Process."""
+    async def serve() -> None:
+        server = await asyncio.start_server(_serve_origin, host, port)
+        ready.set()
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+def process_cpu_seconds(pid: int) -> float | None:
+    """utime + stime of a process, None once it is gone."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def free_port(host: str, kind: int = socket.SOCK_STREAM) -> int:
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+def start_server(
+    run_server: Callable[[str, int, multiprocessing.Event], None],
+    host: str,
+    kind: int,
+) -> tuple[multiprocessing.Process, tuple[str, int]]:
+    """Runs one of the servers above in a process, on a free port of host."""
+    address = (host, free_port(host, kind))
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=run_server, args=(*address, ready), daemon=True)
+    server.start()
+    if not ready.wait(5):
+        server.terminate()
+        server.join()
+        raise RuntimeError(f"{run_server.__name__} did not start")
+    return server, address
+
+
+def spawn_script(script: str, *args: str, timeout: float = 5.0) -> tuple[subprocess.Popen, tuple[str, int]]:
+    """Runs a script next to this one on a port of its own choosing.
+
+    reference_proxy.py and impairment.py print "... on HOST:PORT" once they
+    listen. Reading that back, instead of connecting to see, keeps the proxy
+    from counting the check as one of its clients. A separate process keeps
+    a relay from fighting us for the GIL."""
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-u",
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), script),
+            *args,
+            "--port",
+            "0",
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        readable, _, _ = select.select([process.stdout], [], [], timeout)
+        listening = _LISTENING.search(process.stdout.readline()) if readable else None
+        if listening is None:
+            raise RuntimeError(f"{script} did not start")
+    except BaseException:
+        process.terminate()
+        process.wait()
+        raise
+    return process, ("127.0.0.1", int(listening.group(1)))
@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+
+# bench_dns_parse.py - DNS responses decoded per second by dns_wire.
+#
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from dns_server import DnsServerConfig, build_dns_reply
+from dns_wire import build_dns_request, parse_dns_response, parse_dns_responses
+import argparse
+import sys
+import time
+
+
+def main(args: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the DNS response decoder")
+    parser.add_argument("-n", "--count", type=int, default=200_000, help="Responses to decode")
+    parser.add_argument("-a", "--answers", type=int, default=6, help="A records per response")
+    options = parser.parse_args(args)
+
+    config = DnsServerConfig(answer_count=options.answers)
+    responses = [
+        build_dns_reply(build_dns_request(i & 0xFFFF, f"host-{i % 1000}.example.com"), config)
+        for i in range(options.count)
+    ]
+
+    print(f"DNS PARSE: {options.count} responses, {options.answers} answers each")
+
+    start = time.perf_counter()
+    for resp in responses:
+        parse_dns_response(resp)
+    elapsed = time.perf_counter() - start
+    print(f"  one at a time  {options.count / elapsed:,.0f} responses/s")
+
+    start = time.perf_counter()
+    _, malformed = parse_dns_responses(responses)
+    elapsed = time.perf_counter() - start
+    print(f"  batch          {options.count / elapsed:,.0f} responses/s ({malformed} malformed)")
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main(sys.argv[1:])
+    sys.exit(exit_code)
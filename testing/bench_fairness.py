@@ -0,0 +1,419 @@
+#!/usr/bin/python3
+
+# bench_fairness.py - per-client throughput and fairness with many clients at once.
+#
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from bench_clients import loopback_sources
+from bench_common import (
+    CMD_DOWNLOAD,
+    CMD_UPLOAD,
+    process_cpu_seconds,
+    run_echo,
+    run_sink_source,
+    spawn_script,
+    start_server,
+)
+from dataclasses import asdict, dataclass, field
+from struct import pack
+import argparse
+import json
+import multiprocessing
+import socket
+import socks
+import sys
+import threading
+import time
+
+_CHUNK: int = 64 * 1024
+# Download streams ask for more than they can ever read in one run
+_ENDLESS: int = 1 << 50
+
+_UDP_REQUEST: bytes = b"D"
+_UDP_PAYLOAD: int = 1200
+_UDP_WINDOW: int = 8
+
+
+def jain_index(values: list[float]) -> float:
+    """(sum x)^2 / (n * sum x^2): 1.0 when everyone gets the same, 1/n when one gets it all."""
+    squares = sum(x * x for x in values)
+    if not values or not squares:
+        return 1.0
+    return sum(values) ** 2 / (len(values) * squares)
+
+
+@dataclass
+class FairnessResult:
+    transport: str
+    direction: str
+    clients: int
+    streams: int
+    elapsed_seconds: float
+    client_bytes: list[int] = field(default_factory=list)
+    # Bytes per second per client the proxy should hold everyone to, 0 for none
+    cap: int = 0
+    errors: int = 0
+    proxy_cpu_seconds: float | None = None
+
+    @property
+    def client_rates(self) -> list[float]:
+        if not self.elapsed_seconds:
+            return [0.0 for _ in self.client_bytes]
+        return [moved / self.elapsed_seconds for moved in self.client_bytes]
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return sum(self.client_rates) / (1024 * 1024)
+
+    @property
+    def jain(self) -> float:
+        return jain_index(self.client_rates)
+
+    @property
+    def cap_error_percent(self) -> float | None:
+        """How far the mean client is from the cap, negative when under it."""
+        if not self.cap or not self.client_bytes:
+            return None
+        rates = self.client_rates
+        return 100.0 * (sum(rates) / len(rates) - self.cap) / self.cap
+
+    @property
+    def worst_cap_error_percent(self) -> float | None:
+        if not self.cap or not self.client_bytes:
+            return None
+        return max(100.0 * abs(rate - self.cap) / self.cap for rate in self.client_rates)
+
+    def to_dict(self) -> dict:
+        return {
+            **asdict(self),
+            "client_rates": self.client_rates,
+            "megabytes_per_second": self.megabytes_per_second,
+            "jain": self.jain,
+            "cap_error_percent": self.cap_error_percent,
+            "worst_cap_error_percent": self.worst_cap_error_percent,
+        }
+
+
+class _Run:
+    """Shared state of one run: a barrier to start everyone together, then a deadline."""
+
+    def __init__(self, parties: int, seconds: float):
+        self.seconds = seconds
+        self.ready = threading.Barrier(parties + 1)
+        self.deadline = 0.0
+        self.lock = threading.Lock()
+        self.errors = 0
+
+    def error(self) -> None:
+        with self.lock:
+            self.errors += 1
+
+    def start(self) -> None:
+        # Everyone is connected, the clock starts now
+        self.deadline = time.monotonic() + self.seconds
+        self.ready.wait()
+
+
+def _open(
+    proxy: tuple[str, int],
+    source: str | None,
+    kind: int,
+) -> socks.socksocket:
+    s = socks.socksocket(socket.AF_INET, kind)
+    s.set_proxy(socks.SOCKS5, proxy[0], proxy[1], True)
+    # The proxy tells clients apart by IP, so each one needs its own. Binding
+    # a UDP socket is also what sets up its association
+    if source or kind == socket.SOCK_DGRAM:
+        s.bind((source or "", 0))
+    return s
+
+
+def _tcp_stream(
+    run: _Run,
+    counts: list[int],
+    index: int,
+    proxy: tuple[str, int],
+    target: tuple[str, int],
+    source: str | None,
+    direction: str,
+) -> None:
+    try:
+        s = _open(proxy, source, socket.SOCK_STREAM)
+        s.settimeout(10)
+        s.connect(target)
+    except (socks.ProxyError, OSError):
+        run.error()
+        run.ready.wait()
+        return
+
+    moved = 0
+    try:
+        if direction == "down":
+            s.sendall(CMD_DOWNLOAD + pack(">Q", _ENDLESS))
+        else:
+            s.sendall(CMD_UPLOAD)
+        run.ready.wait()
+
+        buffer = bytearray(_CHUNK)
+        block = memoryview(bytes(_CHUNK))
+        while time.monotonic() < run.deadline:
+            if direction == "down":
+                received = s.recv_into(buffer)
+                if not received:
+                    break
+                moved += received
+            else:
+                moved += s.send(block)
+    except (socks.ProxyError, OSError):
+        run.error()
+    finally:
+        s.close()
+        with run.lock:
+            counts[index] += moved
+
+
+def _udp_client(
+    run: _Run,
+    counts: list[int],
+    index: int,
+    proxy: tuple[str, int],
+    target: tuple[str, int],
+    source: str | None,
+    payload: int = _UDP_PAYLOAD,
+) -> None:
+    try:
+        s = _open(proxy, source, socket.SOCK_DGRAM)
+    except (socks.ProxyError, OSError):
+        run.error()
+        run.ready.wait()
+        return
+
+    moved = 0
+    sequence = 0
+    request = _UDP_REQUEST + b"%s" + pack(">I", payload)
+    try:
+        s.settimeout(0.5)
+        run.ready.wait()
+        outstanding = 0
+        while time.monotonic() < run.deadline:
+            while outstanding < _UDP_WINDOW:
+                s.sendto(request % pack(">Q", sequence), target)
+                sequence += 1
+                outstanding += 1
+            try:
+                data, _ = s.recvfrom(payload + 64)
+            except socket.timeout:
+                # Whatever was in flight is not coming back
+                outstanding = 0
+                continue
+            outstanding -= 1
+            moved += len(data)
+    except (socks.ProxyError, OSError):
+        run.error()
+    finally:
+        s.close()
+        with run.lock:
+            counts[index] += moved
+
+
+def measure(
+    transport: str,
+    direction: str,
+    clients: int,
+    streams: int,
+    seconds: float,
+    proxy: tuple[str, int],
+    target: tuple[str, int],
+    sources: list[str],
+    cap: int,
+    proxy_pid: int | None,
+    udp_payload: int = _UDP_PAYLOAD,
+) -> FairnessResult:
+    counts = [0] * clients
+    threads = []
+    if transport == "tcp":
+        run = _Run(clients * streams, seconds)
+        for index in range(clients):
+            source = sources[index % len(sources)] if sources else None
+            for _ in range(streams):
+                threads.append(threading.Thread(
+                    target=_tcp_stream,
+                    args=(run, counts, index, proxy, target, source, direction),
+                    daemon=True,
+                ))
+    else:
+        run = _Run(clients, seconds)
+        for index in range(clients):
+            source = sources[index % len(sources)] if sources else None
+            threads.append(threading.Thread(
+                target=_udp_client,
+                args=(run, counts, index, proxy, target, source, udp_payload),
+                daemon=True,
+            ))
+
+    for thread in threads:
+        thread.start()
+    proxy_cpu_start = process_cpu_seconds(proxy_pid) if proxy_pid else None
+    start = time.monotonic()
+    run.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    proxy_cpu = None
+    if proxy_cpu_start is not None:
+        proxy_cpu_end = process_cpu_seconds(proxy_pid)
+        if proxy_cpu_end is not None:
+            proxy_cpu = proxy_cpu_end - proxy_cpu_start
+
+    return FairnessResult(
+        transport=transport,
+        direction=direction if transport == "tcp" else "down",
+        clients=clients,
+        streams=streams if transport == "tcp" else 1,
+        elapsed_seconds=min(elapsed, seconds),
+        client_bytes=counts,
+        cap=cap if transport == "tcp" else 0,
+        errors=run.errors,
+        proxy_cpu_seconds=proxy_cpu,
+    )
+
+
+def _format_percent(value: float | None) -> str:
+    return "-" if value is None else f"{value:+.1f}%"
+
+
+def print_results(results: list[FairnessResult]) -> None:
+    print(
+        f"{'PROTO':<6}{'DIR':<5}{'CLIENTS':>8}{'STREAMS':>8}{'TOTAL MB/s':>12}"
+        f"{'MIN MB/s':>10}{'MEAN MB/s':>11}{'MAX MB/s':>10}{'JAIN':>7}"
+        f"{'CAP ERR':>9}{'WORST':>9}{'PROXY CPU':>11}{'ERRORS':>8}"
+    )
+    megabyte = 1024 * 1024
+    for r in results:
+        rates = r.client_rates
+        print(
+            f"{r.transport:<6}{r.direction:<5}{r.clients:>8}{r.streams:>8}{r.megabytes_per_second:>12.2f}"
+            f"{min(rates) / megabyte:>10.3f}{sum(rates) / len(rates) / megabyte:>11.3f}"
+            f"{max(rates) / megabyte:>10.3f}{r.jain:>7.3f}"
+            f"{_format_percent(r.cap_error_percent):>9}{_format_percent(r.worst_cap_error_percent):>9}"
+            f"{'-' if r.proxy_cpu_seconds is None else f'{r.proxy_cpu_seconds:.2f}s':>11}{r.errors:>8}"
+        )
+
+
+def main(args: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark per-client throughput and fairness through a proxy")
+    parser.add_argument("--proxy", metavar="HOST:PORT", help="SOCKS5 proxy to test, default spawns reference_proxy.py")
+    parser.add_argument(
+        "--target",
+        metavar="HOST:PORT",
+        help="Sink/source server as seen from the proxy, default starts one on 127.0.0.1."
+             " UDP uses the echo server on the next port up",
+    )
+    parser.add_argument("-c", "--clients", default="1,4,16,64", help="Comma separated client counts")
+    parser.add_argument("-s", "--streams", type=int, default=1, help="TCP connections per client")
+    parser.add_argument("-t", "--transports", default="tcp,udp", help="Comma separated, from tcp,udp")
+    parser.add_argument("-d", "--direction", choices=("down", "up"), default="down", help="TCP transfer direction")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Length of each run")
+    parser.add_argument(
+        "--cap",
+        type=int,
+        default=0,
+        help="Per-client limit in bytes per second. Passed to the spawned reference proxy,"
+             " with --proxy it is the limit set on the device",
+    )
+    parser.add_argument(
+        "--sources",
+        default="auto",
+        help="Comma separated local addresses to spread clients over, so the proxy sees them"
+             " as different clients. auto gives each one its own 127.0.x.y against the spawned proxy,"
+             " none connects from the default address",
+    )
+    parser.add_argument("--json", metavar="FILE", help="Also write the results here")
+    options = parser.parse_args(args)
+
+    client_counts = [int(n) for n in options.clients.split(",")]
+    transports = options.transports.split(",")
+    if options.sources == "auto":
+        sources = [] if options.proxy else loopback_sources(max(client_counts))
+    elif options.sources == "none":
+        sources = []
+    else:
+        sources = options.sources.split(",")
+
+    children: list = []
+    results: list[FairnessResult] = []
+    try:
+        if options.target:
+            host, _, port = options.target.rpartition(":")
+            target = (host, int(port))
+            udp_target = (host, int(port) + 1)
+        else:
+            sink, target = start_server(run_sink_source, "127.0.0.1", socket.SOCK_STREAM)
+            children.append(sink)
+            echo, udp_target = start_server(run_echo, "127.0.0.1", socket.SOCK_DGRAM)
+            children.append(echo)
+
+        proxy_pid: int | None = None
+        if options.proxy:
+            host, _, port = options.proxy.rpartition(":")
+            proxy = (host, int(port))
+        else:
+            # Listens on every address so clients on 127.0.0.x all reach it
+            proxy_process, proxy = spawn_script(
+                "reference_proxy.py", "--host", "0.0.0.0", "--client-limit", str(options.cap)
+            )
+            children.append(proxy_process)
+            proxy_pid = proxy_process.pid
+
+        for transport in transports:
+            for clients in client_counts:
+                result = measure(
+                    transport,
+                    options.direction,
+                    clients,
+                    options.streams,
+                    options.seconds,
+                    proxy,
+                    target if transport == "tcp" else udp_target,
+                    sources,
+                    options.cap,
+                    proxy_pid,
+                )
+                results.append(result)
+                print(
+                    f"  {transport} x{clients}: {result.megabytes_per_second:.2f} MB/s, jain {result.jain:.3f}",
+                    file=sys.stderr,
+                )
+
+        print_results(results)
+        if options.json:
+            with open(options.json, "w") as f:
+                json.dump([r.to_dict() for r in results], f, indent=2)
+    finally:
+        for child in children:
+            child.terminate()
+            if isinstance(child, multiprocessing.Process):
+                child.join()
+            else:
+                child.wait()
+
+    return 0 if all(r.errors == 0 for r in results) else 1
+
+
+if __name__ == "__main__":
+    exit_code = main(sys.argv[1:])
+    sys.exit(exit_code)
@@ -0,0 +1,286 @@
+#!/usr/bin/python3
+
+# bench_http_forward.py - plain HTTP through a forward proxy, with and without keep-alive.
+#
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from bench_common import process_cpu_seconds, run_origin, spawn_script, start_server
+from dataclasses import dataclass, field
+from histogram import LatencyHistogram, format_ns
+from http_forward import ForwardProxyPool
+import argparse
+import json
+import multiprocessing
+import socket
+import sys
+import threading
+import time
+
+MODE_RECONNECT: str = "reconnect"
+MODE_KEEP_ALIVE: str = "keep-alive"
+MODE_PIPELINE: str = "pipeline"
+
+
+@dataclass
+class ForwardResult:
+    mode: str
+    workers: int
+    depth: int
+    body_size: int
+    requests: int = 0
+    errors: int = 0
+    connections: int = 0
+    retries: int = 0
+    elapsed_seconds: float = 0.0
+    proxy_cpu_seconds: float | None = None
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.requests / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    @property
+    def requests_per_connection(self) -> float:
+        return self.requests / self.connections if self.connections else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "depth": self.depth,
+            "body_size": self.body_size,
+            "requests": self.requests,
+            "errors": self.errors,
+            "connections": self.connections,
+            "retries": self.retries,
+            "elapsed_seconds": self.elapsed_seconds,
+            "requests_per_second": self.requests_per_second,
+            "requests_per_connection": self.requests_per_connection,
+            "proxy_cpu_seconds": self.proxy_cpu_seconds,
+            "latency_ns": self.latency.summary(),
+        }
+
+
+def _worker(
+    pool: ForwardProxyPool,
+    url: str,
+    mode: str,
+    depth: int,
+    body_size: int,
+    count: int,
+    result: ForwardResult,
+    lock: threading.Lock,
+    deadline: float = 0.0,
+    interval: float = 0.0,
+) -> None:
+    # With a deadline count is ignored, with an interval requests (or
+    # pipelined batches) leave on a fixed schedule instead of back to back
+    latency = LatencyHistogram()
+    done = 0
+    errors = 0
+    next_send = time.monotonic()
+    while time.monotonic() < deadline if deadline else done < count:
+        batch = depth if mode == MODE_PIPELINE else 1
+        if not deadline:
+            batch = min(batch, count - done)
+        if interval:
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_send += interval * batch
+        start = time.perf_counter_ns()
+        try:
+            if mode == MODE_PIPELINE:
+                responses = pool.pipeline([("GET", url)] * batch)
+            else:
+                responses = [pool.request("GET", url)]
+        except (OSError, ValueError):
+            errors += batch
+            done += batch
+            continue
+        # Pipelined requests all wait for the batch, that is the trade
+        elapsed = time.perf_counter_ns() - start
+        for response in responses:
+            if response.status != 200 or len(response.body) != body_size:
+                errors += 1
+            latency.record(elapsed)
+        done += batch
+
+    with lock:
+        result.latency.merge(latency)
+        result.requests += done - errors
+        result.errors += errors
+
+
+def measure(
+    proxy: tuple[str, int],
+    url: str,
+    mode: str,
+    workers: int,
+    depth: int,
+    body_size: int,
+    requests: int,
+    proxy_pid: int | None,
+    seconds: float = 0.0,
+    rate: float = 0.0,
+    user: str | None = None,
+    pwd: str | None = None,
+) -> ForwardResult:
+    """Sends requests, or runs for seconds when that is set, across workers.
+
+    rate caps the requests per second of all workers together."""
+    pool = ForwardProxyPool(
+        proxy[0],
+        proxy[1],
+        user,
+        pwd,
+        max_idle=workers,
+        keep_alive=mode != MODE_RECONNECT,
+    )
+    result = ForwardResult(mode=mode, workers=workers, depth=depth if mode == MODE_PIPELINE else 1, body_size=body_size)
+    lock = threading.Lock()
+    share, extra = divmod(requests, workers)
+    interval = workers / rate if rate > 0 else 0.0
+
+    proxy_cpu_start = process_cpu_seconds(proxy_pid) if proxy_pid else None
+    start = time.perf_counter()
+    deadline = time.monotonic() + seconds if seconds > 0 else 0.0
+    threads = [
+        threading.Thread(
+            target=_worker,
+            args=(pool, url, mode, depth, body_size, share + (i < extra), result, lock, deadline, interval),
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result.elapsed_seconds = time.perf_counter() - start
+    pool.close()
+
+    if proxy_cpu_start is not None:
+        proxy_cpu_end = process_cpu_seconds(proxy_pid)
+        if proxy_cpu_end is not None:
+            result.proxy_cpu_seconds = proxy_cpu_end - proxy_cpu_start
+    result.connections = pool.connections_opened
+    result.retries = pool.retries
+    return result
+
+
+def print_results(results: list[ForwardResult]) -> None:
+    print(
+        f"{'MODE':<12}{'WORKERS':>8}{'DEPTH':>7}{'BODY':>9}{'REQ/s':>10}{'REQ/CONN':>10}"
+        f"{'p50':>11}{'p90':>11}{'p99':>11}{'PROXY CPU':>11}{'ERRORS':>8}"
+    )
+    for r in results:
+        summary = r.latency.summary()
+        print(
+            f"{r.mode:<12}{r.workers:>8}{r.depth:>7}{r.body_size:>9}{r.requests_per_second:>10.0f}"
+            f"{r.requests_per_connection:>10.1f}"
+            f"{format_ns(summary['p50']):>11}{format_ns(summary['p90']):>11}{format_ns(summary['p99']):>11}"
+            f"{'-' if r.proxy_cpu_seconds is None else f'{r.proxy_cpu_seconds:.2f}s':>11}{r.errors:>8}"
+        )
+
+    # What keeping connections open buys, at each worker count and body size
+    baseline = {(r.workers, r.body_size): r for r in results if r.mode == MODE_RECONNECT}
+    for r in results:
+        base = baseline.get((r.workers, r.body_size))
+        if r.mode == MODE_RECONNECT or base is None or not base.requests_per_second:
+            continue
+        print(
+            f"  {r.mode} x{r.workers}, {r.body_size} bytes: "
+            f"{r.requests_per_second / base.requests_per_second:.2f}x the requests/s of reconnecting,"
+            f" p50 {format_ns(base.latency.percentile(50))} -> {format_ns(r.latency.percentile(50))}"
+        )
+
+
+def main(args: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark plain HTTP requests through a forward proxy")
+    parser.add_argument("--proxy", metavar="HOST:PORT", help="HTTP proxy to test, default spawns reference_proxy.py")
+    parser.add_argument(
+        "--origin",
+        metavar="HOST:PORT",
+        help="Origin stand-in as seen from the proxy, default starts one on 127.0.0.1",
+    )
+    parser.add_argument(
+        "-m",
+        "--modes",
+        default=f"{MODE_RECONNECT},{MODE_KEEP_ALIVE},{MODE_PIPELINE}",
+        help="Comma separated, from reconnect,keep-alive,pipeline",
+    )
+    parser.add_argument("-w", "--workers", default="1,8", help="Comma separated concurrent client counts")
+    parser.add_argument("-s", "--sizes", default="256,65536", help="Comma separated response body sizes")
+    parser.add_argument("-n", "--requests", type=int, default=2000, help="Requests per run")
+    parser.add_argument("--depth", type=int, default=8, help="Requests in flight per connection when pipelining")
+    parser.add_argument("--chunked", action="store_true", help="Have the origin send chunked bodies")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results here")
+    options = parser.parse_args(args)
+
+    modes = options.modes.split(",")
+    worker_counts = [int(n) for n in options.workers.split(",")]
+    sizes = [int(n) for n in options.sizes.split(",")]
+
+    children: list = []
+    results: list[ForwardResult] = []
+    try:
+        if options.origin:
+            host, _, port = options.origin.rpartition(":")
+            origin = (host, int(port))
+        else:
+            server, origin = start_server(run_origin, "127.0.0.1", socket.SOCK_STREAM)
+            children.append(server)
+
+        proxy_pid: int | None = None
+        if options.proxy:
+            host, _, port = options.proxy.rpartition(":")
+            proxy = (host, int(port))
+        else:
+            proxy_process, proxy = spawn_script("reference_proxy.py")
+            children.append(proxy_process)
+            proxy_pid = proxy_process.pid
+
+        for size in sizes:
+            url = f"http://{origin[0]}:{origin[1]}/{'chunked' if options.chunked else 'bytes'}/{size}"
+            for workers in worker_counts:
+                for mode in modes:
+                    result = measure(proxy, url, mode, workers, options.depth, size, options.requests, proxy_pid)
+                    results.append(result)
+                    print(
+                        f"  {mode} x{workers}, {size} bytes: {result.requests_per_second:.0f} req/s"
+                        f" over {result.connections} connections",
+                        file=sys.stderr,
+                    )
+
+        print_results(results)
+        if options.json:
+            with open(options.json, "w") as f:
+                json.dump([r.to_dict() for r in results], f, indent=2)
+    finally:
+        for child in children:
+            child.terminate()
+            if isinstance(child, multiprocessing.Process):
+                child.join()
+            else:
+                child.wait()
+
+    return 0 if all(r.errors == 0 for r in results) else 1
+
+
+if __name__ == "__main__":
+    exit_code = main(sys.argv[1:])
+    sys.exit(exit_code)
@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+
+# bench_socks5_handshake.py - connection setup time, classic vs pipelined SOCKS5.
+#
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from background import start_in_thread
+from histogram import LatencyHistogram, format_ns
+from impairment import ImpairmentRelay, LinkProfile
+from reference_proxy import ReferenceProxy
+import argparse
+import asyncio
+import socket
+import socks
+import sys
+import time
+
+
+class _AcceptServer:
+    """Destination that accepts and immediately hangs up."""
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> tuple[str, int]:
+        async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            writer.close()
+
+        self._server = await asyncio.start_server(serve, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+
+def measure(
+    proxy: tuple[str, int],
+    target: tuple[str, int],
+    user: str | None,
+    pwd: str | None,
+    pipelined: bool,
+    count: int,
+) -> tuple[LatencyHistogram, int]:
+    latency = LatencyHistogram()
+    errors = 0
+    for _ in range(count):
+        s = socks.socksocket(socket.AF_INET, socket.SOCK_STREAM)
+        s.set_proxy(socks.SOCKS5, proxy[0], proxy[1], True, user, pwd)
+        s.set_socks5_pipelining(pipelined)
+        s.settimeout(10)
+        start = time.monotonic_ns()
+        try:
+            s.connect(target)
+        except (socks.ProxyError, OSError):
+            errors += 1
+            continue
+        else:
+            latency.record(time.monotonic_ns() - start)
+        finally:
+            s.close()
+    return latency, errors
+
+
+def main(args: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark classic against pipelined SOCKS5 connection setup")
+    parser.add_argument("--proxy", metavar="HOST:PORT", help="SOCKS5 proxy, e.g. TetherFi, default runs the reference proxy")
+    parser.add_argument("--target", metavar="HOST:PORT", help="CONNECT destination, required with --proxy")
+    parser.add_argument("--user", help="Username for the --proxy")
+    parser.add_argument("--password", help="Password for the --proxy")
+    parser.add_argument(
+        "--delay-ms",
+        type=float,
+        default=10.0,
+        help="One-way delay added in front of the bundled reference proxy",
+    )
+    parser.add_argument("-n", "--count", type=int, default=200, help="Connections per mode")
+    options = parser.parse_args(args)
+
+    stops = []
+    try:
+        if options.proxy:
+            if not options.target:
+                print("--target is required with --proxy")
+                return 1
+            host, _, port = options.proxy.rpartition(":")
+            modes = [(f"{host}:{port}", (host, int(port)), options.user, options.password)]
+            host, _, port = options.target.rpartition(":")
+            target = (host, int(port))
+        else:
+            target, stop = start_in_thread(_AcceptServer(), name="accept-server")
+            stops.append(stop)
+
+            modes = []
+            for label, user, pwd in (("no auth", None, None), ("user/pass", "tetherfi", "secret")):
+                address, stop = start_in_thread(ReferenceProxy(user, pwd), name="reference-proxy")
+                stops.append(stop)
+                if options.delay_ms > 0:
+                    # Stands in for the Wi-Fi Direct hop, so each round trip
+                    # the handshake makes costs what it would on the link
+                    relay = ImpairmentRelay(address, LinkProfile(delay_ms=options.delay_ms))
+                    address, stop = start_in_thread(relay, name="impairment-relay")
+                    stops.append(stop)
+                modes.append((label, address, user, pwd))
+
+        print(f"SOCKS5 CONNECT setup, {options.count} connections per mode")
+        print(f"  {'PROXY':<22}{'MODE':<11}{'p50':>12}{'p90':>12}{'p99':>12}{'SAVED p50':>12}{'ERRORS':>8}")
+        for label, proxy, user, pwd in modes:
+            classic_p50 = None
+            for pipelined in (False, True):
+                latency, errors = measure(proxy, target, user, pwd, pipelined, options.count)
+                summary = latency.summary()
+                saved = "-"
+                if not pipelined:
+                    classic_p50 = summary["p50"]
+                elif classic_p50 is not None and latency.total:
+                    saved = format_ns(classic_p50 - summary["p50"])
+                print(
+                    f"  {label:<22}{'pipelined' if pipelined else 'classic':<11}"
+                    f"{format_ns(summary['p50']):>12}{format_ns(summary['p90']):>12}"
+                    f"{format_ns(summary['p99']):>12}{saved:>12}{errors:>8}"
+                )
+    finally:
+        for stop in stops:
+            stop.set()
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main(sys.argv[1:])
+    sys.exit(exit_code)
@@ -0,0 +1,323 @@
+#!/usr/bin/python3
+
+# bench_tcp.py - bulk TCP throughput through each proxy protocol.
+#
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from bench_common import (
+    CMD_DOWNLOAD,
+    CMD_UPLOAD,
+    process_cpu_seconds,
+    run_sink_source,
+    spawn_script,
+    start_server,
+)
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from handshake_timing import HandshakeBreakdown
+from struct import pack, unpack
+import argparse
+import json
+import multiprocessing
+import socket
+import socks
+import sys
+import time
+
+_CHUNK: int = 256 * 1024
+_GIGABYTE: int = 1024 * 1024 * 1024
+
+
+@dataclass
+class Protocol:
+    name: str
+    proxy_type: int | None
+    rdns: bool
+    use_hostname: bool
+
+
+PROTOCOLS: dict[str, Protocol] = {
+    "direct": Protocol("direct", None, False, False),
+    "socks4": Protocol("socks4", socks.SOCKS4, False, False),
+    "socks4a": Protocol("socks4a", socks.SOCKS4, True, True),
+    "socks5": Protocol("socks5", socks.SOCKS5, True, True),
+    "http": Protocol("http", socks.HTTP, True, True),
+}
+
+
+@dataclass
+class TransferResult:
+    protocol: str
+    direction: str
+    streams: int
+    total_bytes: int
+    elapsed_seconds: float
+    client_cpu_seconds: float
+    proxy_cpu_seconds: float | None
+    errors: int
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return self.total_bytes / (1024 * 1024) / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    def cpu_per_gigabyte(self, cpu_seconds: float | None) -> float | None:
+        if cpu_seconds is None or not self.total_bytes:
+            return None
+        return cpu_seconds / (self.total_bytes / _GIGABYTE)
+
+
+def _open_stream(
+    protocol: Protocol,
+    target: tuple[str, int],
+    proxy: tuple[str, int],
+) -> socket.socket:
+    host, port = target
+    if protocol.use_hostname and host == "127.0.0.1":
+        # Make the proxy resolve it, which is the point of 4a/5/HTTP
+        host = "localhost"
+
+    s = socks.socksocket(socket.AF_INET, socket.SOCK_STREAM)
+    if protocol.proxy_type is not None:
+        s.set_proxy(protocol.proxy_type, proxy[0], proxy[1], protocol.rdns)
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    s.connect((host, port))
+    return s
+
+
+def _upload(
+    protocol: Protocol,
+    target: tuple[str, int],
+    proxy: tuple[str, int],
+    size: int,
+) -> int:
+    s = _open_stream(protocol, target, proxy)
+    try:
+        s.sendall(CMD_UPLOAD)
+        block = memoryview(bytes(_CHUNK))
+        remaining = size
+        while remaining > 0:
+            sent = s.send(block[:min(remaining, _CHUNK)])
+            remaining -= sent
+        s.shutdown(socket.SHUT_WR)
+
+        ack = b""
+        while len(ack) < 8:
+            data = s.recv(8 - len(ack))
+            if not data:
+                break
+            ack += data
+        return unpack(">Q", ack)[0] if len(ack) == 8 else 0
+    finally:
+        s.close()
+
+
+def _download(
+    protocol: Protocol,
+    target: tuple[str, int],
+    proxy: tuple[str, int],
+    size: int,
+) -> int:
+    s = _open_stream(protocol, target, proxy)
+    try:
+        s.sendall(CMD_DOWNLOAD + pack(">Q", size))
+        buffer = bytearray(_CHUNK)
+        total = 0
+        while total < size:
+            received = s.recv_into(buffer)
+            if not received:
+                break
+            total += received
+        return total
+    finally:
+        s.close()
+
+
+def run_transfer(
+    protocol: Protocol,
+    direction: str,
+    streams: int,
+    bytes_per_stream: int,
+    target: tuple[str, int],
+    proxy: tuple[str, int],
+    proxy_pid: int | None,
+) -> TransferResult:
+    transfer = _upload if direction == "up" else _download
+    errors = 0
+    total = 0
+
+    proxy_cpu_start = process_cpu_seconds(proxy_pid) if proxy_pid else None
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=streams) as executor:
+        futures = [
+            executor.submit(transfer, protocol, target, proxy, bytes_per_stream)
+            for _ in range(streams)
+        ]
+        for future in futures:
+            try:
+                moved = future.result()
+            except (socks.ProxyError, OSError):
+                errors += 1
+                continue
+            total += moved
+            if moved != bytes_per_stream:
+                errors += 1
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    proxy_cpu = None
+    if proxy_cpu_start is not None:
+        proxy_cpu_end = process_cpu_seconds(proxy_pid)
+        if proxy_cpu_end is not None:
+            proxy_cpu = proxy_cpu_end - proxy_cpu_start
+
+    return TransferResult(
+        protocol=protocol.name,
+        direction=direction,
+        streams=streams,
+        total_bytes=total,
+        elapsed_seconds=elapsed,
+        client_cpu_seconds=cpu,
+        proxy_cpu_seconds=proxy_cpu,
+        errors=errors,
+    )
+
+
+def _format_cpu(value: float | None) -> str:
+    return "-" if value is None else f"{value:.2f}s"
+
+
+def print_results(results: list[TransferResult]) -> None:
+    print(
+        f"{'PROTOCOL':<9}{'DIR':<5}{'STREAMS':>8}{'MB/s':>10}"
+        f"{'CLIENT CPU/GB':>15}{'PROXY CPU/GB':>14}{'ERRORS':>8}"
+    )
+    for r in results:
+        print(
+            f"{r.protocol:<9}{r.direction:<5}{r.streams:>8}{r.megabytes_per_second:>10.1f}"
+            f"{_format_cpu(r.cpu_per_gigabyte(r.client_cpu_seconds)):>15}"
+            f"{_format_cpu(r.cpu_per_gigabyte(r.proxy_cpu_seconds)):>14}{r.errors:>8}"
+        )
+
+
+def main(args: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark TCP throughput through each proxy protocol")
+    parser.add_argument("--proxy", metavar="HOST:PORT", help="Proxy to test, default spawns reference_proxy.py")
+    parser.add_argument(
+        "--target",
+        metavar="HOST:PORT",
+        help="Sink/source server as seen from the proxy, default starts one on 127.0.0.1",
+    )
+    parser.add_argument(
+        "-p",
+        "--protocols",
+        default="direct,socks4,socks4a,socks5,http",
+        help=f"Comma separated, from {','.join(PROTOCOLS)}",
+    )
+    parser.add_argument("-s", "--streams", default="1,2,4,8", help="Comma separated parallel stream counts")
+    parser.add_argument("-m", "--megabytes", type=int, default=256, help="Megabytes per run, split across streams")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results here")
+    parser.add_argument("--handshakes", action="store_true", help="Also break down tunnel setup time by phase")
+    parser.add_argument(
+        "--impair",
+        metavar="LINK",
+        help="Reach the proxy through impairment.py with this link, e.g. delay=15,jitter=10,loss=1%%,rate=30000",
+    )
+    options = parser.parse_args(args)
+
+    protocols = [PROTOCOLS[name] for name in options.protocols.split(",")]
+    stream_counts = [int(n) for n in options.streams.split(",")]
+    total_bytes = options.megabytes * 1024 * 1024
+
+    children: list = []
+    results: list[TransferResult] = []
+    try:
+        if options.target:
+            host, _, port = options.target.rpartition(":")
+            target = (host, int(port))
+        else:
+            sink, target = start_server(run_sink_source, "127.0.0.1", socket.SOCK_STREAM)
+            children.append(sink)
+
+        proxy_pid: int | None = None
+        if options.proxy:
+            host, _, port = options.proxy.rpartition(":")
+            proxy = (host, int(port))
+        else:
+            proxy_process, proxy = spawn_script("reference_proxy.py")
+            children.append(proxy_process)
+            proxy_pid = proxy_process.pid
+
+        if options.impair:
+            upstream = proxy
+            relay_process, proxy = spawn_script(
+                "impairment.py", "--upstream", f"{upstream[0]}:{upstream[1]}", "--link", options.impair
+            )
+            children.append(relay_process)
+
+        handshakes = HandshakeBreakdown().install() if options.handshakes else None
+        for protocol in protocols:
+            for direction in ("up", "down"):
+                for streams in stream_counts:
+                    result = run_transfer(
+                        protocol,
+                        direction,
+                        streams,
+                        total_bytes // streams,
+                        target,
+                        proxy,
+                        None if protocol.proxy_type is None else proxy_pid,
+                    )
+                    results.append(result)
+                    print(
+                        f"  {protocol.name} {direction} x{streams}: {result.megabytes_per_second:.1f} MB/s",
+                        file=sys.stderr,
+                    )
+
+        print_results(results)
+        if handshakes is not None:
+            handshakes.uninstall()
+            handshakes.print()
+
+        if options.json:
+            with open(options.json, "w") as f:
+                json.dump(
+                    [
+                        {
+                            **asdict(r),
+                            "megabytes_per_second": r.megabytes_per_second,
+                            "client_cpu_seconds_per_gb": r.cpu_per_gigabyte(r.client_cpu_seconds),
+                            "proxy_cpu_seconds_per_gb": r.cpu_per_gigabyte(r.proxy_cpu_seconds),
+                        }
+                        for r in results
+                    ],
+                    f,
+                    indent=2,
+                )
+    finally:
+        for child in children:
+            child.terminate()
+            if isinstance(child, multiprocessing.Process):
+                child.join()
+            else:
+                child.wait()
+
+    return 0 if all(r.errors == 0 for r in results) else 1
+
+
+if __name__ == "__main__":
+    exit_code = main(sys.argv[1:])
+    sys.exit(exit_code)
@@ -0,0 +1,266 @@
+#!/usr/bin/python3
+
+# bench_udp_frag.py - goodput of large UDP datagrams against SOCKS5 fragment size.
+#
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from bench_common import (
+    CMD_DOWNLOAD,
+    CMD_UPLOAD,
+    MAX_DATAGRAM,
+    UDP_REQUEST_HEADER,
+    run_echo,
+    spawn_script,
+    start_server,
+)
+from dataclasses import asdict, dataclass
+from struct import pack, unpack_from
+import argparse
+import json
+import multiprocessing
+import socket
+import socks
+import sys
+import time
+
+# Room for a full window of the biggest datagrams, so losses are the relay's
+_RCVBUF: int = 4 * 1024 * 1024
+
+
+@dataclass
+class FragmentResult:
+    direction: str
+    payload_size: int
+    fragment_size: int | None
+    fragments: int
+    delivered: int
+    lost: int
+    elapsed_seconds: float
+
+    @property
+    def megabytes_per_second(self) -> float:
+        if not self.elapsed_seconds:
+            return 0.0
+        return self.delivered * self.payload_size / (1024 * 1024) / self.elapsed_seconds
+
+    @property
+    def datagrams_per_second(self) -> float:
+        return self.delivered / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    @property
+    def loss_percent(self) -> float:
+        attempted = self.delivered + self.lost
+        return 100.0 * self.lost / attempted if attempted else 0.0
+
+
+def _fragment_count(payload_size: int, fragment_size: int | None) -> int:
+    if not fragment_size or payload_size <= fragment_size:
+        return 0
+    return -(-payload_size // fragment_size)
+
+
+def measure(
+    proxy: tuple[str, int],
+    target: tuple[str, int],
+    direction: str,
+    payload_size: int,
+    fragment_size: int | None,
+    count: int,
+    window: int,
+    timeout: float,
+) -> FragmentResult:
+    """Moves count datagrams of payload_size bytes, window at a time.
+
+    Anything not answered within timeout counts as lost."""
+    s = socks.socksocket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.set_proxy(socks.SOCKS5, proxy[0], proxy[1], True)
+    if direction == "up":
+        s.set_udp_fragmentation(fragment_size)
+    s.settimeout(timeout)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, _RCVBUF)
+    s.bind(("", 0))
+
+    if direction == "up":
+        body = bytes(payload_size - UDP_REQUEST_HEADER)
+    else:
+        body = pack(">I", payload_size - 8)
+
+    delivered = 0
+    lost = 0
+    sent = 0
+    outstanding: set[int] = set()
+    try:
+        start = time.perf_counter()
+        while delivered + lost < count:
+            while len(outstanding) < window and sent < count:
+                command = CMD_UPLOAD if direction == "up" else CMD_DOWNLOAD
+                s.sendto(command + pack(">Q", sent) + body, target)
+                outstanding.add(sent)
+                sent += 1
+            try:
+                data, _ = s.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                lost += len(outstanding)
+                outstanding.clear()
+                continue
+            if len(data) < 8:
+                continue
+            (seq,) = unpack_from(">Q", data)
+            if seq in outstanding and (direction == "up" or len(data) == payload_size):
+                outstanding.discard(seq)
+                delivered += 1
+        elapsed = time.perf_counter() - start
+    finally:
+        s.close()
+
+    return FragmentResult(
+        direction=direction,
+        payload_size=payload_size,
+        fragment_size=fragment_size,
+        fragments=_fragment_count(payload_size, fragment_size),
+        delivered=delivered,
+        lost=lost,
+        elapsed_seconds=elapsed,
+    )
+
+
+def print_results(results: list[FragmentResult]) -> None:
+    print(f"{'DIR':<5}{'PAYLOAD':>9}{'FRAGMENT':>10}{'FRAGS':>7}{'MB/s':>10}{'DGRAM/s':>10}{'LOSS':>8}")
+    for r in results:
+        fragment = "whole" if not r.fragments else str(r.fragment_size)
+        print(
+            f"{r.direction:<5}{r.payload_size:>9}{fragment:>10}{r.fragments:>7}"
+            f"{r.megabytes_per_second:>10.1f}{r.datagrams_per_second:>10.0f}{r.loss_percent:>7.1f}%"
+        )
+
+
+def _parse_fragment_sizes(value: str) -> list[int | None]:
+    return [None if size == "none" else int(size) for size in value.split(",")]
+
+
+def main(args: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark large UDP datagrams against SOCKS5 fragment size")
+    parser.add_argument(
+        "--proxy",
+        metavar="HOST:PORT",
+        help="SOCKS5 proxy to test, e.g. TetherFi, default spawns reference_proxy.py once per fragment size."
+             " Only uploads are fragmented then, downloads go out the way the proxy sends them",
+    )
+    parser.add_argument(
+        "--target",
+        metavar="HOST:PORT",
+        help="Echo server as seen from the proxy, default starts one on 127.0.0.1",
+    )
+    parser.add_argument("-s", "--sizes", default="8192,32768,60000", help="Comma separated payload sizes")
+    parser.add_argument(
+        "-f",
+        "--fragments",
+        default="none,512,1400,4096,16384",
+        help="Comma separated fragment sizes, none sends every datagram whole",
+    )
+    parser.add_argument("-d", "--directions", default="up,down", help="Comma separated, from up,down")
+    parser.add_argument("-n", "--count", type=int, default=2000, help="Datagrams per run")
+    parser.add_argument("-w", "--window", type=int, default=8, help="Datagrams in flight")
+    parser.add_argument("--timeout", type=float, default=1.0, help="Seconds before outstanding datagrams count as lost")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results here")
+    options = parser.parse_args(args)
+
+    sizes = [int(size) for size in options.sizes.split(",")]
+    fragment_sizes = _parse_fragment_sizes(options.fragments)
+    directions = options.directions.split(",")
+    for size in sizes:
+        if not UDP_REQUEST_HEADER + 4 <= size <= MAX_DATAGRAM - 512:
+            print(f"Payload size {size} leaves no room for the request or the SOCKS5 header")
+            return 1
+
+    children: list = []
+    results: list[FragmentResult] = []
+    try:
+        if options.target:
+            host, _, port = options.target.rpartition(":")
+            target = (host, int(port))
+        else:
+            echo, target = start_server(run_echo, "127.0.0.1", socket.SOCK_DGRAM)
+            children.append(echo)
+
+        for fragment_size in fragment_sizes:
+            proxy_process = None
+            if options.proxy:
+                host, _, port = options.proxy.rpartition(":")
+                proxy = (host, int(port))
+            else:
+                arguments = ["--udp-fragment-size", str(fragment_size)] if fragment_size else []
+                proxy_process, proxy = spawn_script("reference_proxy.py", *arguments)
+                children.append(proxy_process)
+
+            try:
+                for size in sizes:
+                    if _fragment_count(size, fragment_size) > 127:
+                        print(f"  skipping {size} bytes in {fragment_size} byte fragments, over 127", file=sys.stderr)
+                        continue
+                    for direction in directions:
+                        result = measure(
+                            proxy,
+                            target,
+                            direction,
+                            size,
+                            fragment_size,
+                            options.count,
+                            options.window,
+                            options.timeout,
+                        )
+                        results.append(result)
+                        print(
+                            f"  {direction} {size} / {fragment_size or 'whole'}: "
+                            f"{result.megabytes_per_second:.1f} MB/s, {result.loss_percent:.1f}% lost",
+                            file=sys.stderr,
+                        )
+            finally:
+                if proxy_process is not None:
+                    proxy_process.terminate()
+                    proxy_process.wait()
+                    children.remove(proxy_process)
+
+        print_results(results)
+        if options.json:
+            with open(options.json, "w") as f:
+                json.dump(
+                    [
+                        {
+                            **asdict(r),
+                            "megabytes_per_second": r.megabytes_per_second,
+                            "datagrams_per_second": r.datagrams_per_second,
+                            "loss_percent": r.loss_percent,
+                        }
+                        for r in results
+                    ],
+                    f,
+                    indent=2,
+                )
+    finally:
+        for child in children:
+            child.terminate()
+            if isinstance(child, multiprocessing.Process):
+                child.join()
+            else:
+                child.wait()
+
+    return 0 if all(r.lost == 0 for r in results) else 1
+
+
+if __name__ == "__main__":
+    exit_code = main(sys.argv[1:])
+    sys.exit(exit_code)
@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+
+# bench_udp_send.py - packets per second through socksocket's UDP send paths.
+#
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from bench_common import spawn_script
+from collections.abc import Callable
+from io import BytesIO
+import argparse
+import socket
+import socks
+import subprocess
+import sys
+import time
+
+
+def _legacy_sendto(s: socks.socksocket, payload: bytes, address: tuple[str, int]) -> int:
+    # What socksocket.sendto did before headers were cached: a fresh BytesIO,
+    # address encoding and a concatenated copy of the payload for every packet
+    if s.type != socket.SOCK_DGRAM:
+        raise ValueError("Not a UDP socket")
+    if not s._proxyconn:
+        s.bind(("", 0))
+
+    header = BytesIO()
+    header.write(b"\x00\x00")
+    header.write(b"\x00")
+    s._write_SOCKS5_address(address, header)
+    sent = socket.socket.send(s, header.getvalue() + payload)
+    return sent - header.tell()
+
+
+def _run(
+    name: str,
+    send: Callable[[list[tuple[bytes, tuple[str, int]]]], None],
+    datagrams: list[tuple[bytes, tuple[str, int]]],
+    rounds: int,
+) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        send(datagrams)
+    elapsed = time.perf_counter() - start
+
+    packets = len(datagrams) * rounds
+    pps = packets / elapsed
+    print(f"  {name:<14} {packets} packets in {elapsed:.3f}s = {pps:,.0f} pps")
+    return pps
+
+
+def bench(
+    proxy_server_host: str,
+    proxy_server_port: int,
+    count: int,
+    size: int,
+    destinations: int,
+) -> None:
+    s = socks.socksocket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.set_proxy(socks.SOCKS5, proxy_server_host, proxy_server_port, True)
+    s.bind(("", 0))
+
+    # Nothing listens on the discard port, the relay just forwards into the
+    # void. Half the destinations are names, which the proxy resolves.
+    payload = bytes(size)
+    addresses = [
+        (f"127.0.{i // 250}.{i % 250 + 1}", 9) if i % 2 else (f"dest-{i}.invalid", 9)
+        for i in range(destinations)
+    ]
+    datagrams = [(payload, addresses[i % destinations]) for i in range(min(count, 1000))]
+    rounds = max(1, count // len(datagrams))
+
+    print(f"UDP SEND: {size} byte payloads to {destinations} destinations")
+    try:
+        legacy = _run(
+            "legacy",
+            lambda batch: [_legacy_sendto(s, p, a) for p, a in batch],
+            datagrams,
+            rounds,
+        )
+        cached = _run(
+            "cached sendto",
+            lambda batch: [s.sendto(p, a) for p, a in batch],
+            datagrams,
+            rounds,
+        )
+        batched = _run("sendto_many", s.sendto_many, datagrams, rounds)
+        print(f"  gain: sendto x{cached / legacy:.2f}, sendto_many x{batched / legacy:.2f}")
+    finally:
+        s.close()
+
+
+def main(args: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark socksocket UDP send paths")
+    parser.add_argument("--proxy", metavar="HOST:PORT", help="SOCKS5 proxy, default spawns reference_proxy.py")
+    parser.add_argument("-n", "--count", type=int, default=200_000, help="Datagrams per path")
+    parser.add_argument("-s", "--size", type=int, default=512, help="Payload size in bytes")
+    parser.add_argument("-d", "--destinations", type=int, default=16, help="Distinct destinations")
+    options = parser.parse_args(args)
+
+    proxy_process: subprocess.Popen | None = None
+    if options.proxy:
+        host, _, port = options.proxy.rpartition(":")
+        proxy_server_host, proxy_server_port = host, int(port)
+    else:
+        proxy_process, (proxy_server_host, proxy_server_port) = spawn_script("reference_proxy.py")
+
+    try:
+        bench(
+            proxy_server_host,
+            proxy_server_port,
+            options.count,
+            options.size,
+            options.destinations,
+        )
+    finally:
+        if proxy_process:
+            proxy_process.terminate()
+            proxy_process.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main(sys.argv[1:])
+    sys.exit(exit_code)
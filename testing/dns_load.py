@@ -0,0 +1,294 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from dns_store import ResponsePairs
+from dns_wire import DNSParseError, build_dns_request, parse_dns_response
+from histogram import LatencyHistogram
+from socks_asyncio import SOCKS5UDPAssociation, open_udp_association
+import asyncio
+import itertools
+import socket
+import time
+
+
+class DnsClient:
+    """Matches DNS replies to in-flight queries by transaction ID."""
+
+    def __init__(self):
+        self._pending: dict[int, asyncio.Future] = {}
+        self._ids = itertools.cycle(range(1, 0x10000))
+
+    def next_transaction_id(self) -> int:
+        # Never hand out an ID that is still waiting on a reply
+        for _ in range(0xFFFF):
+            transaction_id = next(self._ids)
+            if transaction_id not in self._pending:
+                return transaction_id
+        raise RuntimeError("All DNS transaction IDs are in flight")
+
+    def _send(self, request: bytes) -> None:
+        raise NotImplementedError
+
+    def _on_response(self, resp: bytes) -> None:
+        if len(resp) < 2:
+            return
+        future = self._pending.pop(int.from_bytes(resp[:2], "big"), None)
+        if future and not future.done():
+            future.set_result(resp)
+
+    async def query(self, request: bytes, timeout: float) -> bytes:
+        transaction_id = int.from_bytes(request[:2], "big")
+        future = asyncio.get_running_loop().create_future()
+        self._pending[transaction_id] = future
+        try:
+            self._send(request)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if self._pending.get(transaction_id) is future:
+                del self._pending[transaction_id]
+
+    def close(self) -> None:
+        pass
+
+
+class _DirectProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, client: DirectDnsClient):
+        self._client = client
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        self._client._on_response(data)
+
+
+class DirectDnsClient(DnsClient):
+    """Queries the DNS server straight from this machine, no proxy."""
+
+    def __init__(self):
+        super().__init__()
+        self._transport: asyncio.DatagramTransport | None = None
+
+    async def open(self, remote_host: str, remote_port: int) -> DirectDnsClient:
+        self._transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: _DirectProtocol(self),
+            remote_addr=(remote_host, remote_port),
+            family=socket.AF_INET,
+        )
+        return self
+
+    def _send(self, request: bytes) -> None:
+        self._transport.sendto(request)
+
+    def close(self) -> None:
+        if self._transport:
+            self._transport.close()
+
+
+class ProxiedDnsClient(DnsClient):
+    """Queries the DNS server through a SOCKS5 UDP association."""
+
+    def __init__(self, remote_host: str, remote_port: int):
+        super().__init__()
+        self._remote = (remote_host, remote_port)
+        self._association: SOCKS5UDPAssociation | None = None
+
+    async def open(
+        self,
+        proxy_server_host: str,
+        proxy_server_port: int,
+        user: str | None = None,
+        pwd: str | None = None,
+    ) -> ProxiedDnsClient:
+        self._association = await open_udp_association(
+            proxy_host=proxy_server_host,
+            proxy_port=proxy_server_port,
+            user=user,
+            pwd=pwd,
+            on_datagram=lambda data, _: self._on_response(data),
+        )
+        return self
+
+    def _send(self, request: bytes) -> None:
+        self._association.sendto(request, self._remote)
+
+    def close(self) -> None:
+        if self._association:
+            self._association.close()
+
+
+@dataclass
+class PathStats:
+    sent: int = 0
+    answered: int = 0
+    timeouts: int = 0
+    errors: int = 0
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+    @property
+    def failed(self) -> int:
+        return self.timeouts + self.errors
+
+
+@dataclass
+class LoadReport:
+    concurrency: int
+    elapsed_seconds: float = 0.0
+    direct: PathStats = field(default_factory=PathStats)
+    proxy: PathStats = field(default_factory=PathStats)
+    pairs: ResponsePairs | None = None
+
+    def qps(self, stats: PathStats) -> float:
+        if self.elapsed_seconds <= 0:
+            return 0.0
+        return stats.answered / self.elapsed_seconds
+
+    def print(self) -> None:
+        print(f"LOAD: concurrency={self.concurrency} elapsed={self.elapsed_seconds:.3f}s")
+        for name, stats in (("DIRECT", self.direct), ("PROXY", self.proxy)):
+            print(
+                f"  {name:<6} sent={stats.sent} answered={stats.answered} "
+                f"timeouts={stats.timeouts} errors={stats.errors} "
+                f"qps={self.qps(stats):.1f}"
+            )
+
+
+async def _timed_query(
+    client: DnsClient,
+    stats: PathStats,
+    domain_name: str,
+    timeout: float,
+) -> bytes | None:
+    request = build_dns_request(client.next_transaction_id(), domain_name)
+    stats.sent += 1
+    start = time.monotonic_ns()
+    try:
+        resp = await client.query(request, timeout)
+    except asyncio.TimeoutError:
+        stats.timeouts += 1
+        return None
+    except (OSError, ConnectionError):
+        stats.errors += 1
+        return None
+
+    # Anything other than NOERROR counts against the path
+    if len(resp) < 12 or resp[3] & 0x0F != 0:
+        stats.errors += 1
+        return None
+
+    stats.answered += 1
+    stats.latency.record(time.monotonic_ns() - start)
+    return resp
+
+
+async def run_load(
+    domains: list[str],
+    queries: int,
+    concurrency: int,
+    remote_host: str,
+    remote_port: int,
+    proxy_server_host: str,
+    proxy_server_port: int,
+    user: str | None = None,
+    pwd: str | None = None,
+    timeout: float = 2.0,
+    compare: bool = False,
+    rate: float = 0.0,
+    progress: Callable[[LoadReport], None] | None = None,
+    progress_interval: float = 1.0,
+    duration: float = 0.0,
+) -> LoadReport:
+    """Sends queries through both paths and reports how each one did.
+
+    At most concurrency queries are in flight per path. With a rate they
+    are also spread out to that many per second, otherwise each worker
+    sends the next one as soon as its last one finished. progress, if
+    given, is called with the report so far every progress_interval
+    seconds. A duration in seconds runs until that much time has passed
+    instead of stopping after queries."""
+    report = LoadReport(concurrency=concurrency)
+    if compare:
+        report.pairs = ResponsePairs()
+
+    direct = await DirectDnsClient().open(remote_host, remote_port)
+    proxy = await ProxiedDnsClient(remote_host, remote_port).open(
+        proxy_server_host,
+        proxy_server_port,
+        user,
+        pwd,
+    )
+
+    names = itertools.cycle(domains)
+    remaining = queries
+    issued = 0
+    start = time.monotonic()
+    deadline = start + duration
+
+    def more() -> bool:
+        if duration > 0:
+            return time.monotonic() < deadline
+        return remaining > 0
+
+    async def worker() -> None:
+        nonlocal remaining, issued
+        while more():
+            remaining -= 1
+            domain_name = next(names)
+
+            if rate > 0:
+                # Open loop: every query has its own slot on the schedule
+                due = start + issued / rate
+                issued += 1
+                delay = due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            # Fire both paths at the same time so they see the same conditions
+            direct_resp, proxy_resp = await asyncio.gather(
+                _timed_query(direct, report.direct, domain_name, timeout),
+                _timed_query(proxy, report.proxy, domain_name, timeout),
+            )
+
+            if report.pairs is not None and direct_resp and proxy_resp:
+                try:
+                    direct_response = parse_dns_response(direct_resp)
+                    proxy_response = parse_dns_response(proxy_resp)
+                except DNSParseError:
+                    report.proxy.errors += 1
+                    continue
+
+                # Each path numbers its own queries, only the answers matter
+                proxy_response.transaction_id = direct_response.transaction_id
+                report.pairs.append(direct_response, proxy_response)
+
+    async def report_progress() -> None:
+        while True:
+            await asyncio.sleep(progress_interval)
+            report.elapsed_seconds = time.monotonic() - start
+            progress(report)
+
+    reporter = asyncio.create_task(report_progress()) if progress else None
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    finally:
+        report.elapsed_seconds = time.monotonic() - start
+        if reporter:
+            reporter.cancel()
+        direct.close()
+        proxy.close()
+
+    return report
@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from dns_load import LoadReport, PathStats, run_load
+from histogram import LatencyHistogram
+from multiprocessing.shared_memory import SharedMemory
+import asyncio
+import multiprocessing
+import time
+
+# Every worker owns one slot of the shared block: its elapsed nanoseconds,
+# the counters of each path, then each path's histogram
+_COUNTERS: tuple[str, ...] = ("sent", "answered", "timeouts", "errors")
+_HEADER_WORDS: int = 1 + 2 * len(_COUNTERS)
+_HISTOGRAM_WORDS: int = LatencyHistogram().word_count
+SLOT_WORDS: int = _HEADER_WORDS + 2 * _HISTOGRAM_WORDS
+
+
+def _paths(report: LoadReport) -> tuple[PathStats, PathStats]:
+    return report.direct, report.proxy
+
+
+def _publish(words: memoryview, report: LoadReport) -> None:
+    words[0] = int(report.elapsed_seconds * 1_000_000_000)
+    index = 1
+    for stats in _paths(report):
+        for name in _COUNTERS:
+            words[index] = getattr(stats, name)
+            index += 1
+
+    offset = _HEADER_WORDS
+    for stats in _paths(report):
+        stats.latency.write_words(words[offset:offset + _HISTOGRAM_WORDS])
+        offset += _HISTOGRAM_WORDS
+
+
+def _collect(words: memoryview, report: LoadReport) -> None:
+    # Workers run side by side, so the slowest one sets the elapsed time
+    report.elapsed_seconds = max(report.elapsed_seconds, words[0] / 1_000_000_000)
+    index = 1
+    for stats in _paths(report):
+        for name in _COUNTERS:
+            setattr(stats, name, getattr(stats, name) + words[index])
+            index += 1
+
+    offset = _HEADER_WORDS
+    for stats in _paths(report):
+        stats.latency.merge_words(words[offset:offset + _HISTOGRAM_WORDS])
+        offset += _HISTOGRAM_WORDS
+
+
+def _worker(index: int, shm_name: str, load_args: dict) -> None:
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
+    # Spawned workers share the parent's resource tracker, which unlinks the
+    # block once the parent is done with it
+    shm = SharedMemory(name=shm_name)
+    words = shm.buf.cast("Q")
+    slot = words[index * SLOT_WORDS:(index + 1) * SLOT_WORDS]
+    try:
+        report = asyncio.run(run_load(**load_args, progress=lambda r: _publish(slot, r)))
+        _publish(slot, report)
+    finally:
+        slot.release()
+        words.release()
+        shm.close()
+
+
+def run_multi_load(
+    processes: int,
+    domains: list[str],
+    queries: int,
+    concurrency: int,
+    remote_host: str,
+    remote_port: int,
+    proxy_server_host: str,
+    proxy_server_port: int,
+    user: str | None = None,
+    pwd: str | None = None,
+    timeout: float = 2.0,
+    rate: float = 0.0,
+) -> LoadReport:
+    """Runs run_load() in several processes and merges their reports.
+
+    Every worker gets its own event loop, UDP association and 1/processes
+    of the queries and rate, so one host can push far more than a single
+    GIL allows. Counters and histograms come back through one shared
+    memory block. concurrency is per worker."""
+    context = multiprocessing.get_context("spawn")
+    shm = SharedMemory(create=True, size=8 * SLOT_WORDS * processes)
+    try:
+        workers = []
+        share, extra = divmod(queries, processes)
+        for index in range(processes):
+            load_args = dict(
+                domains=domains,
+                queries=share + (1 if index < extra else 0),
+                concurrency=concurrency,
+                remote_host=remote_host,
+                remote_port=remote_port,
+                proxy_server_host=proxy_server_host,
+                proxy_server_port=proxy_server_port,
+                user=user,
+                pwd=pwd,
+                timeout=timeout,
+                rate=rate / processes,
+            )
+            worker = context.Process(
+                target=_worker,
+                args=(index, shm.name, load_args),
+                name=f"dns-load-{index}",
+                daemon=True,
+            )
+            worker.start()
+            workers.append(worker)
+
+        start = time.monotonic()
+        for worker in workers:
+            worker.join()
+
+        report = LoadReport(concurrency=concurrency * processes)
+        words = shm.buf.cast("Q")
+        try:
+            for index, worker in enumerate(workers):
+                if worker.exitcode != 0:
+                    print(f"WARNING: load worker {index} exited with {worker.exitcode}")
+                _collect(words[index * SLOT_WORDS:(index + 1) * SLOT_WORDS], report)
+        finally:
+            words.release()
+
+        if not report.elapsed_seconds:
+            report.elapsed_seconds = time.monotonic() - start
+        return report
+    finally:
+        shm.close()
+        shm.unlink()
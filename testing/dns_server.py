@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+
+# dns_server.py - deterministic stand-in DNS server for offline benchmarks.
+#
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from dataclasses import dataclass
+from dns_wire import parse_dns_question
+from struct import pack, unpack
+from struct import error as StructError
+import argparse
+import asyncio
+import hashlib
+
+TYPE_A: int = 1
+TYPE_AAAA: int = 28
+CLASS_IN: int = 1
+
+RCODE_FORMERR: int = 1
+RCODE_NOTIMP: int = 4
+
+# Every answer points back at the name in the question, which always starts
+# right after the 12 byte header
+_NAME_POINTER: bytes = b"\xc0\x0c"
+
+
+@dataclass
+class DnsServerConfig:
+    answer_count: int = 6
+    ttl: int = 300
+    delay_ms: float = 0.0
+
+
+def _answer_addresses(name: str, qtype: int, count: int) -> list[bytes]:
+    # Addresses are derived from the name so every run, and both the direct and
+    # proxied path, get the same answer. IPv4 answers come from the 198.18.0.0/15
+    # benchmarking range (RFC 2544), IPv6 from 2001:db8::/32 (RFC 3849).
+    digest = hashlib.sha256(name.lower().encode("utf-8")).digest()
+    addresses: list[bytes] = []
+    for index in range(min(count, 255)):
+        if qtype == TYPE_A:
+            addresses.append(bytes([198, 18 + (digest[0] & 1), digest[1], index + 1]))
+        else:
+            addresses.append(b"\x20\x01\x0d\xb8" + digest[2:12] + pack(">H", index + 1))
+    return addresses
+
+
+def build_dns_reply(request: bytes, config: DnsServerConfig) -> bytes:
+    try:
+        transaction_id, flags, name, qtype, qclass, end = parse_dns_question(request)
+    except (ValueError, IndexError, UnicodeDecodeError, StructError):
+        # Just enough to echo the transaction ID back with FORMERR
+        transaction_id = unpack(">H", request[:2])[0] if len(request) >= 2 else 0
+        return pack(">HHHHHH", transaction_id, 0x8000 | RCODE_FORMERR, 0, 0, 0, 0)
+
+    # QR=1, keep opcode and RD from the request, RA=1
+    reply_flags = 0x8080 | (flags & 0x7900)
+    question = request[12:end]
+
+    opcode = (flags >> 11) & 0xF
+    if opcode != 0:
+        return pack(">HHHHHH", transaction_id, reply_flags | RCODE_NOTIMP, 1, 0, 0, 0) + question
+
+    answers: list[bytes] = []
+    if qclass == CLASS_IN and qtype in (TYPE_A, TYPE_AAAA):
+        for address in _answer_addresses(name, qtype, config.answer_count):
+            answers.append(
+                _NAME_POINTER
+                + pack(">HHIH", qtype, CLASS_IN, config.ttl, len(address))
+                + address
+            )
+
+    header = pack(">HHHHHH", transaction_id, reply_flags, 1, len(answers), 0, 0)
+    return header + question + b"".join(answers)
+
+
+class _UdpDnsProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, config: DnsServerConfig):
+        self._config = config
+        self._transport: asyncio.DatagramTransport | None = None
+        self._loop = asyncio.get_running_loop()
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self._transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        reply = build_dns_reply(data, self._config)
+        if self._config.delay_ms > 0:
+            self._loop.call_later(self._config.delay_ms / 1000.0, self._reply, reply, addr)
+        else:
+            self._reply(reply, addr)
+
+    def _reply(self, reply: bytes, addr: tuple) -> None:
+        if not self._transport.is_closing():
+            self._transport.sendto(reply, addr)
+
+
+async def _serve_tcp_client(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    config: DnsServerConfig,
+) -> None:
+    # DNS over TCP: every message carries a two byte length prefix
+    try:
+        while True:
+            (length,) = unpack(">H", await reader.readexactly(2))
+            reply = build_dns_reply(await reader.readexactly(length), config)
+            if config.delay_ms > 0:
+                await asyncio.sleep(config.delay_ms / 1000.0)
+            writer.write(pack(">H", len(reply)) + reply)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+class DnsServer:
+    """UDP and TCP DNS responder with deterministic A/AAAA answers."""
+
+    def __init__(self, config: DnsServerConfig | None = None):
+        self.config = config or DnsServerConfig()
+        self.address: tuple[str, int] | None = None
+        self._udp: asyncio.DatagramTransport | None = None
+        self._tcp: asyncio.Server | None = None
+        self._clients: set[asyncio.StreamWriter] = set()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> tuple[str, int]:
+        loop = asyncio.get_running_loop()
+        self._udp, _ = await loop.create_datagram_endpoint(
+            lambda: _UdpDnsProtocol(self.config),
+            local_addr=(host, port),
+        )
+
+        # TCP shares whatever port the kernel gave UDP
+        host, port = self._udp.get_extra_info("sockname")[:2]
+        self._tcp = await asyncio.start_server(self._serve_tcp, host, port)
+        self.address = (host, port)
+        return self.address
+
+    async def _serve_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._clients.add(writer)
+        try:
+            await _serve_tcp_client(reader, writer, self.config)
+        finally:
+            self._clients.discard(writer)
+
+    async def stop(self) -> None:
+        if self._udp:
+            self._udp.close()
+        if self._tcp:
+            self._tcp.close()
+            # Since Python 3.12.1 wait_closed() also waits for every client
+            # connection, so they have to be closed before it
+            for writer in list(self._clients):
+                writer.close()
+            await self._tcp.wait_closed()
+
+
+async def _serve_forever(options: argparse.Namespace) -> None:
+    server = DnsServer(DnsServerConfig(
+        answer_count=options.answers,
+        ttl=options.ttl,
+        delay_ms=options.delay_ms,
+    ))
+    host, port = await server.start(options.host, options.port)
+    print(f"DNS server listening on {host}:{port} (udp+tcp)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main(args: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Deterministic stand-in DNS server")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=0, help="UDP and TCP port, 0 for any free one")
+    parser.add_argument("--answers", type=int, default=6, help="Answers per A/AAAA reply")
+    parser.add_argument("--ttl", type=int, default=300, help="TTL of every answer")
+    parser.add_argument("--delay-ms", type=float, default=0.0, help="Delay before each reply")
+    options = parser.parse_args(args)
+
+    try:
+        asyncio.run(_serve_forever(options))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+
+    exit_code = main(sys.argv[1:])
+    sys.exit(exit_code)
@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from array import array
+from collections import Counter
+from dataclasses import dataclass, field
+from dns_wire import DNSResponse, DNSResult
+
+# Most overnight runs only ever see a few thousand distinct answers, so the
+# stores keep ids into shared tables instead of a string per record
+_NO_ANSWER_SET: int = 0
+
+
+def _pack_flags(response: DNSResponse) -> int:
+    return (
+        response.query_or_response << 15
+        | response.opcode << 11
+        | response.authoritative_answer_bit << 10
+        | response.truncation_bit << 9
+        | response.recursion_desired_bit << 8
+        | response.recursion_available_bit << 7
+        | response.response_code
+    )
+
+
+class ResponseStore:
+    """Column store for millions of DNS responses.
+
+    Header fields and record fields each live in their own array, and
+    addresses are interned once into a shared table. Every response also gets
+    an id for its unordered set of (address, type, class) answers, so two
+    stores can be compared a response at a time without touching records."""
+
+    __slots__ = (
+        "transaction_ids",
+        "flags",
+        "question_counts",
+        "answer_counts",
+        "authority_counts",
+        "additional_counts",
+        "answer_sets",
+        "record_starts",
+        "types",
+        "classes",
+        "ttls",
+        "address_ids",
+        "addresses",
+        "_address_index",
+        "_answer_set_index",
+    )
+
+    def __init__(
+        self,
+        addresses: list[str] | None = None,
+        address_index: dict[str, int] | None = None,
+        answer_set_index: dict[frozenset, int] | None = None,
+    ):
+        self.transaction_ids = array("H")
+        self.flags = array("H")
+        self.question_counts = array("H")
+        self.answer_counts = array("H")
+        self.authority_counts = array("H")
+        self.additional_counts = array("H")
+        self.answer_sets = array("I")
+
+        # Records of response i are record_starts[i] up to record_starts[i + 1]
+        self.record_starts = array("I", [0])
+        self.types = array("H")
+        self.classes = array("H")
+        self.ttls = array("I")
+        self.address_ids = array("I")
+
+        # Two stores that will be diffed must share these tables so equal
+        # answers get equal ids
+        self.addresses = addresses if addresses is not None else []
+        self._address_index = address_index if address_index is not None else {}
+        self._answer_set_index = answer_set_index if answer_set_index is not None else {}
+
+    def sibling(self) -> ResponseStore:
+        """An empty store sharing this one's address and answer set tables."""
+        return ResponseStore(self.addresses, self._address_index, self._answer_set_index)
+
+    def __len__(self) -> int:
+        return len(self.transaction_ids)
+
+    def _address_id(self, address: str) -> int:
+        address_id = self._address_index.get(address)
+        if address_id is None:
+            address_id = len(self.addresses)
+            self.addresses.append(address)
+            self._address_index[address] = address_id
+        return address_id
+
+    def append(self, response: DNSResponse) -> int:
+        self.transaction_ids.append(response.transaction_id)
+        self.flags.append(_pack_flags(response))
+        self.question_counts.append(response.question_count)
+        self.answer_counts.append(response.answer_count)
+        self.authority_counts.append(response.authority_count)
+        self.additional_counts.append(response.additional_count)
+
+        answers: list[tuple[int, int, int]] = []
+        for result in response.results:
+            address_id = self._address_id(result.address)
+            self.types.append(result.dns_type)
+            self.classes.append(result.dns_class)
+            self.ttls.append(result.ttl)
+            self.address_ids.append(address_id)
+            answers.append((address_id, result.dns_type, result.dns_class))
+        self.record_starts.append(len(self.types))
+
+        if answers:
+            key = frozenset(answers)
+            answer_set = self._answer_set_index.get(key)
+            if answer_set is None:
+                answer_set = len(self._answer_set_index) + 1
+                self._answer_set_index[key] = answer_set
+        else:
+            answer_set = _NO_ANSWER_SET
+        self.answer_sets.append(answer_set)
+
+        return len(self.transaction_ids) - 1
+
+    def response(self, index: int) -> DNSResponse:
+        """Rebuilds the full response, only needed to explain a mismatch."""
+        flags = self.flags[index]
+        start, end = self.record_starts[index], self.record_starts[index + 1]
+        return DNSResponse(
+            transaction_id=self.transaction_ids[index],
+            query_or_response=(flags >> 15) & 0x1,
+            opcode=(flags >> 11) & 0xF,
+            truncation_bit=(flags >> 9) & 0x1,
+            authoritative_answer_bit=(flags >> 10) & 0x1,
+            recursion_desired_bit=(flags >> 8) & 0x1,
+            recursion_available_bit=(flags >> 7) & 0x1,
+            response_code=flags & 0xF,
+            question_count=self.question_counts[index],
+            answer_count=self.answer_counts[index],
+            authority_count=self.authority_counts[index],
+            additional_count=self.additional_counts[index],
+            results=[
+                DNSResult(
+                    self.types[i],
+                    self.classes[i],
+                    self.ttls[i],
+                    self.addresses[self.address_ids[i]],
+                )
+                for i in range(start, end)
+            ],
+        )
+
+
+@dataclass
+class StoreDiff:
+    compared: int = 0
+    mismatched: int = 0
+    fields: Counter = field(default_factory=Counter)
+    samples: list[tuple[int, list[str]]] = field(default_factory=list)
+
+    def print(self) -> None:
+        print(f"DIFF: {self.mismatched} of {self.compared} response pairs differ")
+        for name, count in self.fields.most_common():
+            print(f"  {name}: {count}")
+        for index, mismatched_fields in self.samples:
+            print(f"  #{index}: {mismatched_fields}")
+
+
+class ResponsePairs:
+    """Direct and proxied responses stored side by side, pair i in slot i."""
+
+    __slots__ = ("direct", "proxy")
+
+    def __init__(self):
+        self.direct = ResponseStore()
+        self.proxy = self.direct.sibling()
+
+    def __len__(self) -> int:
+        return len(self.direct)
+
+    def append(self, direct: DNSResponse, proxy: DNSResponse) -> None:
+        self.direct.append(direct)
+        self.proxy.append(proxy)
+
+    def diff(self, max_samples: int = 10) -> StoreDiff:
+        """Compares every pair, only rebuilding the ones that differ."""
+        direct = self.direct
+        proxy = self.proxy
+        result = StoreDiff(compared=len(direct))
+
+        # Whole columns at once, the same test DNSResponse.matches() makes
+        # ignoring TTLs and answer order
+        columns = (
+            (direct.transaction_ids, proxy.transaction_ids),
+            (direct.flags, proxy.flags),
+            (direct.question_counts, proxy.question_counts),
+            (direct.answer_counts, proxy.answer_counts),
+            (direct.authority_counts, proxy.authority_counts),
+            (direct.additional_counts, proxy.additional_counts),
+            (direct.answer_sets, proxy.answer_sets),
+        )
+        differing: set[int] = set()
+        for left, right in columns:
+            if left != right:
+                differing.update(i for i, (a, b) in enumerate(zip(left, right)) if a != b)
+
+        for index in sorted(differing):
+            mismatched_fields = direct.response(index).matches(proxy.response(index))
+            if not mismatched_fields:
+                # Same answers, duplicated differently
+                continue
+            result.mismatched += 1
+            result.fields.update(name.split(":")[0].split(" ")[0] for name in mismatched_fields)
+            if len(result.samples) < max_samples:
+                result.samples.append((index, mismatched_fields))
+        return result
@@ -0,0 +1,429 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2025 pyamsoft
+# 
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from struct import Struct, pack, unpack_from
+from struct import error as StructError
+import gc
+import socket
+
+@dataclass(slots=True)
+class DNSResult:
+    dns_type: int
+    dns_class: int
+    ttl: int
+    address: str
+
+
+@dataclass(slots=True)
+class DNSResponse:
+    transaction_id: int
+    query_or_response: int
+    opcode: int
+    truncation_bit: int
+    authoritative_answer_bit: int
+    recursion_desired_bit: int
+    recursion_available_bit: int
+    response_code: int
+    question_count: int
+    answer_count: int
+    authority_count: int
+    additional_count: int
+    results: list[DNSResult]
+    authorities: list[DNSResult] = field(default_factory=list)
+
+    def matches(self, other: DNSResponse) -> list[str]:
+        mismatched: list[str] = []
+
+        if self.transaction_id != other.transaction_id:
+            mismatched.append("transaction_id")
+        if self.query_or_response != other.query_or_response:
+            mismatched.append("query_or_response")
+        if self.opcode != other.opcode:
+            mismatched.append("opcode")
+        if self.truncation_bit != other.truncation_bit:
+            mismatched.append("truncation_bit")
+        if self.authoritative_answer_bit != other.authoritative_answer_bit:
+            mismatched.append("authoritative_answer_bit")
+        if self.recursion_desired_bit != other.recursion_desired_bit:
+            mismatched.append("recursion_desired_bit")
+        if self.recursion_available_bit != other.recursion_available_bit:
+            mismatched.append("recursion_available_bit")
+        if self.response_code != other.response_code:
+            mismatched.append("response_code")
+        if self.question_count != other.question_count:
+            mismatched.append("question_count")
+        if self.answer_count != other.answer_count:
+            mismatched.append("answer_count")
+        if self.authority_count != other.authority_count:
+            mismatched.append("authority_count")
+        if self.additional_count != other.additional_count:
+            mismatched.append("additional_count")
+
+        if len(self.results) != len(other.results):
+            mismatched.append("len(results)")
+
+        # Index the other side by address once instead of scanning it for every
+        # result. The first result wins on duplicates, as the old scan did.
+        by_address: dict[str, DNSResult] = {}
+        for res_2 in other.results:
+            by_address.setdefault(res_2.address, res_2)
+
+        for res_1 in self.results:
+            matched = by_address.get(res_1.address)
+            if not matched:
+                mismatched.append(f"Address: {res_1.address}")
+            else:
+                if res_1.dns_class != matched.dns_class:
+                    mismatched.append(f"dns_class: {res_1.address}")
+                if res_1.dns_type != matched.dns_type:
+                    mismatched.append(f"dns_type {res_1.address}")
+
+        return mismatched
+
+def encode_domain_name(domain: str) -> bytes:
+    parts: list[str] = domain.split(".")
+    encoded_name: bytes = b""
+
+    for part in parts:
+        encoded_name += bytes([len(part)]) + part.encode("utf-8")
+    encoded_name += b"\0"
+    return encoded_name
+
+def build_dns_request(transaction_id: int, domain_name: str) -> bytes:
+    # Standard DNS request
+    # 1) AA bit - set to 0, we are a request not an answer
+    # 2) TC - truncation, set to 0
+    # 3) RD bit - recursion bit, yes we want to look up all known DNS servers until a match is found
+    # 4) RA bit - recursion available, we are not a server, set to 0
+    flags: int = 0x0100
+
+    # One question, what is the IP of the domain_name
+    num_questions: int = 1
+
+    # No answers
+    num_answers: int = 0
+
+    # No authority records
+    num_authority_records: int = 0
+
+    # No additional records
+    num_additional_records: int = 0
+
+    # Pack the header as bytes
+    header = pack(
+        ">HHHHHH",
+        transaction_id,
+        flags,
+        num_questions,
+        num_answers,
+        num_authority_records,
+        num_additional_records,
+    )
+
+    # A record
+    query_type: int = 1
+
+    # Class IN
+    query_class: int = 1
+
+    question = pack(
+        ">HH",
+        query_type,
+        query_class,
+    )
+
+    encoded_domain = encode_domain_name(domain_name)
+
+    return header + encoded_domain + question
+
+def parse_dns_question(request: bytes) -> tuple[int, int, str, int, int, int]:
+    # Returns (transaction_id, flags, name, qtype, qclass, offset past the question)
+    transaction_id, flags, question_count = unpack_from(">HHH", request, 0)
+    if question_count < 1:
+        raise ValueError("DNS request has no question")
+
+    labels: list[str] = []
+    offset = 12
+    length = request[offset]
+    while length != 0:
+        if length & 0xC0:
+            raise ValueError("Compressed names are not expected in a question")
+        offset += 1
+        labels.append(request[offset:offset + length].decode("utf-8"))
+        offset += length
+        length = request[offset]
+    # Skip the null byte
+    offset += 1
+
+    qtype, qclass = unpack_from(">HH", request, offset)
+    return transaction_id, flags, ".".join(labels), qtype, qclass, offset + 4
+
+TYPE_A: int = 1
+TYPE_NS: int = 2
+TYPE_CNAME: int = 5
+TYPE_SOA: int = 6
+TYPE_PTR: int = 12
+TYPE_MX: int = 15
+TYPE_TXT: int = 16
+TYPE_AAAA: int = 28
+TYPE_HTTPS: int = 65
+
+# SvcParamKeys from RFC 9460
+_SVC_PARAM_NAMES: dict[int, str] = {
+    0: "mandatory",
+    1: "alpn",
+    2: "no-default-alpn",
+    3: "port",
+    4: "ipv4hint",
+    5: "ech",
+    6: "ipv6hint",
+}
+
+# A name can be at most 255 bytes, so more pointer jumps than that is a loop
+_MAX_POINTER_JUMPS: int = 128
+
+_HEADER = Struct(">HHHHHH")
+_RECORD = Struct(">HHIH")
+_U16 = Struct(">H")
+_SOA_TIMERS = Struct(">IIIII")
+
+
+class DNSParseError(ValueError):
+    pass
+
+
+def _skip_name(view: memoryview, offset: int) -> int:
+    # Answer owner names are never kept, so walk past them without decoding
+    while True:
+        length = view[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += length + 1
+
+
+def _read_name(view: memoryview, offset: int, names: dict[int, str]) -> tuple[str, int]:
+    # Returns (name, offset past the name where it was first seen). Every
+    # suffix decoded is remembered by offset, so later pointers into the same
+    # message are a dict lookup.
+    labels: list[str] = []
+    starts: list[int] = []
+    end = -1
+    jumps = 0
+    while True:
+        cached = names.get(offset)
+        if cached is not None:
+            if cached:
+                labels.append(cached)
+            if end < 0:
+                end = _skip_name(view, offset)
+            break
+
+        length = view[offset]
+        if length == 0:
+            if end < 0:
+                end = offset + 1
+            break
+        if length & 0xC0 == 0xC0:
+            jumps += 1
+            if jumps > _MAX_POINTER_JUMPS:
+                raise DNSParseError("DNS name compression loop")
+            if end < 0:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | view[offset + 1]
+            continue
+        if length & 0xC0:
+            raise DNSParseError(f"Unsupported DNS label type: {length:#04x}")
+
+        starts.append(offset)
+        labels.append(bytes(view[offset + 1:offset + 1 + length]).decode("utf-8", "replace"))
+        offset += length + 1
+
+    name = ".".join(labels)
+    # Remember every suffix we walked, "a.b.c" at one offset, "b.c" at the next
+    for index, start in enumerate(starts):
+        names[start] = ".".join(labels[index:])
+    return name, end
+
+
+def _format_svcb(view: memoryview, offset: int, end: int, names: dict[int, str]) -> str:
+    (priority,) = _U16.unpack_from(view, offset)
+    target, offset = _read_name(view, offset + 2, names)
+    parts = [str(priority), target or "."]
+
+    while offset < end:
+        key, length = unpack_from(">HH", view, offset)
+        offset += 4
+        value = view[offset:offset + length]
+        offset += length
+
+        name = _SVC_PARAM_NAMES.get(key, f"key{key}")
+        if key == 1:
+            alpns: list[str] = []
+            index = 0
+            while index < length:
+                alpn_length = value[index]
+                alpns.append(bytes(value[index + 1:index + 1 + alpn_length]).decode("ascii", "replace"))
+                index += alpn_length + 1
+            parts.append(f"{name}={','.join(alpns)}")
+        elif key == 2:
+            parts.append(name)
+        elif key == 3:
+            parts.append(f"{name}={_U16.unpack_from(value, 0)[0]}")
+        elif key == 4:
+            hints = [socket.inet_ntop(socket.AF_INET, value[i:i + 4]) for i in range(0, length, 4)]
+            parts.append(f"{name}={','.join(hints)}")
+        elif key == 6:
+            hints = [socket.inet_ntop(socket.AF_INET6, value[i:i + 16]) for i in range(0, length, 16)]
+            parts.append(f"{name}={','.join(hints)}")
+        else:
+            parts.append(f"{name}={bytes(value).hex()}")
+    return " ".join(parts)
+
+
+def _format_rdata(
+    view: memoryview,
+    dns_type: int,
+    offset: int,
+    rdlength: int,
+    names: dict[int, str],
+) -> str:
+    if dns_type == TYPE_A:
+        return socket.inet_ntop(socket.AF_INET, view[offset:offset + 4])
+    if dns_type == TYPE_AAAA:
+        return socket.inet_ntop(socket.AF_INET6, view[offset:offset + 16])
+    if dns_type in (TYPE_CNAME, TYPE_NS, TYPE_PTR):
+        return _read_name(view, offset, names)[0]
+    if dns_type == TYPE_SOA:
+        mname, after = _read_name(view, offset, names)
+        rname, after = _read_name(view, after, names)
+        timers = _SOA_TIMERS.unpack_from(view, after)
+        return " ".join([mname, rname, *(str(t) for t in timers)])
+    if dns_type == TYPE_HTTPS:
+        return _format_svcb(view, offset, offset + rdlength, names)
+    if dns_type == TYPE_MX:
+        (preference,) = _U16.unpack_from(view, offset)
+        return f"{preference} {_read_name(view, offset + 2, names)[0]}"
+
+    # Anything else in the RFC 3597 generic form
+    return f"\\# {rdlength} {bytes(view[offset:offset + rdlength]).hex()}"
+
+
+def _parse_records(
+    view: memoryview,
+    offset: int,
+    count: int,
+    names: dict[int, str],
+) -> tuple[list[DNSResult], int]:
+    records: list[DNSResult] = []
+    append = records.append
+    unpack_record = _RECORD.unpack_from
+    inet_ntop = socket.inet_ntop
+    size = len(view)
+    for _ in range(count):
+        # Nearly every owner name is a single compression pointer
+        if view[offset] & 0xC0 == 0xC0:
+            offset += 2
+        else:
+            offset = _skip_name(view, offset)
+        dns_type, dns_class, ttl, rdlength = unpack_record(view, offset)
+        offset += 10
+        end = offset + rdlength
+        if end > size:
+            raise DNSParseError("DNS record runs past the end of the message")
+
+        if dns_type == TYPE_A:
+            address = inet_ntop(socket.AF_INET, view[offset:end])
+        elif dns_type == TYPE_AAAA:
+            address = inet_ntop(socket.AF_INET6, view[offset:end])
+        else:
+            address = _format_rdata(view, dns_type, offset, rdlength, names)
+        append(DNSResult(dns_type, dns_class, ttl, address))
+        offset = end
+    return records, offset
+
+
+def parse_dns_response(resp: bytes | bytearray | memoryview) -> DNSResponse:
+    """Decodes a DNS response without copying the message.
+
+    Compressed names are followed wherever they appear. A, AAAA, CNAME, NS,
+    PTR, MX, SOA and HTTPS records are decoded, anything else is kept in the
+    RFC 3597 generic form instead of failing the run."""
+    view = memoryview(resp)
+    try:
+        (transaction_id, flags, question_count, answer_count,
+         authority_count, additional_count) = _HEADER.unpack_from(view, 0)
+
+        offset = 12
+        for _ in range(question_count):
+            # Skip QNAME, QTYPE and QCLASS
+            offset = _skip_name(view, offset) + 4
+
+        names: dict[int, str] = {}
+        answers, offset = _parse_records(view, offset, answer_count, names)
+        authorities, offset = _parse_records(view, offset, authority_count, names)
+    except DNSParseError:
+        raise
+    except (IndexError, ValueError, OSError, StructError) as e:
+        raise DNSParseError(f"Malformed DNS response: {e}") from e
+
+    return DNSResponse(
+        transaction_id=transaction_id,
+        query_or_response=(flags >> 15) & 0x1,
+        opcode=(flags >> 11) & 0xF,
+        truncation_bit=(flags >> 9) & 0x1,
+        authoritative_answer_bit=(flags >> 10) & 0x1,
+        recursion_desired_bit=(flags >> 8) & 0x1,
+        recursion_available_bit=(flags >> 7) & 0x1,
+        response_code=flags & 0xF,
+        question_count=question_count,
+        answer_count=answer_count,
+        authority_count=authority_count,
+        additional_count=additional_count,
+        results=answers,
+        authorities=authorities,
+    )
+
+
+def parse_dns_responses(
+    responses: Iterable[bytes | bytearray | memoryview],
+) -> tuple[list[DNSResponse], int]:
+    """Decodes a batch of responses in one pass.
+
+    Returns the decoded responses and how many were malformed and skipped."""
+    parsed: list[DNSResponse] = []
+    append = parsed.append
+    malformed = 0
+
+    # Decoded records never form reference cycles, but every one of them
+    # counts towards the cyclic collector's thresholds. Left on, it keeps
+    # rescanning the growing batch and halves the decode rate.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for resp in responses:
+            try:
+                append(parse_dns_response(resp))
+            except DNSParseError:
+                malformed += 1
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return parsed, malformed
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from collections import Counter
+from histogram import LatencyHistogram, format_ns
+import socks
+import threading
+
+
+class HandshakeBreakdown:
+    """Aggregates socksocket handshake marks into per-phase histograms.
+
+    Handshakes are grouped by proxy type and entry point, e.g. "SOCKS5 bind"
+    for a UDP association or "HTTP connect" for a tunnel. While installed the
+    hook runs on whichever thread finished the handshake."""
+
+    def __init__(self):
+        self.groups: dict[str, dict[str, LatencyHistogram]] = {}
+        self.totals: dict[str, LatencyHistogram] = {}
+        self.failures: dict[str, Counter] = {}
+        self._lock = threading.Lock()
+
+    def record(self, sock: socks.socksocket, marks: list[tuple[str, int]], error: BaseException | None) -> None:
+        proxy_type = socks.PRINTABLE_PROXY_TYPES.get(sock.proxy[0], "?")
+        entry, start = marks[0]
+        group = f"{proxy_type} {entry}"
+
+        with self._lock:
+            phases = self.groups.setdefault(group, {})
+            previous = start
+            for phase, timestamp in marks[1:]:
+                histogram = phases.get(phase)
+                if histogram is None:
+                    histogram = phases[phase] = LatencyHistogram()
+                histogram.record(timestamp - previous)
+                previous = timestamp
+
+            if error is None:
+                total = self.totals.get(group)
+                if total is None:
+                    total = self.totals[group] = LatencyHistogram()
+                total.record(previous - start)
+            else:
+                # Blame the phase that never got its mark
+                self.failures.setdefault(group, Counter())[f"after {marks[-1][0]}: {type(error).__name__}"] += 1
+
+    def install(self) -> HandshakeBreakdown:
+        socks.set_handshake_hook(self.record)
+        return self
+
+    def uninstall(self) -> None:
+        if socks.get_handshake_hook() == self.record:
+            socks.set_handshake_hook(None)
+
+    def __enter__(self) -> HandshakeBreakdown:
+        return self.install()
+
+    def __exit__(self, *exc_info) -> None:
+        self.uninstall()
+
+    def print(self) -> None:
+        """Prints where the time went in each kind of handshake."""
+        with self._lock:
+            for group, phases in self.groups.items():
+                total = self.totals.get(group, LatencyHistogram())
+                failures = self.failures.get(group, Counter())
+                print(f"HANDSHAKE: {group}, {total.total} completed, {sum(failures.values())} failed")
+                print(f"  {'PHASE':<16}{'p50':>12}{'p90':>12}{'p99':>12}{'max':>12}")
+                for phase, histogram in (*phases.items(), ("total", total)):
+                    if not histogram.total:
+                        continue
+                    summary = histogram.summary()
+                    print(
+                        f"  {phase:<16}{format_ns(summary['p50']):>12}{format_ns(summary['p90']):>12}"
+                        f"{format_ns(summary['p99']):>12}{format_ns(summary['max']):>12}"
+                    )
+                for reason, count in failures.most_common():
+                    print(f"  failed {reason}: {count}")
@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from array import array
+
+# Percentiles the ops team asks for, in report order
+REPORT_PERCENTILES: tuple[float, ...] = (50.0, 90.0, 99.0, 99.9)
+
+# 256 linear sub-buckets, then 128 per power of two. Every recorded value
+# lands in a bucket no wider than 1/128th of itself, so percentiles are good
+# to better than 1%.
+_SUB_BUCKET_BITS: int = 8
+_SUB_BUCKET_COUNT: int = 1 << _SUB_BUCKET_BITS
+_SUB_BUCKET_HALF: int = _SUB_BUCKET_COUNT >> 1
+
+# 2^43 ns is a bit over two hours, far beyond any timeout we would use
+_HIGHEST_TRACKABLE_BITS: int = 43
+
+
+def _bucket_count(highest_bits: int) -> int:
+    return _SUB_BUCKET_COUNT + (highest_bits - _SUB_BUCKET_BITS) * _SUB_BUCKET_HALF
+
+
+class LatencyHistogram:
+    """HDR-style log-bucketed histogram of nanosecond latencies.
+
+    Memory is fixed when the histogram is created and never grows, no matter
+    how many values are recorded."""
+
+    def __init__(self, highest_bits: int = _HIGHEST_TRACKABLE_BITS):
+        self._highest_bits = highest_bits
+        self._highest_value = (1 << highest_bits) - 1
+        self.counts = array("Q", bytes(8 * _bucket_count(highest_bits)))
+        self.total: int = 0
+        self.min: int = 0
+        self.max: int = 0
+        self.sum: int = 0
+
+    @staticmethod
+    def _index_of(value: int) -> int:
+        if value < _SUB_BUCKET_COUNT:
+            return value
+        shift = value.bit_length() - _SUB_BUCKET_BITS
+        return _SUB_BUCKET_COUNT + (shift - 1) * _SUB_BUCKET_HALF + (value >> shift) - _SUB_BUCKET_HALF
+
+    @staticmethod
+    def _highest_equivalent(index: int) -> int:
+        if index < _SUB_BUCKET_COUNT:
+            return index
+        shift, sub = divmod(index - _SUB_BUCKET_COUNT, _SUB_BUCKET_HALF)
+        shift += 1
+        return ((sub + _SUB_BUCKET_HALF + 1) << shift) - 1
+
+    def record(self, value_ns: int, count: int = 1) -> None:
+        if value_ns < 0:
+            value_ns = 0
+        index = self._index_of(min(value_ns, self._highest_value))
+        self.counts[index] += count
+
+        if not self.total or value_ns < self.min:
+            self.min = value_ns
+        if value_ns > self.max:
+            self.max = value_ns
+        self.total += count
+        self.sum += value_ns * count
+
+    def merge(self, other: LatencyHistogram) -> None:
+        if other._highest_bits != self._highest_bits:
+            raise ValueError("Cannot merge histograms with different ranges")
+        if not other.total:
+            return
+
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += count
+
+        if not self.total or other.min < self.min:
+            self.min = other.min
+        self.max = max(self.max, other.max)
+        self.total += other.total
+        self.sum += other.sum
+
+    def reset(self) -> None:
+        counts = self.counts
+        for index in range(len(counts)):
+            counts[index] = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+        self.sum = 0
+
+    # Flat layout for sharing between processes: total, min, max and sum,
+    # then every bucket count, all as unsigned 64 bit words
+    _HEADER_WORDS: int = 4
+
+    @property
+    def word_count(self) -> int:
+        return self._HEADER_WORDS + len(self.counts)
+
+    def write_words(self, words: memoryview) -> None:
+        """Copies this histogram into a memoryview of word_count 'Q' items."""
+        words[0] = self.total
+        words[1] = self.min
+        words[2] = self.max
+        words[3] = self.sum
+        words[self._HEADER_WORDS:self.word_count] = self.counts
+
+    def merge_words(self, words: memoryview) -> None:
+        """Merges a histogram written by write_words(), e.g. by another process."""
+        total, minimum, maximum, total_sum = words[:self._HEADER_WORDS]
+        if not total:
+            return
+
+        counts = self.counts
+        for index, count in enumerate(words[self._HEADER_WORDS:self.word_count]):
+            if count:
+                counts[index] += count
+
+        if not self.total or minimum < self.min:
+            self.min = minimum
+        self.max = max(self.max, maximum)
+        self.total += total
+        self.sum += total_sum
+
+    def mean(self) -> float:
+        if not self.total:
+            return 0.0
+        return self.sum / self.total
+
+    def percentile(self, percentile: float) -> int:
+        if not self.total:
+            return 0
+
+        # Same rank rule as HdrHistogram: the smallest value that at least
+        # this percentage of recorded values are less than or equal to
+        wanted = max(1, int(percentile / 100.0 * self.total + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if not count:
+                continue
+            seen += count
+            if seen >= wanted:
+                return min(self._highest_equivalent(index), self.max)
+        return self.max
+
+    def summary(self) -> dict[str, int]:
+        result = {f"p{p:g}": self.percentile(p) for p in REPORT_PERCENTILES}
+        result["max"] = self.max
+        return result
+
+
+def format_ns(value_ns: float) -> str:
+    if abs(value_ns) >= 1_000_000_000:
+        return f"{value_ns / 1_000_000_000:.3f}s"
+    if abs(value_ns) >= 1_000_000:
+        return f"{value_ns / 1_000_000:.3f}ms"
+    return f"{value_ns / 1_000:.1f}us"
+
+
+def print_latency_comparison(direct: LatencyHistogram, proxy: LatencyHistogram) -> None:
+    """Prints percentiles for both paths and how much the proxy adds."""
+    direct_summary = direct.summary()
+    proxy_summary = proxy.summary()
+
+    print(f"LATENCY: direct={direct.total} samples, proxy={proxy.total} samples")
+    print(f"  {'':<8}{'DIRECT':>14}{'PROXY':>14}{'OVERHEAD':>14}")
+    for name, direct_ns in direct_summary.items():
+        proxy_ns = proxy_summary[name]
+        overhead = format_ns(proxy_ns - direct_ns) if direct.total and proxy.total else "-"
+        print(
+            f"  {name:<8}{format_ns(direct_ns):>14}{format_ns(proxy_ns):>14}{overhead:>14}"
+        )
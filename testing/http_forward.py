@@ -0,0 +1,291 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# HTTP/1.1 forward proxy client: plain requests with an absolute URL as the
+# target, sent to the proxy itself rather than tunnelled through CONNECT.
+# This is the path TetherFi's HttpProxySession takes for http:// URLs.
+
+from __future__ import annotations
+from base64 import b64encode
+from dataclasses import dataclass
+from http_wire import (
+    BODY_CHUNKED,
+    BODY_LENGTH,
+    BODY_UNTIL_CLOSE,
+    MAX_HEAD,
+    Headers,
+    body_framing,
+    encode_head,
+    header,
+    keep_alive,
+    parse_chunk_size,
+    parse_head,
+    split_absolute_url,
+)
+import socket
+import threading
+
+DEFAULT_MAX_IDLE: int = 8
+DEFAULT_TIMEOUT: float = 10.0
+
+# Safe to send twice, so safe to pipeline and to retry on a fresh connection
+IDEMPOTENT_METHODS: frozenset[str] = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS", "TRACE"})
+
+
+@dataclass
+class HttpResponse:
+    status: int
+    reason: str
+    headers: Headers
+    body: bytes
+    # Came over a connection that had already carried another request
+    reused: bool = False
+
+
+def build_request(
+    method: str,
+    url: str,
+    headers: Headers | None = None,
+    body: bytes = b"",
+    keep_open: bool = True,
+    authorization: str | None = None,
+) -> bytes:
+    """A request in absolute-form, the way a client talks to a forward proxy."""
+    host, port, _ = split_absolute_url(url)
+    sent: Headers = list(headers or [])
+    if header(sent, "host") is None:
+        sent.insert(0, ("Host", host if port == 80 else f"{host}:{port}"))
+    if body or method in ("POST", "PUT"):
+        sent.append(("Content-Length", str(len(body))))
+    if authorization:
+        sent.append(("Proxy-Authorization", authorization))
+    if not keep_open:
+        sent.append(("Connection", "close"))
+    return encode_head(f"{method} {url} HTTP/1.1", sent) + body
+
+
+class ForwardProxyConnection:
+    """One keep-alive connection to the proxy, used by one thread at a time."""
+
+    def __init__(
+        self,
+        proxy: tuple[str, int],
+        timeout: float | None = DEFAULT_TIMEOUT,
+        source_address: tuple[str, int] | None = None,
+    ):
+        self.sock = socket.create_connection(proxy, timeout, source_address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self.sock.makefile("rb")
+        # Responses read so far, more than zero means the connection is reused
+        self.responses = 0
+        self.open = True
+
+    def send(self, data: bytes) -> None:
+        self.sock.sendall(data)
+
+    def _read_head(self) -> bytes:
+        lines = []
+        size = 0
+        while True:
+            line = self._file.readline(MAX_HEAD + 1)
+            if not line:
+                if not lines:
+                    # Closed between responses, usually an idle timeout
+                    raise ConnectionResetError("Proxy closed the connection")
+                raise ValueError("Truncated HTTP response head")
+            size += len(line)
+            if size > MAX_HEAD:
+                raise ValueError("HTTP response head too large")
+            lines.append(line)
+            if line == b"\r\n":
+                return b"".join(lines)
+
+    def _read_exactly(self, size: int) -> bytes:
+        data = self._file.read(size)
+        if len(data) != size:
+            raise ValueError("Truncated HTTP response body")
+        return data
+
+    def _read_chunked(self) -> bytes:
+        chunks = []
+        while size := parse_chunk_size(self._file.readline(MAX_HEAD)):
+            chunks.append(self._read_exactly(size))
+            if self._file.readline(3) != b"\r\n":
+                raise ValueError("Missing CRLF after chunk")
+        # Trailers are read and dropped
+        while self._file.readline(MAX_HEAD) not in (b"\r\n", b""):
+            pass
+        return b"".join(chunks)
+
+    def read_response(self, method: str) -> HttpResponse:
+        while True:
+            version, status, reason, headers = parse_head(self._read_head())
+            status = int(status)
+            # Interim responses are only a promise of the real one
+            if not 100 <= status < 200:
+                break
+
+        framing, length = body_framing(headers, request=False, method=method, status=status)
+        if framing == BODY_LENGTH:
+            body = self._read_exactly(length)
+        elif framing == BODY_CHUNKED:
+            body = self._read_chunked()
+        elif framing == BODY_UNTIL_CLOSE:
+            body = self._file.read()
+        else:
+            body = b""
+
+        if framing == BODY_UNTIL_CLOSE or not keep_alive(version, headers):
+            self.open = False
+        response = HttpResponse(status, reason, headers, body, reused=self.responses > 0)
+        self.responses += 1
+        return response
+
+    def close(self) -> None:
+        self.open = False
+        self._file.close()
+        self.sock.close()
+
+
+class ForwardProxyPool:
+    """Keep-alive connections to one HTTP proxy, for any number of origins.
+
+    The proxy picks the origin from each request's URL, so every idle
+    connection can serve every request. With keep_alive off each request
+    gets a connection of its own, which is what reusing them saves. Thread-safe."""
+
+    def __init__(
+        self,
+        proxy_host: str,
+        proxy_port: int,
+        user: str | None = None,
+        pwd: str | None = None,
+        max_idle: int = DEFAULT_MAX_IDLE,
+        keep_alive: bool = True,
+        timeout: float | None = DEFAULT_TIMEOUT,
+        source_address: tuple[str, int] | None = None,
+    ):
+        self.proxy = (proxy_host, proxy_port)
+        self.authorization = None
+        if user:
+            self.authorization = "basic " + b64encode(f"{user}:{pwd or ''}".encode()).decode()
+        self.max_idle = max_idle
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.source_address = source_address
+
+        self.connections_opened = 0
+        self.requests = 0
+        self.retries = 0
+        self._idle: list[ForwardProxyConnection] = []
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> ForwardProxyConnection:
+        with self._lock:
+            while self._idle:
+                connection = self._idle.pop()
+                if connection.open:
+                    return connection
+                connection.close()
+            self.connections_opened += 1
+        return ForwardProxyConnection(self.proxy, self.timeout, self.source_address)
+
+    def _release(self, connection: ForwardProxyConnection) -> None:
+        if self.keep_alive and connection.open:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(connection)
+                    return
+        connection.close()
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        headers: Headers | None = None,
+        body: bytes = b"",
+    ) -> HttpResponse:
+        data = build_request(method, url, headers, body, self.keep_alive, self.authorization)
+        with self._lock:
+            self.requests += 1
+
+        while True:
+            connection = self._acquire()
+            reused = connection.responses > 0
+            try:
+                connection.send(data)
+                response = connection.read_response(method)
+            except ConnectionError:
+                connection.close()
+                # An idle connection the proxy already gave up on, the
+                # request never got anywhere so it can go again
+                if reused and method in IDEMPOTENT_METHODS:
+                    with self._lock:
+                        self.retries += 1
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            self._release(connection)
+            return response
+
+    def pipeline(self, requests: list[tuple[str, str]]) -> list[HttpResponse]:
+        """Sends (method, url) requests back to back on one connection, then reads the responses.
+
+        Whatever is left unanswered when the proxy closes the connection
+        part way goes again on a new one."""
+        for method, _ in requests:
+            if method not in IDEMPOTENT_METHODS:
+                raise ValueError(f"{method} requests are not safe to pipeline")
+        with self._lock:
+            self.requests += len(requests)
+
+        responses: list[HttpResponse] = []
+        while len(responses) < len(requests):
+            pending = requests[len(responses):]
+            connection = self._acquire()
+            reused = connection.responses > 0
+            answered = len(responses)
+            try:
+                connection.send(b"".join(
+                    build_request(method, url, keep_open=True, authorization=self.authorization)
+                    for method, url in pending
+                ))
+                for method, _ in pending:
+                    responses.append(connection.read_response(method))
+                    if not connection.open:
+                        break
+            except ConnectionError:
+                connection.close()
+                # A fresh connection that answered nothing is not going to
+                # do better the next time
+                if not reused and len(responses) == answered:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                continue
+            except BaseException:
+                connection.close()
+                raise
+            self._release(connection)
+        return responses
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# HTTP/1.1 message heads and body framing without any I/O, shared by the
+# forward proxy client, the reference proxy and the origin stand-in.
+#
+# Only what a forward proxy needs: absolute-form request targets, keep-alive
+# and the three ways a body can end (RFC 9112 section 6). Errors are
+# ValueError, the same as a malformed SOCKS reply in socks_codec.
+
+from __future__ import annotations
+from urllib.parse import urlsplit
+
+HEADER_END: bytes = b"\r\n\r\n"
+MAX_HEAD: int = 16 * 1024
+
+# Framing of a body, from body_framing()
+BODY_NONE: str = "none"
+BODY_LENGTH: str = "length"
+BODY_CHUNKED: str = "chunked"
+BODY_UNTIL_CLOSE: str = "close"
+
+# Headers for one connection only, a proxy never passes them on.
+# Transfer-Encoding is one too, but bodies are relayed in the framing they
+# arrived in, so it goes along with them.
+HOP_BY_HOP: frozenset[str] = frozenset({
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "proxy-connection",
+    "te",
+    "trailer",
+    "upgrade",
+})
+
+Headers = list[tuple[str, str]]
+
+
+def parse_head(head: bytes) -> tuple[str, str, str, Headers]:
+    """Splits a request or status line and its headers.
+
+    Returns the three parts of the first line, (method, target, version) for
+    a request or (version, status, reason) for a response, and the headers
+    in order with their names as sent."""
+    lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+    parts = lines[0].split(" ", 2)
+    if len(parts) < 2:
+        raise ValueError(f"Malformed HTTP start line: {lines[0]!r}")
+    if len(parts) == 2:
+        # A status line may leave out the reason
+        parts.append("")
+
+    headers = []
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if not sep or not name or name[-1] in " \t":
+            raise ValueError(f"Malformed HTTP header: {line!r}")
+        headers.append((name, value.strip()))
+    return parts[0], parts[1], parts[2], headers
+
+
+def header(headers: Headers, name: str) -> str | None:
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _tokens(headers: Headers, name: str) -> set[str]:
+    name = name.lower()
+    return {
+        token.strip().lower()
+        for key, value in headers if key.lower() == name
+        for token in value.split(",")
+    }
+
+
+def keep_alive(version: str, headers: Headers) -> bool:
+    """Whether the connection stays open after this message."""
+    tokens = _tokens(headers, "connection") | _tokens(headers, "proxy-connection")
+    if version == "HTTP/1.0":
+        return "keep-alive" in tokens
+    return "close" not in tokens
+
+
+def body_framing(
+    headers: Headers,
+    request: bool,
+    method: str | None = None,
+    status: int | None = None,
+) -> tuple[str, int]:
+    """How the body after this head ends, and its length if it has one."""
+    if not request:
+        if method == "HEAD" or (status is not None and (100 <= status < 200 or status in (204, 304))):
+            return BODY_NONE, 0
+
+    if "chunked" in _tokens(headers, "transfer-encoding"):
+        return BODY_CHUNKED, 0
+    length = header(headers, "content-length")
+    if length is not None:
+        if not length.isdigit():
+            raise ValueError(f"Bad Content-Length: {length!r}")
+        return BODY_LENGTH, int(length)
+    # A request with neither has no body, a response runs until the close
+    if request:
+        return BODY_NONE, 0
+    return BODY_UNTIL_CLOSE, 0
+
+
+def parse_chunk_size(line: bytes) -> int:
+    """Size from a chunk header line, extensions ignored."""
+    size = line.split(b";", 1)[0].strip()
+    if not size or size.strip(b"0123456789abcdefABCDEF"):
+        raise ValueError(f"Bad chunk size: {line!r}")
+    return int(size, 16)
+
+
+def split_absolute_url(url: str) -> tuple[str, int, str]:
+    """Host, port and origin-form target of an absolute-form http:// URL."""
+    parts = urlsplit(url)
+    if parts.scheme.lower() != "http" or not parts.hostname:
+        raise ValueError(f"Not an absolute http URL: {url!r}")
+    target = parts.path or "/"
+    if parts.query:
+        target += "?" + parts.query
+    return parts.hostname, parts.port or 80, target
+
+
+def end_to_end(headers: Headers) -> Headers:
+    """Headers without the hop-by-hop ones, including any Connection names."""
+    dropped = HOP_BY_HOP | _tokens(headers, "connection")
+    return [(name, value) for name, value in headers if name.lower() not in dropped]
+
+
+def encode_head(start_line: str, headers: Headers) -> bytes:
+    lines = [start_line]
+    lines.extend(f"{name}: {value}" for name, value in headers)
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
@@ -0,0 +1,574 @@
+#!/usr/bin/python3
+
+# impairment.py - lossy, jittery, rate-limited link between the harness and a proxy.
+#
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Stands in for a Wi-Fi Direct or RNDIS hop when the proxy is on the bench.
+# TCP and UDP arriving on one port are forwarded to the upstream through a
+# shaper per direction, shared by every flow the way the air is. SOCKS5 UDP
+# ASSOCIATE replies are rewritten so relayed datagrams cross the same link
+# instead of going around it.
+
+from __future__ import annotations
+from dataclasses import dataclass
+from socks_codec import CMD_UDP_ASSOCIATE, SOCKS5_VERSION, decode_socks5_address, encode_socks5_address
+import argparse
+import asyncio
+import random
+
+# How long a UDP flow may sit idle before its upstream socket is closed
+_FLOW_IDLE_SECONDS: float = 30.0
+_TCP_CHUNK: int = 64 * 1024
+# Chunks waiting for their due time per TCP direction, past this the reader
+# stops reading and the sender feels it as a full window
+_TCP_QUEUE_CHUNKS: int = 64
+
+
+@dataclass
+class LinkProfile:
+    """What one direction of the link does to traffic.
+
+    UDP datagrams are dropped with probability loss, and a reordered one is
+    held back reorder_ms longer than the rest. TCP cannot lose or reorder
+    bytes, a lost chunk stalls its connection for a retransmit instead. A
+    rate_kbit cap queues traffic behind a token bucket of burst_bytes, and
+    datagrams that would queue longer than queue_ms are tail dropped."""
+
+    delay_ms: float = 0.0
+    jitter_ms: float = 0.0
+    loss: float = 0.0
+    reorder: float = 0.0
+    reorder_ms: float = 10.0
+    rate_kbit: float = 0.0
+    burst_bytes: int = 16 * 1024
+    queue_ms: float = 200.0
+
+    _KEYS = {
+        "delay": "delay_ms",
+        "jitter": "jitter_ms",
+        "loss": "loss",
+        "reorder": "reorder",
+        "reorder_gap": "reorder_ms",
+        "rate": "rate_kbit",
+        "burst": "burst_bytes",
+        "queue": "queue_ms",
+    }
+
+    @classmethod
+    def parse(cls, spec: str) -> LinkProfile:
+        """From e.g. "delay=20,jitter=5,loss=1%,rate=20000", times in ms and rate in kbit/s."""
+        profile = cls()
+        for item in filter(None, spec.split(",")):
+            key, sep, value = item.partition("=")
+            if not sep or key.strip() not in cls._KEYS:
+                raise ValueError(f"Unknown link setting {item!r}, expected one of {','.join(cls._KEYS)}")
+            value = value.strip()
+            number = float(value[:-1]) / 100 if value.endswith("%") else float(value)
+            attr = cls._KEYS[key.strip()]
+            setattr(profile, attr, int(number) if attr == "burst_bytes" else number)
+        return profile
+
+
+@dataclass
+class LinkStats:
+    packets: int = 0
+    bytes: int = 0
+    lost: int = 0
+    overflowed: int = 0
+    reordered: int = 0
+
+
+class _TokenBucket:
+
+    def __init__(self, rate_kbit: float, burst_bytes: int):
+        self.rate = rate_kbit * 1000 / 8
+        self.burst = burst_bytes
+        self._tokens = float(burst_bytes)
+        self._time = 0.0
+
+    def reserve(self, size: int, now: float, limit: float | None = None) -> float | None:
+        """When size bytes finish going out, None if that is over limit seconds away."""
+        start = max(now, self._time)
+        tokens = min(self.burst, self._tokens + (start - self._time) * self.rate)
+        departure = start + max(0.0, size - tokens) / self.rate
+        if limit is not None and departure - now > limit:
+            return None
+        self._tokens = max(0.0, tokens - size)
+        self._time = departure
+        return departure
+
+
+class _Shaper:
+    """One direction of the link, shared by every flow crossing it."""
+
+    def __init__(self, profile: LinkProfile, rng: random.Random):
+        self.profile = profile
+        self.stats = LinkStats()
+        self._rng = rng
+        self._bucket = _TokenBucket(profile.rate_kbit, profile.burst_bytes) if profile.rate_kbit > 0 else None
+
+    def _latency(self) -> float:
+        profile = self.profile
+        jitter = self._rng.uniform(-profile.jitter_ms, profile.jitter_ms) if profile.jitter_ms else 0.0
+        return max(0.0, profile.delay_ms + jitter) / 1000
+
+    def datagram(self, size: int, now: float) -> float | None:
+        """Loop time to deliver a datagram at, None to drop it."""
+        profile = self.profile
+        if profile.loss and self._rng.random() < profile.loss:
+            self.stats.lost += 1
+            return None
+
+        departure = now
+        if self._bucket:
+            departure = self._bucket.reserve(size, now, profile.queue_ms / 1000)
+            if departure is None:
+                self.stats.overflowed += 1
+                return None
+
+        due = departure + self._latency()
+        if profile.reorder and self._rng.random() < profile.reorder:
+            due += profile.reorder_ms / 1000
+            self.stats.reordered += 1
+        self.stats.packets += 1
+        self.stats.bytes += size
+        return due
+
+    def chunk(self, size: int, now: float) -> float:
+        """Loop time a TCP chunk arrives, before keeping its stream in order."""
+        profile = self.profile
+        departure = self._bucket.reserve(size, now) if self._bucket else now
+        due = departure + self._latency()
+        if profile.loss and self._rng.random() < profile.loss:
+            # Roughly one retransmission timeout, a minimum RTO or two RTTs
+            due += max(0.2, 4 * profile.delay_ms / 1000)
+            self.stats.lost += 1
+        self.stats.packets += 1
+        self.stats.bytes += size
+        return due
+
+
+class _TcpLink:
+    """Writes one direction of a TCP connection at the times its shaper picks."""
+
+    def __init__(self, shaper: _Shaper, writer: asyncio.StreamWriter):
+        self._shaper = shaper
+        self._writer = writer
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue(_TCP_QUEUE_CHUNKS)
+        self._last_due = 0.0
+        self._delivery = asyncio.create_task(self._deliver())
+
+    async def send(self, data: bytes) -> None:
+        # A stream arrives in order however much the latency jitters
+        self._last_due = max(self._last_due, self._shaper.chunk(len(data), self._loop.time()))
+        await self._queue.put((self._last_due, data))
+
+    async def pump(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while data := await reader.read(_TCP_CHUNK):
+                await self.send(data)
+        except ConnectionError:
+            pass
+        await self.finish()
+
+    async def finish(self) -> None:
+        await self._queue.put(None)
+        try:
+            await self._delivery
+        except ConnectionError:
+            pass
+
+    def cancel(self) -> None:
+        self._delivery.cancel()
+
+    async def _deliver(self) -> None:
+        writer = self._writer
+        while (item := await self._queue.get()) is not None:
+            due, data = item
+            wait = due - self._loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+
+
+class _UdpFlow(asyncio.DatagramProtocol):
+    """Upstream socket for one client address."""
+
+    def __init__(self, forwarder: _UdpForwarder, client: tuple):
+        self.client = client
+        self.last_active = 0.0
+        self._forwarder = forwarder
+        self._transport: asyncio.DatagramTransport | None = None
+        self._backlog: list[bytes] = []
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self._transport = transport
+        for data in self._backlog:
+            transport.sendto(data)
+        self._backlog.clear()
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        self._forwarder.to_client(self, data)
+
+    def error_received(self, exc: Exception) -> None:
+        pass
+
+    def send(self, data: bytes) -> None:
+        if self._transport is None:
+            self._backlog.append(data)
+        elif not self._transport.is_closing():
+            self._transport.sendto(data)
+
+    def close(self) -> None:
+        if self._transport:
+            self._transport.close()
+
+
+class _UdpForwarder(asyncio.DatagramProtocol):
+    """UDP listener giving every client address its own upstream socket."""
+
+    def __init__(self, up: _Shaper, down: _Shaper, upstream: tuple[str, int]):
+        self.upstream = upstream
+        self._up = up
+        self._down = down
+        self._flows: dict[tuple, _UdpFlow] = {}
+        self._transport: asyncio.DatagramTransport | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def start(self, host: str, port: int) -> tuple[str, int]:
+        self._loop = asyncio.get_running_loop()
+        self._transport, _ = await self._loop.create_datagram_endpoint(lambda: self, local_addr=(host, port))
+        return self._transport.get_extra_info("sockname")[:2]
+
+    def stop(self) -> None:
+        for flow in self._flows.values():
+            flow.close()
+        self._flows.clear()
+        if self._transport:
+            self._transport.close()
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        now = self._loop.time()
+        flow = self._flows.get(addr)
+        if flow is None:
+            flow = self._open_flow(addr, now)
+        flow.last_active = now
+
+        due = self._up.datagram(len(data), now)
+        if due is not None:
+            self._loop.call_at(due, flow.send, data)
+
+    def error_received(self, exc: Exception) -> None:
+        pass
+
+    def _open_flow(self, addr: tuple, now: float) -> _UdpFlow:
+        # Clients like normal_udp_request use a new port per query
+        idle = [key for key, flow in self._flows.items() if now - flow.last_active > _FLOW_IDLE_SECONDS]
+        for key in idle:
+            self._flows.pop(key).close()
+
+        flow = self._flows[addr] = _UdpFlow(self, addr)
+        self._loop.create_task(self._connect(flow))
+        return flow
+
+    async def _connect(self, flow: _UdpFlow) -> None:
+        try:
+            await self._loop.create_datagram_endpoint(lambda: flow, remote_addr=self.upstream)
+        except OSError:
+            self._flows.pop(flow.client, None)
+
+    def to_client(self, flow: _UdpFlow, data: bytes) -> None:
+        now = self._loop.time()
+        flow.last_active = now
+        due = self._down.datagram(len(data), now)
+        if due is not None:
+            self._loop.call_at(due, self._send_to_client, data, flow.client)
+
+    def _send_to_client(self, data: bytes, client: tuple) -> None:
+        if self._transport and not self._transport.is_closing():
+            self._transport.sendto(data, client)
+
+
+async def _read_socks5_address(reader: asyncio.StreamReader) -> bytes:
+    atyp = await reader.readexactly(1)
+    if atyp[0] == 0x03:
+        length = await reader.readexactly(1)
+        return atyp + length + await reader.readexactly(length[0] + 2)
+    return atyp + await reader.readexactly((16 if atyp[0] == 0x04 else 4) + 2)
+
+
+class ImpairmentRelay:
+    """Forwards TCP and UDP on one port to upstream through an impaired link.
+
+    up shapes traffic towards the upstream, down the replies, the same
+    profile both ways if down is not given. seed makes the losses and
+    jitter repeat from one run to the next."""
+
+    def __init__(
+        self,
+        upstream: tuple[str, int],
+        up: LinkProfile,
+        down: LinkProfile | None = None,
+        seed: int | None = None,
+        socks5_udp: bool = True,
+    ):
+        self.upstream = upstream
+        self.up = up
+        self.down = down or up
+        self.socks5_udp = socks5_udp
+        rng = random.Random(seed)
+        self._up = _Shaper(self.up, rng)
+        self._down = _Shaper(self.down, rng)
+        self._server: asyncio.Server | None = None
+        self._udp: _UdpForwarder | None = None
+        self._sessions: set[asyncio.Task] = set()
+
+    @property
+    def up_stats(self) -> LinkStats:
+        return self._up.stats
+
+    @property
+    def down_stats(self) -> LinkStats:
+        return self._down.stats
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> tuple[str, int]:
+        self._server = await asyncio.start_server(self._serve, host, port)
+        address = self._server.sockets[0].getsockname()[:2]
+        self._udp = _UdpForwarder(self._up, self._down, self.upstream)
+        await self._udp.start(*address)
+        return address
+
+    async def stop(self) -> None:
+        if self._udp:
+            self._udp.stop()
+        # Since Python 3.12.1 wait_closed() also waits for every client
+        # connection, so the sessions have to end before it
+        if self._server:
+            self._server.close()
+        sessions = list(self._sessions)
+        for session in sessions:
+            session.cancel()
+        await asyncio.gather(*sessions, return_exceptions=True)
+        if self._server:
+            await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = asyncio.current_task()
+        self._sessions.add(session)
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(*self.upstream)
+        except OSError:
+            writer.close()
+            self._sessions.discard(session)
+            return
+
+        up = _TcpLink(self._up, upstream_writer)
+        down = _TcpLink(self._down, writer)
+        associations: list[_UdpForwarder] = []
+        try:
+            if self.socks5_udp:
+                # Each side is followed on its own, so a pipelined handshake
+                # crosses the link as fast as it would without us
+                command = asyncio.get_running_loop().create_future()
+                await asyncio.gather(
+                    self._client_side(reader, up, command),
+                    self._proxy_side(upstream_reader, writer, down, command, associations),
+                )
+            else:
+                await asyncio.gather(up.pump(reader), down.pump(upstream_reader))
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            up.cancel()
+            down.cancel()
+        except asyncio.CancelledError:
+            # Shut down with the client still connected. Python 3.11's stream
+            # callback reports a cancelled session as an unhandled error
+            up.cancel()
+            down.cancel()
+        finally:
+            for forwarder in associations:
+                forwarder.stop()
+            writer.close()
+            upstream_writer.close()
+            self._sessions.discard(session)
+
+    async def _client_side(
+        self,
+        reader: asyncio.StreamReader,
+        up: _TcpLink,
+        command: asyncio.Future,
+    ) -> None:
+        try:
+            await self._sniff_request(reader, up, command)
+        except asyncio.IncompleteReadError as e:
+            # Gone before finishing its handshake, pass on what it did send
+            if e.partial:
+                await up.send(e.partial)
+            await up.finish()
+            return
+        finally:
+            if not command.done():
+                command.set_result(None)
+        await up.pump(reader)
+
+    async def _sniff_request(
+        self,
+        reader: asyncio.StreamReader,
+        up: _TcpLink,
+        command: asyncio.Future,
+    ) -> None:
+        """Follows the client half of a SOCKS5 handshake up to its request.
+
+        UDP ASSOCIATE requests are rewritten, everything else is forwarded
+        as it is."""
+        version = await reader.readexactly(1)
+        if version[0] != SOCKS5_VERSION:
+            command.set_result(None)
+            await up.send(version)
+            return
+        count = await reader.readexactly(1)
+        await up.send(version + count + await reader.readexactly(count[0]))
+
+        # Username/password auth is version 1, the request itself version 5,
+        # so there is no need to wait for the method the server picks
+        head = await reader.readexactly(1)
+        if head[0] == 0x01:
+            length = await reader.readexactly(1)
+            user = await reader.readexactly(length[0])
+            length2 = await reader.readexactly(1)
+            await up.send(head + length + user + length2 + await reader.readexactly(length2[0]))
+            head = await reader.readexactly(1)
+
+        request = head + await reader.readexactly(2)
+        address = await _read_socks5_address(reader)
+        if request[1] == CMD_UDP_ASSOCIATE:
+            # The proxy sees datagrams from our socket, not the client's, so
+            # let it take whatever arrives first from this host
+            address = encode_socks5_address("0.0.0.0", 0)
+        command.set_result(request[1])
+        await up.send(request + address)
+
+    async def _proxy_side(
+        self,
+        upstream_reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        down: _TcpLink,
+        command: asyncio.Future,
+        associations: list[_UdpForwarder],
+    ) -> None:
+        try:
+            await self._sniff_reply(upstream_reader, writer, down, command, associations)
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                await down.send(e.partial)
+            await down.finish()
+            return
+        await down.pump(upstream_reader)
+
+    async def _sniff_reply(
+        self,
+        upstream_reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        down: _TcpLink,
+        command: asyncio.Future,
+        associations: list[_UdpForwarder],
+    ) -> None:
+        """Follows the server half of a SOCKS5 handshake up to its reply.
+
+        A successful UDP ASSOCIATE gets a forwarder of its own, and the
+        reply points the client at it instead of the proxy's relay."""
+        method = await upstream_reader.readexactly(2)
+        await down.send(method)
+        if method[0] != SOCKS5_VERSION:
+            return
+        if method[1] == 0x02:
+            status = await upstream_reader.readexactly(2)
+            await down.send(status)
+            if status[1]:
+                return
+        elif method[1] != 0x00:
+            return
+
+        reply = await upstream_reader.readexactly(3)
+        bound = await _read_socks5_address(upstream_reader)
+        if reply[1] or await command != CMD_UDP_ASSOCIATE:
+            await down.send(reply + bound)
+            return
+
+        # Clients send to the proxy's host and the relay port, like socksocket
+        _, relay_port, _ = decode_socks5_address(bound, 0)
+        forwarder = _UdpForwarder(self._up, self._down, (self.upstream[0], relay_port))
+        associations.append(forwarder)
+        local = await forwarder.start(writer.get_extra_info("sockname")[0], 0)
+        await down.send(reply + encode_socks5_address(*local))
+
+
+def print_link_stats(relay: ImpairmentRelay) -> None:
+    print(f"LINK: {'DIR':<6}{'PACKETS':>10}{'BYTES':>14}{'LOST':>8}{'OVERFLOW':>10}{'REORDERED':>11}")
+    for name, stats in (("up", relay.up_stats), ("down", relay.down_stats)):
+        print(
+            f"      {name:<6}{stats.packets:>10}{stats.bytes:>14}{stats.lost:>8}"
+            f"{stats.overflowed:>10}{stats.reordered:>11}"
+        )
+
+
+async def _serve_forever(options: argparse.Namespace, up: LinkProfile, down: LinkProfile) -> None:
+    host, _, port = options.upstream.rpartition(":")
+    relay = ImpairmentRelay((host, int(port)), up, down, seed=options.seed)
+    host, port = await relay.start(options.host, options.port)
+    print(f"Impairment relay on {host}:{port} -> {options.upstream}")
+    print(f"  up   {up}")
+    print(f"  down {down}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await relay.stop()
+        print_link_stats(relay)
+
+
+def main(args: list[str]) -> int:
+    parser = argparse.ArgumentParser(
+        description="Relay TCP and UDP to a proxy through an emulated lossy link",
+        epilog="LINK is a comma separated list of delay=MS, jitter=MS, loss=P, reorder=P,"
+               " reorder_gap=MS, rate=KBIT, burst=BYTES and queue=MS, e.g."
+               " delay=15,jitter=10,loss=1%%,rate=30000",
+    )
+    parser.add_argument("--upstream", required=True, metavar="HOST:PORT", help="Proxy to forward to")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8230, help="Port for TCP and UDP")
+    parser.add_argument("--link", default="", metavar="LINK", help="Both directions")
+    parser.add_argument("--up", metavar="LINK", help="Towards the proxy, overrides --link")
+    parser.add_argument("--down", metavar="LINK", help="From the proxy, overrides --link")
+    parser.add_argument("--seed", type=int, help="Seed for repeatable losses and jitter")
+    options = parser.parse_args(args)
+
+    up = LinkProfile.parse(options.up if options.up is not None else options.link)
+    down = LinkProfile.parse(options.down if options.down is not None else options.link)
+    try:
+        asyncio.run(_serve_forever(options, up, down))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+
+    exit_code = main(sys.argv[1:])
+    sys.exit(exit_code)
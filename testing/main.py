@@ -15,363 +15,71 @@
 # under the License.
 
 from __future__ import annotations
-from normal_nonproxy_udp_response import normal_udp_request
-from socks_udp_response import proxy_udp_request
-from struct import pack, unpack
-from dataclasses import dataclass
+from normal_nonproxy_udp_response import direct_path, normal_udp_request
+from socks_udp_response import proxy_path, proxy_udp_request
+from dns_load import run_load
+from dns_load_multi import run_multi_load
+from soak import SoakRecorder
+from background import start_in_thread
+from dns_server import DnsServer, DnsServerConfig
+from reference_proxy import ReferenceProxy
+from dns_wire import DNSResponse, build_dns_request, parse_dns_response
+from histogram import LatencyHistogram, print_latency_comparison
+from handshake_timing import HandshakeBreakdown
+from impairment import ImpairmentRelay, LinkProfile, print_link_stats
+from udp_retry import print_path_stats
+import scenario
 from pprint import pprint
+import argparse
+import asyncio
+import itertools
+import os
 import socket
+import time
 
 remote_host: str = "dns.google"
 remote_port: int = 53
 
-@dataclass
-class DNSResult:
-    dns_type: int
-    dns_class: int
-    ttl: int
-    address: str
+proxy_server_host: str = "192.168.49.1"
+proxy_server_port: int = 8229
 
+direct_latency = LatencyHistogram()
+proxy_latency = LatencyHistogram()
 
-@dataclass
-class DNSResponse:
-    transaction_id: int
-    query_or_response: int
-    opcode: int
-    truncation_bit: int
-    authoritative_answer_bit: int
-    recursion_desired_bit: int
-    recursion_available_bit: int
-    response_code: int
-    question_count: int
-    answer_count: int
-    authority_count: int
-    additional_count: int
-    results: list[DNSResult]
-
-    def matches(self, other: DNSResponse) -> list[str]:
-        mismatched: list[str] = []
-
-        if self.transaction_id != other.transaction_id:
-            mismatched.append("transaction_id")
-        if self.query_or_response != other.query_or_response:
-            mismatched.append("query_or_response")
-        if self.opcode != other.opcode:
-            mismatched.append("opcode")
-        if self.truncation_bit != other.truncation_bit:
-            mismatched.append("truncation_bit")
-        if self.authoritative_answer_bit != other.authoritative_answer_bit:
-            mismatched.append("authoritative_answer_bit")
-        if self.recursion_desired_bit != other.recursion_desired_bit:
-            mismatched.append("recursion_desired_bit")
-        if self.recursion_available_bit != other.recursion_available_bit:
-            mismatched.append("recursion_available_bit")
-        if self.response_code != other.response_code:
-            mismatched.append("response_code")
-        if self.question_count != other.question_count:
-            mismatched.append("question_count")
-        if self.answer_count != other.answer_count:
-            mismatched.append("answer_count")
-        if self.authority_count != other.authority_count:
-            mismatched.append("additional_count")
-        if self.additional_count != other.additional_count:
-            mismatched.append("additional_count")
-
-        if len(self.results) != len(other.results):
-            mismatched.append("len(results)")
-
-        for res_1 in self.results:
-            matched: DNSResult | None = None
-            for res_2 in other.results:
-                if res_1.address == res_2.address:
-                    matched = res_2
-                    break
-
-            if not matched:
-                mismatched.append(f"Address: {res_1.address}")
-            else:
-                if res_1.dns_class != matched.dns_class:
-                    mismatched.append(f"dns_class: {res_1.address}")
-                if res_1.dns_type != matched.dns_type:
-                    mismatched.append(f"dns_type {res_1.address}")
-
-        return mismatched
-
-fake_normal_response = DNSResponse(
-    transaction_id=4660,
-    query_or_response=1,
-    opcode=0, 
-    truncation_bit=0, 
-    authoritative_answer_bit=0, 
-    recursion_desired_bit=1, 
-    recursion_available_bit=1, 
-    response_code=0, 
-    question_count=1, 
-    answer_count=6, 
-    authority_count=0, 
-    additional_count=0, 
-    results=[
-        DNSResult(
-            dns_type=1, 
-            dns_class=1, 
-            ttl=233, 
-            address='96.7.128.198',
-        ), 
-        DNSResult(
-            dns_type=1, 
-            dns_class=1, 
-            ttl=233, 
-            address='23.215.0.138',
-        ), 
-        DNSResult(
-            dns_type=1, 
-            dns_class=1, 
-            ttl=233, 
-            address='23.215.0.136',
-        ), 
-        DNSResult(
-            dns_type=1, 
-            dns_class=1, 
-            ttl=233, 
-            address='23.192.228.84',
-        ), 
-        DNSResult(
-            dns_type=1, 
-            dns_class=1, 
-            ttl=233, 
-            address='96.7.128.175',
-        ), 
-        DNSResult(
-            dns_type=1, 
-            dns_class=1, 
-            ttl=233, 
-            address='23.192.228.80',
-        )
-    ]
-)
-
-fake_proxy_response = DNSResponse(
-    transaction_id=4660,
-    query_or_response=1,
-    opcode=0,
-    truncation_bit=0,
-    authoritative_answer_bit=0,
-    recursion_desired_bit=1,
-    recursion_available_bit=1,
-    response_code=0,
-    question_count=1,
-    answer_count=6,
-    authority_count=0,
-    additional_count=0,
-    results=[
-        DNSResult(
-            dns_type=1,
-            dns_class=1,
-            ttl=248,
-            address='96.7.128.175',
-        ),
-        DNSResult(
-            dns_type=1,
-            dns_class=1,
-            ttl=248,
-            address='23.215.0.136',
-        ),
-        DNSResult(
-            dns_type=1,
-            dns_class=1,
-            ttl=248,
-            address='23.192.228.84',
-        ),
-        DNSResult(
-            dns_type=1, 
-            dns_class=1, 
-            ttl=248, 
-            address='23.215.0.138',
-        ), 
-        DNSResult(
-            dns_type=1, 
-            dns_class=1, 
-            ttl=248, 
-            address='96.7.128.198',
-        ), 
-        DNSResult(
-            dns_type=1, 
-            dns_class=1, 
-            ttl=248, 
-            address='23.192.228.80',
-        ),
-    ],
-)
-
-def encode_domain_name(domain: str) -> bytes:
-    parts: list[str] = domain.split(".")
-    encoded_name: bytes = b""
-
-    for part in parts:
-        encoded_name += bytes([len(part)]) + part.encode("utf-8")
-    encoded_name += b"\0"
-    return encoded_name
-
-def build_dns_request(transaction_id: int, domain_name: str) -> bytes:
-    # Standard DNS request
-    # 1) AA bit - set to 0, we are a request not an answer
-    # 2) TC - truncation, set to 0
-    # 3) RD bit - recursion bit, yes we want to look up all known DNS servers until a match is found
-    # 4) RA bit - recursion available, we are not a server, set to 0
-    flags: int = 0x0100
-
-    # One question, what is the IP of the domain_name
-    num_questions: int = 1
-
-    # No answers
-    num_answers: int = 0
-
-    # No authority records
-    num_authority_records: int = 0
-
-    # No additional records
-    num_additional_records: int = 0
-
-    # Pack the header as bytes
-    header = pack(
-        ">HHHHHH",
-        transaction_id,
-        flags,
-        num_questions,
-        num_answers,
-        num_authority_records,
-        num_additional_records,
-    )
-
-    # A record
-    query_type: int = 1
-
-    # Class IN
-    query_class: int = 1
+def test_dns(transaction_id: int, domain_name: str, compare: bool = False) -> int:
+    dns_request = build_dns_request(transaction_id, domain_name)
 
-    question = pack(
-        ">HH",
-        query_type,
-        query_class,
+    start = time.monotonic_ns()
+    b = normal_udp_request(
+        request=dns_request,
+        remote_host=remote_host,
+        remote_port=remote_port,
     )
-
-    encoded_domain = encode_domain_name(domain_name)
-
-    return header + encoded_domain + question
-
-def parse_dns_response(resp: bytes) -> DNSResponse:
-    # DNS header fields (12 bytes)
-    header_offset = 12  # Start after the DNS header
-    header = resp[:header_offset]
-
-    # Unpack the header (using struct to decode the binary data)
-    transaction_id, flags, question_count, answer_count, authority_count, additional_count = unpack('>HHHHHH', header)
-
-    # Extract header fields
-    qr = (flags >> 15) & 0x1      # QR (Query/Response)
-    opcode = (flags >> 11) & 0xF  # Opcode
-    aa = (flags >> 10) & 0x1      # AA (Authoritative Answer)
-    tc = (flags >> 9) & 0x1       # TC (Truncation)
-    rd = (flags >> 8) & 0x1       # RD (Recursion Desired)
-    ra = (flags >> 7) & 0x1       # RA (Recursion Available)
-    rcode = flags & 0xF           # RCODE (Response Code)
-
-    # Parse question section
-    offset = header_offset
-    for _ in range(question_count):
-        q_len = resp[offset]
-        while q_len != 0:
-            offset += q_len + 1
-            q_len = resp[offset]
-        # Skip the null byte
-        offset += 1
-
-        # Skip QTYPE
-        offset += 2
-
-        # Skip QCLASS
-        offset += 2
-
-    # Parsing the answer section
-    answers = []
-    for _ in range(answer_count):
-        # Skip the name field
-        offset += 2
-        
-        dns_type, dns_class, ttl, rdlength = unpack('>HHIH', resp[offset:offset + 10])
-        offset += 10
-
-        # A record
-        if dns_type == 1:
-            ip_address = socket.inet_ntoa(resp[offset:offset + rdlength])
-        # AAAA record
-        elif dns_type == 28:
-            ip_address = socket.inet_ntop(socket.AF_INET6, resp[offset:offset + rdlength])
-        else:
-            raise Exception(f"Unexpected DNS response type: {dns_type}")
-        
-        answers.append((dns_type, dns_class, ttl, ip_address))
-        offset += rdlength
-
-    return DNSResponse(
-        transaction_id=transaction_id,
-        answer_count=answer_count,
-        query_or_response=qr,
-        question_count=question_count,
-        opcode=opcode,
-        authoritative_answer_bit=aa,
-        truncation_bit=tc,
-        recursion_desired_bit=rd,
-        recursion_available_bit=ra,
-        response_code=rcode,
-        authority_count=authority_count,
-        additional_count=additional_count,
-        results=[DNSResult(
-            dns_type=dns_type,
-            dns_class=dns_class,
-            ttl=ttl,
-            address=ip_address,
-        ) for (dns_type, dns_class, ttl, ip_address) in answers]
+    print("NORMAL BYTES: ", b)
+    if not b or len(b) <= 0:
+        print("BAD NORMAL RESPONSE")
+        return 1
+    # Lost requests show up in the path counters, not as a huge sample
+    direct_latency.record(time.monotonic_ns() - start)
+    normal_response: DNSResponse = parse_dns_response(b)
+    print("NORMAL RESP: ", normal_response)
+
+    start = time.monotonic_ns()
+    b = proxy_udp_request(
+        request=dns_request,
+        remote_host=remote_host,
+        remote_port=remote_port,
+        proxy_server_host=proxy_server_host,
+        proxy_server_port=proxy_server_port,
     )
-
-def test_dns(transaction_id: int, domain_name: str) -> int:
-    dns_request = build_dns_request(transaction_id, domain_name)
-
-    normal_response: DNSResponse | None = None
-    proxy_response: DNSResponse | None = None
-
-    # Fake responses
-    # normal_response = fake_normal_response
-    # proxy_response = fake_proxy_response
-
-    if not normal_response:
-        b = normal_udp_request(
-            request=dns_request,
-            remote_host=remote_host,
-            remote_port=remote_port,
-        )
-        print("NORMAL BYTES: ", b)
-        if not b or len(b) <= 0:
-            print("BAD NORMAL RESPONSE")
-            return 1
-        normal_response = parse_dns_response(b)
-        print("NORMAL RESP: ", normal_response)
-
-    if not proxy_response:
-        b = proxy_udp_request(
-            request=dns_request,
-            remote_host=remote_host,
-            remote_port=remote_port,
-            proxy_server_host="192.168.49.1",
-            proxy_server_port=8229,
-        )
-        if not b or len(b) <= 0:
-            print("BAD PROXY RESPONSE")
-            return 2
-        proxy_response = parse_dns_response(b)
-        pprint(proxy_response)
-
-    if domain_name == "example.com":
+    if not b or len(b) <= 0:
+        print("BAD PROXY RESPONSE")
+        return 2
+    proxy_latency.record(time.monotonic_ns() - start)
+    proxy_response: DNSResponse = parse_dns_response(b)
+    pprint(proxy_response)
+
+    if compare or domain_name == "example.com":
         mismatched_fields: list[str] = normal_response.matches(proxy_response)
         if len(mismatched_fields) > 0:
             print(f"MISMATCH IN RESPONSES: {mismatched_fields}")
@@ -379,17 +87,283 @@ def test_dns(transaction_id: int, domain_name: str) -> int:
 
     return 0
 
+def run_soak(options: argparse.Namespace, relay: ImpairmentRelay | None) -> int:
+    # Answered pairs would grow for the whole run, so soak mode never keeps them
+    metrics = open(options.metrics, "w", newline="") if options.metrics else open(os.devnull, "w")
+    with metrics:
+        recorder = SoakRecorder(metrics, SoakRecorder.format_for(options.metrics or ""))
+        report = asyncio.run(run_load(
+            domains=options.domains,
+            queries=0,
+            concurrency=options.concurrency,
+            remote_host=socket.gethostbyname(remote_host),
+            remote_port=remote_port,
+            proxy_server_host=proxy_server_host,
+            proxy_server_port=proxy_server_port,
+            timeout=options.timeout,
+            rate=options.rate,
+            progress=recorder.sample,
+            progress_interval=options.metrics_interval,
+            duration=options.duration,
+        ))
+        recorder.finish(report)
+
+    report.print()
+    print_latency_comparison(report.direct.latency, report.proxy.latency)
+    if relay is not None:
+        print_link_stats(relay)
+    if options.metrics:
+        print(f"SOAK: {recorder.rows} rows written to {options.metrics}")
+    return 1 if report.direct.failed or report.proxy.failed else 0
+
+def parse_args(args: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare DNS over UDP directly and through the TetherFi SOCKS5 proxy",
+    )
+    parser.add_argument("domains", nargs="*", help="Domain names to look up")
+    parser.add_argument(
+        "--scenario",
+        metavar="FILE",
+        help="Run a scenario file instead and write its result bundle to ./results."
+             " Everything else comes from the file, see scenario.py --help for more",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=0,
+        help="Run in load mode with this many queries in flight per path",
+    )
+    parser.add_argument(
+        "-n",
+        "--queries",
+        type=int,
+        default=1000,
+        help="Total queries per path in load mode, cycling through the domains",
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=1,
+        help="Split load mode across this many worker processes, each with -c queries in flight",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0.0,
+        help="Queries per second per path in load mode, shared by all processes (default as fast as replies allow)",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=0.0,
+        help="Soak mode: run load mode for this many seconds instead of -n queries",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="Soak mode: stream one row of metrics per interval here, CSV if it ends in .csv else JSONL",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=1.0,
+        help="Seconds per soak mode metrics row",
+    )
+    parser.add_argument(
+        "--proxy",
+        metavar="HOST:PORT",
+        help=f"SOCKS5 proxy to test instead of {proxy_server_host}:{proxy_server_port}",
+    )
+    parser.add_argument(
+        "--serve-proxy",
+        action="store_true",
+        help="Start the bundled reference proxy on the --proxy address (default 127.0.0.1:8229)"
+             " and test it instead of the device",
+    )
+    parser.add_argument(
+        "--impair",
+        metavar="LINK",
+        help="Reach the proxy through impairment.py with this link, e.g. delay=15,jitter=10,loss=1%%,rate=30000."
+             " The direct path is left alone, it has no phone hop to emulate",
+    )
+    parser.add_argument(
+        "--impair-seed",
+        type=int,
+        help="Seed for repeatable losses and jitter with --impair",
+    )
+    parser.add_argument(
+        "--dns",
+        metavar="HOST:PORT",
+        help=f"DNS server to query instead of {remote_host}:{remote_port}",
+    )
+    parser.add_argument(
+        "--serve-dns",
+        action="store_true",
+        help="Start the bundled DNS responder on the --dns address (default 127.0.0.1 on a free port)"
+             " and query it, so nothing leaves the test network",
+    )
+    parser.add_argument(
+        "--dns-answers",
+        type=int,
+        default=6,
+        help="Answers per reply from the bundled DNS responder",
+    )
+    parser.add_argument(
+        "--dns-delay-ms",
+        type=float,
+        default=0.0,
+        help="Delay before every reply from the bundled DNS responder",
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="Keep every answered pair in load mode and diff direct against proxy at the end"
+             " (always on with --serve-dns)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=2.0,
+        help="Seconds to wait for each reply in load mode",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=2,
+        help="Retransmits per query in sequential mode before it counts as lost",
+    )
+    parser.add_argument(
+        "--handshakes",
+        action="store_true",
+        help="Time each phase of the UDP ASSOCIATE handshakes made in sequential mode",
+    )
+    return parser.parse_args(args)
+
 def main(args: list[str]) -> int:
-    if not args:
+    global remote_host, remote_port, proxy_server_host, proxy_server_port
+
+    options = parse_args(args)
+    if options.scenario:
+        return scenario.main([options.scenario])
+    if not options.domains:
         print("Specify at least 1 domain name for DNS")
         return 1
 
-    transaction_id = 0x1234
-    for domain_name in args:
+    if options.dns:
+        host, _, port = options.dns.rpartition(":")
+        remote_host, remote_port = host, int(port)
+    elif options.serve_dns:
+        # Never 5353, that is mDNS and usually taken by avahi or resolved
+        remote_host, remote_port = "127.0.0.1", 0
+
+    if options.proxy:
+        host, _, port = options.proxy.rpartition(":")
+        proxy_server_host, proxy_server_port = host, int(port)
+    elif options.serve_proxy:
+        proxy_server_host, proxy_server_port = "127.0.0.1", 8229
+
+    if options.serve_proxy:
+        (proxy_server_host, proxy_server_port), _ = start_in_thread(
+            ReferenceProxy(),
+            host=proxy_server_host,
+            port=proxy_server_port,
+            name="reference-proxy",
+        )
+        print(f"Serving reference proxy on {proxy_server_host}:{proxy_server_port}")
+
+    relay = None
+    if options.impair:
+        relay = ImpairmentRelay(
+            (proxy_server_host, proxy_server_port),
+            LinkProfile.parse(options.impair),
+            seed=options.impair_seed,
+        )
+        (proxy_server_host, proxy_server_port), _ = start_in_thread(relay, name="impairment-relay")
+        print(f"Impairing the proxy link through {proxy_server_host}:{proxy_server_port}: {relay.up}")
+
+    if options.serve_dns:
+        (remote_host, remote_port), _ = start_in_thread(
+            DnsServer(DnsServerConfig(
+                answer_count=options.dns_answers,
+                delay_ms=options.dns_delay_ms,
+            )),
+            host=remote_host,
+            port=remote_port,
+            name="dns-server",
+        )
+        print(f"Serving DNS on {remote_host}:{remote_port}")
+        if remote_host in ("0.0.0.0", "::") or (remote_host.startswith("127.") and not options.serve_proxy):
+            # The queries, and a proxy on another machine, need an address
+            # they can route to
+            print("WARNING: pass --dns <this machine's LAN IP>:<port> so the proxy can reach it")
+
+    if options.concurrency > 0:
+        if options.duration > 0:
+            if options.processes > 1:
+                print("Soak mode runs in a single process, drop -p")
+                return 1
+            return run_soak(options, relay)
+
+        if options.processes > 1:
+            # Answered pairs stay in the workers, so there is nothing to diff
+            report = run_multi_load(
+                processes=options.processes,
+                domains=options.domains,
+                queries=options.queries,
+                concurrency=options.concurrency,
+                remote_host=socket.gethostbyname(remote_host),
+                remote_port=remote_port,
+                proxy_server_host=proxy_server_host,
+                proxy_server_port=proxy_server_port,
+                timeout=options.timeout,
+                rate=options.rate,
+            )
+        else:
+            report = asyncio.run(run_load(
+                domains=options.domains,
+                queries=options.queries,
+                concurrency=options.concurrency,
+                remote_host=socket.gethostbyname(remote_host),
+                remote_port=remote_port,
+                proxy_server_host=proxy_server_host,
+                proxy_server_port=proxy_server_port,
+                timeout=options.timeout,
+                compare=options.compare or options.serve_dns,
+                rate=options.rate,
+            ))
+        report.print()
+        print_latency_comparison(report.direct.latency, report.proxy.latency)
+        if relay is not None:
+            print_link_stats(relay)
+
+        mismatched = 0
+        if report.pairs is not None:
+            diff = report.pairs.diff()
+            diff.print()
+            mismatched = diff.mismatched
+        return 1 if report.direct.failed or report.proxy.failed or mismatched else 0
+
+    handshakes = HandshakeBreakdown().install() if options.handshakes else None
+    direct_path.retries = proxy_path.retries = options.retries
+
+    # The association outlives each query, so a late reply to one query must
+    # not carry the ID of the next
+    transaction_ids = itertools.cycle(range(0x1234, 0x10000))
+    for domain_name in options.domains:
         print(f"DNS: {domain_name}")
-        test_dns(transaction_id, domain_name)
+        # The bundled responder answers deterministically, so both paths must agree
+        test_dns(next(transaction_ids), domain_name, compare=options.serve_dns)
         print("")
 
+    print_latency_comparison(direct_latency, proxy_latency)
+    print_path_stats(direct_path, proxy_path)
+    if relay is not None:
+        print_link_stats(relay)
+    if handshakes is not None:
+        handshakes.uninstall()
+        handshakes.print()
     return 0
 
 if __name__ == "__main__":
@@ -14,14 +14,57 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+from __future__ import annotations
+from udp_retry import UdpPath
 import socket
+import time
+
+FAILED_RESP: bytes = bytes([])
+
+# Shared by every direct request, so the RTT estimate carries over
+direct_path = UdpPath("direct")
 
 def normal_udp_request(
     request: bytes,
     remote_host: str,
     remote_port: int,
+    path: UdpPath | None = None,
 ) -> bytes:
+    path = path or direct_path
+    transaction_id = request[:2]
+
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.sendto(request, (remote_host, remote_port))
-    (resp, _)= s.recvfrom(4096)
-    return resp
+    try:
+        # Connected, so the kernel drops anything not from the server
+        s.connect((remote_host, remote_port))
+
+        def wait(timeout: float) -> bytes | None:
+            deadline = time.monotonic() + timeout
+            while (remaining := deadline - time.monotonic()) > 0:
+                s.settimeout(remaining)
+                try:
+                    resp = s.recv(4096)
+                except socket.timeout:
+                    return None
+                if resp[:2] == transaction_id:
+                    return resp
+            return None
+
+        resp = path.exchange(lambda: s.send(request), wait)
+        if resp is None:
+            return FAILED_RESP
+
+        # Replies to the other copies that already made it back
+        s.setblocking(False)
+        while True:
+            try:
+                if s.recv(4096)[:2] == transaction_id:
+                    path.count_duplicate()
+            except (BlockingIOError, ConnectionRefusedError):
+                break
+        return resp
+    except ConnectionRefusedError:
+        # ICMP port unreachable, nothing listens there
+        return FAILED_RESP
+    finally:
+        s.close()
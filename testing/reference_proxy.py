@@ -0,0 +1,763 @@
+#!/usr/bin/python3
+
+# reference_proxy.py - known-fast local SOCKS4/4a/5 and HTTP proxy.
+#
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Speaks everything socksocket._proxy_negotiators does, plus SOCKS5 UDP
+# ASSOCIATE, on a single port. The protocol is picked from the first byte the
+# client sends, the same way TetherFi's SOCKS and HTTP sessions share a port.
+# Unlike TetherFi it also reassembles SOCKS5 UDP fragments, and fragments
+# replies when asked to. Plain HTTP requests with an absolute URL are
+# forwarded one at a time over keep-alive connections on both sides.
+# Benchmarks run against it measure the client pipeline on its own, and give
+# a baseline to hold the phone up against.
+
+from __future__ import annotations
+from base64 import b64encode
+from dataclasses import asdict, dataclass, field
+from http_wire import (
+    BODY_CHUNKED,
+    BODY_LENGTH,
+    BODY_UNTIL_CLOSE,
+    HEADER_END,
+    body_framing,
+    encode_head,
+    end_to_end,
+    header,
+    keep_alive,
+    parse_chunk_size,
+    parse_head,
+    split_absolute_url,
+)
+from socks_codec import (
+    UDPReassembler,
+    decode_socks5_address,
+    decode_socks5_udp_header,
+    encode_socks5_address,
+    encode_socks5_udp_header,
+    split_socks5_udp_payload,
+)
+from struct import pack, unpack
+import argparse
+import asyncio
+import json
+import socket
+import time
+
+SOCKS4_VERSION: int = 0x04
+SOCKS5_VERSION: int = 0x05
+
+SOCKS5_CMD_CONNECT: int = 0x01
+SOCKS5_CMD_UDP_ASSOCIATE: int = 0x03
+
+SOCKS5_REPLY_SUCCEEDED: int = 0x00
+SOCKS5_REPLY_GENERAL_FAILURE: int = 0x01
+SOCKS5_REPLY_HOST_UNREACHABLE: int = 0x04
+SOCKS5_REPLY_CONNECTION_REFUSED: int = 0x05
+SOCKS5_REPLY_COMMAND_NOT_SUPPORTED: int = 0x07
+
+SOCKS4_REPLY_GRANTED: int = 0x5A
+SOCKS4_REPLY_REJECTED: int = 0x5B
+
+# Big reads keep the per-chunk Python overhead down on bulk transfers
+_RELAY_CHUNK: int = 256 * 1024
+_MAX_HTTP_HEADER: int = 16 * 1024
+_UDP_RCVBUF: int = 4 * 1024 * 1024
+# Limited clients are relayed in small reads so the limit is checked often,
+# TetherFi copies 4 KiB at a time
+_LIMITED_CHUNK: int = 16 * 1024
+
+
+@dataclass
+class ProxyStats:
+    connections: dict[str, int] = field(default_factory=dict)
+    failures: int = 0
+    bytes_up: int = 0
+    bytes_down: int = 0
+    datagrams_up: int = 0
+    datagrams_down: int = 0
+    fragments_up: int = 0
+    fragments_down: int = 0
+    reassembled: int = 0
+    abandoned: int = 0
+    # Datagrams for a destination the relay socket's address family can't reach
+    unreachable: int = 0
+    # Distinct client IPs, and the time spent finding them on every session
+    clients: int = 0
+    client_lookups: int = 0
+    client_lookup_ns: int = 0
+    # Plain HTTP requests forwarded, and the origin connections they needed
+    http_requests: int = 0
+    http_origin_connections: int = 0
+
+    def count(self, protocol: str) -> None:
+        self.connections[protocol] = self.connections.get(protocol, 0) + 1
+
+
+@dataclass
+class TrackedClient:
+    host: str
+    first_seen: float
+    last_seen: float
+    sessions: int = 0
+
+
+class ClientTracker:
+    """Every client IP that opened a session, in the order they showed up.
+
+    Same shape as TetherFi's AllowedClients: a list behind a lock that each
+    new session scans for its IP, adding the client when it is not there, so
+    the cost of a session grows with the number of clients."""
+
+    def __init__(self, stats: ProxyStats):
+        self.clients: list[TrackedClient] = []
+        self._stats = stats
+        self._lock = asyncio.Lock()
+
+    async def seen(self, host: str) -> TrackedClient:
+        start = time.perf_counter_ns()
+        async with self._lock:
+            now = time.monotonic()
+            client = next((c for c in self.clients if c.host == host), None)
+            if client is None:
+                client = TrackedClient(host, first_seen=now, last_seen=now)
+                self.clients.append(client)
+                self._stats.clients = len(self.clients)
+            client.last_seen = now
+            client.sessions += 1
+        self._stats.client_lookups += 1
+        self._stats.client_lookup_ns += time.perf_counter_ns() - start
+        return client
+
+
+class BandwidthLimiter:
+    """Bytes one client moved in the current second, across all its connections.
+
+    Same scheme as TetherFi's clients/BandwidthLimiter.kt and
+    enforceBandwidthLimit(): a counter behind a lock that every read of
+    every connection of the client adds to. A read that takes it over the
+    limit sleeps out the rest of the client's second, and what went over
+    counts against the next one."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.waits: int = 0
+        self._lock = asyncio.Lock()
+        self._amount: int = 0
+        self._started: float = time.monotonic()
+
+    async def enforce(self, read: int) -> None:
+        """Counts read bytes, and waits for the next second if they go over."""
+        async with self._lock:
+            now = time.monotonic()
+            windows = int(now - self._started)
+            if windows:
+                # Every second that went by is over whether or not anyone hit
+                # the limit in it, an idle client gets back its whole allowance
+                self._amount = max(0, self._amount - self.limit * windows)
+                self._started += windows
+            self._amount += read
+            if self._amount <= self.limit:
+                return
+            delay = self._started + 1.0 - now
+            self.waits += 1
+        await asyncio.sleep(delay)
+
+
+async def _pipe(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    stats: ProxyStats,
+    upstream: bool,
+    limiter: BandwidthLimiter | None = None,
+) -> None:
+    chunk = _LIMITED_CHUNK if limiter else _RELAY_CHUNK
+    try:
+        while data := await reader.read(chunk):
+            if limiter:
+                await limiter.enforce(len(data))
+            writer.write(data)
+            if upstream:
+                stats.bytes_up += len(data)
+            else:
+                stats.bytes_down += len(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+    except (ConnectionError, OSError):
+        pass
+
+
+async def _relay(
+    client_reader: asyncio.StreamReader,
+    client_writer: asyncio.StreamWriter,
+    remote_reader: asyncio.StreamReader,
+    remote_writer: asyncio.StreamWriter,
+    stats: ProxyStats,
+    limiter: BandwidthLimiter | None = None,
+) -> None:
+    try:
+        await asyncio.gather(
+            _pipe(client_reader, remote_writer, stats, upstream=True, limiter=limiter),
+            _pipe(remote_reader, client_writer, stats, upstream=False, limiter=limiter),
+        )
+    finally:
+        remote_writer.close()
+
+
+async def _copy_http_body(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    framing: str,
+    length: int,
+) -> int:
+    """Relays one message body as it was framed, returns its size on the wire."""
+    copied = 0
+    if framing == BODY_LENGTH:
+        while copied < length:
+            data = await reader.read(min(_RELAY_CHUNK, length - copied))
+            if not data:
+                raise asyncio.IncompleteReadError(b"", length - copied)
+            writer.write(data)
+            copied += len(data)
+            await writer.drain()
+    elif framing == BODY_CHUNKED:
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            size = parse_chunk_size(line)
+            writer.write(line)
+            copied += len(line)
+            if not size:
+                break
+            # The chunk and the CRLF after it
+            chunk = await reader.readexactly(size + 2)
+            writer.write(chunk)
+            copied += len(chunk)
+            await writer.drain()
+        # Trailers, up to the blank line
+        while (line := await reader.readuntil(b"\r\n")) != b"\r\n":
+            writer.write(line)
+            copied += len(line)
+        writer.write(line)
+        copied += len(line)
+    elif framing == BODY_UNTIL_CLOSE:
+        while data := await reader.read(_RELAY_CHUNK):
+            writer.write(data)
+            copied += len(data)
+            await writer.drain()
+    return copied
+
+
+def _tune(writer: asyncio.StreamWriter) -> None:
+    sock = writer.get_extra_info("socket")
+    if sock is not None:
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+
+
+class _UdpRelayProtocol(asyncio.DatagramProtocol):
+    """One UDP ASSOCIATE relay, alive for as long as its control connection."""
+
+    def __init__(
+        self,
+        client_host: str,
+        client_port: int,
+        stats: ProxyStats,
+        fragment_size: int | None = None,
+    ):
+        self._client_host = client_host
+        self._client_port = client_port
+        self._client_addr: tuple[str, int] | None = None
+        self._stats = stats
+        self._fragment_size = fragment_size
+        self._transport: asyncio.DatagramTransport | None = None
+        self._resolved: dict[str, str] = {}
+        self._reassembler = UDPReassembler()
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self._transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        addr = addr[:2]
+        if addr == self._client_addr or self._is_client(addr):
+            self._client_addr = addr
+            self._from_client(data)
+        elif self._client_addr:
+            # Reply from the remote side, wrap it up for the client
+            header = encode_socks5_udp_header(*addr)
+            if self._fragment_size and len(data) > self._fragment_size:
+                try:
+                    fragments = split_socks5_udp_payload(header, data, self._fragment_size)
+                except ValueError:
+                    return
+                for fragment_header, chunk in fragments:
+                    self._transport.sendto(fragment_header + chunk, self._client_addr)
+                self._stats.fragments_down += len(fragments)
+            else:
+                self._transport.sendto(header + data, self._client_addr)
+            self._stats.datagrams_down += 1
+
+    def _is_client(self, addr: tuple[str, int]) -> bool:
+        # The client tells us which port it will send from. A zero port (or a
+        # wildcard host) means "whatever arrives first from the client host".
+        host, port = addr
+        if self._client_addr is not None:
+            return False
+        if self._client_port and port != self._client_port:
+            return False
+        return host == self._client_host
+
+    def _from_client(self, data: bytes) -> None:
+        try:
+            frag, host, port, offset = decode_socks5_udp_header(data, len(data))
+        except OSError:
+            return
+
+        payload = data[offset:]
+        if frag:
+            # Sequences are kept apart by destination, the client is one source
+            self._stats.fragments_up += 1
+            abandoned = self._reassembler.abandoned
+            payload = self._reassembler.feed(
+                (host, port), frag, payload, asyncio.get_running_loop().time())
+            self._stats.abandoned += self._reassembler.abandoned - abandoned
+            if payload is None:
+                return
+            self._stats.reassembled += 1
+
+        self._stats.datagrams_up += 1
+        resolved = self._resolved.get(host)
+        if resolved:
+            self._transport.sendto(payload, (resolved, port))
+        else:
+            asyncio.get_running_loop().create_task(self._resolve_and_send(host, port, payload))
+
+    async def _resolve_and_send(self, host: str, port: int, payload: bytes) -> None:
+        # The relay is bound on one address, so only destinations in its
+        # family are reachable, over IPv6 just as over IPv4
+        family = self._transport.get_extra_info("socket").family
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                host, port, family=family, type=socket.SOCK_DGRAM,
+            )
+        except OSError:
+            self._stats.unreachable += 1
+            return
+        resolved = infos[0][4][0]
+        self._resolved[host] = resolved
+        if not self._transport.is_closing():
+            self._transport.sendto(payload, (resolved, port))
+
+
+class ReferenceProxy:
+    """SOCKS4/4a/5 and HTTP CONNECT proxy on one port."""
+
+    def __init__(
+        self,
+        user: str | None = None,
+        pwd: str | None = None,
+        udp_fragment_size: int | None = None,
+        client_limit: int = 0,
+    ):
+        self.user = user
+        self.pwd = pwd
+        # Replies bigger than this go back to UDP clients as fragments
+        self.udp_fragment_size = udp_fragment_size
+        # Bytes per second each client IP may relay over TCP, 0 for no limit
+        self.client_limit = client_limit
+        self.limiters: dict[str, BandwidthLimiter] = {}
+        self.stats = ProxyStats()
+        self.tracker = ClientTracker(self.stats)
+        self.address: tuple[str, int] | None = None
+        self._server: asyncio.Server | None = None
+
+        # asyncio only keeps weak references to the per-client tasks, and drops
+        # its own once the client hangs up, so hold them here until they finish
+        self._sessions: set[asyncio.Task] = set()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> tuple[str, int]:
+        self._server = await asyncio.start_server(self._serve, host, port)
+        self.address = self._server.sockets[0].getsockname()[:2]
+        return self.address
+
+    async def stop(self) -> None:
+        # Since Python 3.12.1 wait_closed() also waits for every client
+        # connection, so the sessions have to end before it
+        if self._server:
+            self._server.close()
+        sessions = list(self._sessions)
+        for session in sessions:
+            session.cancel()
+        await asyncio.gather(*sessions, return_exceptions=True)
+        if self._server:
+            await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = asyncio.current_task()
+        self._sessions.add(session)
+        _tune(writer)
+        try:
+            await self.tracker.seen(writer.get_extra_info("peername")[0])
+            first = await reader.readexactly(1)
+            if first[0] == SOCKS5_VERSION:
+                await self._serve_socks5(reader, writer)
+            elif first[0] == SOCKS4_VERSION:
+                await self._serve_socks4(reader, writer)
+            else:
+                await self._serve_http(first, reader, writer)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError, ValueError):
+            self.stats.failures += 1
+        except asyncio.CancelledError:
+            # Shut down with the client still connected. Python 3.11's stream
+            # callback reports a cancelled session as an unhandled error
+            pass
+        finally:
+            writer.close()
+            self._sessions.discard(session)
+
+    def _limiter_for(self, writer: asyncio.StreamWriter) -> BandwidthLimiter | None:
+        # TetherFi tells clients apart by IP address
+        if not self.client_limit:
+            return None
+        host = writer.get_extra_info("peername")[0]
+        limiter = self.limiters.get(host)
+        if limiter is None:
+            limiter = self.limiters[host] = BandwidthLimiter(self.client_limit)
+        return limiter
+
+    async def _open_remote(
+        self,
+        host: str,
+        port: int,
+    ) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        remote_reader, remote_writer = await asyncio.open_connection(host, port)
+        _tune(remote_writer)
+        return remote_reader, remote_writer
+
+    # SOCKS5
+
+    async def _serve_socks5(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        method_count = (await reader.readexactly(1))[0]
+        methods = await reader.readexactly(method_count)
+
+        if self.user:
+            if 0x02 not in methods:
+                writer.write(b"\x05\xff")
+                return
+            writer.write(b"\x05\x02")
+            if not await self._socks5_authenticate(reader, writer):
+                return
+        elif 0x00 in methods:
+            writer.write(b"\x05\x00")
+        else:
+            writer.write(b"\x05\xff")
+            return
+
+        version, cmd, _ = await reader.readexactly(3)
+        if version != SOCKS5_VERSION:
+            raise ValueError("Bad SOCKS5 request version")
+
+        atyp = await reader.readexactly(1)
+        if atyp[0] == 0x01:
+            raw = atyp + await reader.readexactly(4 + 2)
+        elif atyp[0] == 0x04:
+            raw = atyp + await reader.readexactly(16 + 2)
+        elif atyp[0] == 0x03:
+            length = await reader.readexactly(1)
+            raw = atyp + length + await reader.readexactly(length[0] + 2)
+        else:
+            writer.write(self._socks5_reply(0x08))
+            return
+        host, port, _ = decode_socks5_address(raw, 0)
+
+        if cmd == SOCKS5_CMD_CONNECT:
+            self.stats.count("SOCKS5")
+            try:
+                remote_reader, remote_writer = await self._open_remote(host, port)
+            except ConnectionRefusedError:
+                writer.write(self._socks5_reply(SOCKS5_REPLY_CONNECTION_REFUSED))
+                return
+            except OSError:
+                writer.write(self._socks5_reply(SOCKS5_REPLY_HOST_UNREACHABLE))
+                return
+
+            bound = remote_writer.get_extra_info("sockname")
+            writer.write(self._socks5_reply(SOCKS5_REPLY_SUCCEEDED, bound[0], bound[1]))
+            await _relay(reader, writer, remote_reader, remote_writer, self.stats, self._limiter_for(writer))
+        elif cmd == SOCKS5_CMD_UDP_ASSOCIATE:
+            self.stats.count("SOCKS5-UDP")
+            await self._socks5_udp_associate(reader, writer, host, port)
+        else:
+            writer.write(self._socks5_reply(SOCKS5_REPLY_COMMAND_NOT_SUPPORTED))
+
+    async def _socks5_authenticate(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        version, user_length = await reader.readexactly(2)
+        user = await reader.readexactly(user_length)
+        pwd_length = (await reader.readexactly(1))[0]
+        pwd = await reader.readexactly(pwd_length)
+
+        ok = version == 0x01 and user == self.user.encode() and pwd == (self.pwd or "").encode()
+        writer.write(b"\x01\x00" if ok else b"\x01\x01")
+        return ok
+
+    @staticmethod
+    def _socks5_reply(status: int, host: str = "0.0.0.0", port: int = 0) -> bytes:
+        return bytes([SOCKS5_VERSION, status, 0x00]) + encode_socks5_address(host, port)
+
+    async def _socks5_udp_associate(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        client_host: str,
+        client_port: int,
+    ) -> None:
+        peer_host = writer.get_extra_info("peername")[0]
+        if client_host in ("0.0.0.0", "::", "0"):
+            client_host = peer_host
+
+        # Bind the relay on the address the client reached us on
+        local_host = writer.get_extra_info("sockname")[0]
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: _UdpRelayProtocol(client_host, client_port, self.stats, self.udp_fragment_size),
+            local_addr=(local_host, 0),
+        )
+        try:
+            # Bursts of big datagrams overflow the default buffer long before
+            # the event loop falls behind
+            transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, _UDP_RCVBUF)
+        except OSError:
+            pass
+        try:
+            relay_host, relay_port = transport.get_extra_info("sockname")[:2]
+            writer.write(self._socks5_reply(SOCKS5_REPLY_SUCCEEDED, relay_host, relay_port))
+            await writer.drain()
+
+            # The association lives exactly as long as the control connection
+            while await reader.read(1024):
+                pass
+        finally:
+            transport.close()
+
+    # SOCKS4 and SOCKS4a
+
+    async def _serve_socks4(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        cmd, port = unpack(">BH", await reader.readexactly(3))
+        ip = await reader.readexactly(4)
+        user = (await reader.readuntil(b"\x00"))[:-1]
+
+        if ip[:3] == b"\x00\x00\x00" and ip[3] != 0:
+            # SOCKS4a, the host name follows the user ID
+            host = (await reader.readuntil(b"\x00"))[:-1].decode("idna")
+            self.stats.count("SOCKS4a")
+        else:
+            host = socket.inet_ntoa(ip)
+            self.stats.count("SOCKS4")
+
+        if cmd != 0x01 or (self.user and user != self.user.encode()):
+            writer.write(pack(">BBH", 0x00, SOCKS4_REPLY_REJECTED, 0) + b"\x00" * 4)
+            return
+
+        try:
+            remote_reader, remote_writer = await self._open_remote(host, port)
+        except OSError:
+            writer.write(pack(">BBH", 0x00, SOCKS4_REPLY_REJECTED, 0) + b"\x00" * 4)
+            return
+
+        bound_host, bound_port = remote_writer.get_extra_info("sockname")[:2]
+        writer.write(
+            pack(">BBH", 0x00, SOCKS4_REPLY_GRANTED, bound_port)
+            + socket.inet_aton(bound_host)
+        )
+        await _relay(reader, writer, remote_reader, remote_writer, self.stats, self._limiter_for(writer))
+
+    # HTTP CONNECT
+
+    async def _serve_http(
+        self,
+        first: bytes,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        head = first + await reader.readuntil(b"\r\n\r\n")
+        if len(head) > _MAX_HTTP_HEADER:
+            writer.write(b"HTTP/1.1 431 Request Header Fields Too Large\r\n\r\n")
+            return
+
+        method, target, version, headers = parse_head(head)
+
+        if self.user:
+            expected = "basic " + b64encode(
+                f"{self.user}:{self.pwd or ''}".encode()).decode()
+            if (header(headers, "proxy-authorization") or "").lower() != expected.lower():
+                writer.write(b"HTTP/1.1 407 Proxy Authentication Required\r\n\r\n")
+                return
+
+        if method != "CONNECT":
+            self.stats.count("HTTP-forward")
+            await self._forward_http(method, target, version, headers, reader, writer)
+            return
+
+        self.stats.count("HTTP")
+        host, _, port = target.rpartition(":")
+        try:
+            remote_reader, remote_writer = await self._open_remote(host.strip("[]"), int(port))
+        except OSError:
+            writer.write(b"HTTP/1.1 502 Bad Gateway\r\n\r\n")
+            return
+
+        writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+        await _relay(reader, writer, remote_reader, remote_writer, self.stats, self._limiter_for(writer))
+
+    # Plain HTTP forwarding
+
+    async def _forward_http(
+        self,
+        method: str,
+        target: str,
+        version: str,
+        headers: list[tuple[str, str]],
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        origin: tuple[str, int] | None = None
+        remote_reader: asyncio.StreamReader | None = None
+        remote_writer: asyncio.StreamWriter | None = None
+        try:
+            while True:
+                try:
+                    host, port, path = split_absolute_url(target)
+                except ValueError:
+                    writer.write(b"HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n")
+                    return
+
+                if origin != (host, port):
+                    if remote_writer is not None:
+                        remote_writer.close()
+                        remote_writer = None
+                    try:
+                        remote_reader, remote_writer = await self._open_remote(host, port)
+                    except OSError:
+                        writer.write(b"HTTP/1.1 502 Bad Gateway\r\nConnection: close\r\n\r\n")
+                        return
+                    origin = (host, port)
+                    self.stats.http_origin_connections += 1
+
+                # Requests go on in origin-form, minus anything meant for us
+                client_keep_alive = keep_alive(version, headers)
+                forwarded = end_to_end(headers)
+                if header(forwarded, "host") is None:
+                    forwarded.insert(0, ("Host", host if port == 80 else f"{host}:{port}"))
+                remote_writer.write(encode_head(f"{method} {path} HTTP/1.1", forwarded))
+                framing, length = body_framing(headers, request=True)
+                self.stats.bytes_up += await _copy_http_body(reader, remote_writer, framing, length)
+                self.stats.http_requests += 1
+
+                # Interim 1xx responses go straight through ahead of the final one
+                while True:
+                    head = await remote_reader.readuntil(HEADER_END)
+                    remote_version, status, reason, remote_headers = parse_head(head)
+                    status = int(status)
+                    if not 100 <= status < 200:
+                        break
+                    writer.write(head)
+
+                framing, length = body_framing(remote_headers, request=False, method=method, status=status)
+                origin_keep_alive = keep_alive(remote_version, remote_headers) and framing != BODY_UNTIL_CLOSE
+                client_keep_alive = client_keep_alive and framing != BODY_UNTIL_CLOSE
+                returned = end_to_end(remote_headers)
+                returned.append(("Connection", "keep-alive" if client_keep_alive else "close"))
+                writer.write(encode_head(f"HTTP/1.1 {status} {reason}", returned))
+                self.stats.bytes_down += await _copy_http_body(remote_reader, writer, framing, length)
+                await writer.drain()
+
+                if not origin_keep_alive:
+                    remote_writer.close()
+                    origin = remote_writer = None
+                if not client_keep_alive:
+                    return
+
+                # Pipelined requests are already waiting in the reader
+                try:
+                    head = await reader.readuntil(HEADER_END)
+                except asyncio.IncompleteReadError as e:
+                    if e.partial:
+                        raise
+                    return
+                method, target, version, headers = parse_head(head)
+        finally:
+            if remote_writer is not None:
+                remote_writer.close()
+
+
+async def _serve_forever(options: argparse.Namespace) -> None:
+    proxy = ReferenceProxy(
+        user=options.user,
+        pwd=options.password,
+        udp_fragment_size=options.udp_fragment_size,
+        client_limit=options.client_limit,
+    )
+    host, port = await proxy.start(options.host, options.port)
+    print(f"Reference proxy listening on {host}:{port} (SOCKS4/4a/5, HTTP CONNECT and forwarding, UDP)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await proxy.stop()
+        print(f"STATS: {proxy.stats}")
+        if options.stats:
+            with open(options.stats, "w") as f:
+                json.dump(asdict(proxy.stats), f, indent=2)
+
+
+def main(args: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Reference SOCKS and HTTP proxy")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8229, help="Port for every protocol")
+    parser.add_argument("--user", help="Require this username")
+    parser.add_argument("--password", help="Require this password")
+    parser.add_argument(
+        "--udp-fragment-size",
+        type=int,
+        help="Send UDP replies bigger than this to the client as SOCKS5 fragments",
+    )
+    parser.add_argument(
+        "--client-limit",
+        type=int,
+        default=0,
+        help="Bytes per second each client IP may relay over TCP, the way TetherFi enforces its bandwidth limit",
+    )
+    parser.add_argument("--stats", metavar="FILE", help="Write the stats here as JSON on shutdown")
+    options = parser.parse_args(args)
+
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
+    try:
+        asyncio.run(_serve_forever(options))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+
+    exit_code = main(sys.argv[1:])
+    sys.exit(exit_code)
@@ -0,0 +1,553 @@
+#!/usr/bin/python3
+
+# scenario.py - run a benchmark described by a scenario file, keep the results.
+#
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# A scenario file (JSON, or TOML where tomllib is available) says what to
+# run: the proxy, an optional impaired link in front of it, and a mix of
+# workloads that all run at once for the same warm-up and duration. Every
+# workload runs in its own process, so they only compete the way real
+# clients of the phone would. The result bundle is one JSON file holding
+# the scenario as it was run, its hash, the machine and harness it ran on,
+# and what every workload measured. The same file gives the same run on
+# anyone's machine, against any build of the app.
+
+from __future__ import annotations
+from background import start_in_thread
+from bench_clients import loopback_sources
+from bench_common import free_port, process_cpu_seconds, run_echo, run_origin, run_sink_source, spawn_script
+from bench_http_forward import MODE_KEEP_ALIVE, MODE_PIPELINE, MODE_RECONNECT
+from dataclasses import asdict, dataclass, field, fields
+from datetime import datetime, timezone
+from dns_server import DnsServer, DnsServerConfig
+from impairment import ImpairmentRelay, LinkProfile
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+BUNDLE_FORMAT: int = 1
+
+WORKLOAD_DNS: str = "dns"
+WORKLOAD_TCP: str = "tcp"
+WORKLOAD_UDP: str = "udp"
+WORKLOAD_HTTP: str = "http"
+WORKLOAD_TYPES: tuple[str, ...] = (WORKLOAD_DNS, WORKLOAD_TCP, WORKLOAD_UDP, WORKLOAD_HTTP)
+
+# Proxy address that spawns reference_proxy.py, and DNS server that starts
+# the bundled responder
+REFERENCE_PROXY: str = "reference"
+BUNDLED_DNS: str = "bundled"
+
+# Time for every workload process to start before the clock does
+_SPAWN_TIMEOUT: float = 30.0
+
+
+@dataclass
+class ProxySpec:
+    # HOST:PORT of the proxy, e.g. the phone, or "reference" for a local one
+    address: str = REFERENCE_PROXY
+    user: str | None = None
+    password: str | None = None
+    # LinkProfile strings for the hop to the proxy, down defaults to up
+    impair: str | None = None
+    impair_down: str | None = None
+    # Bytes per second per client IP, only for the reference proxy
+    client_limit: int = 0
+
+
+@dataclass
+class Workload:
+    type: str
+    name: str = ""
+    # Queries in flight per path for dns, clients for tcp and udp, workers for http
+    concurrency: int = 1
+    # Queries per second per path for dns, requests per second for http, 0 for flat out
+    rate: float = 0.0
+    # Datagram size for udp, response body size for http
+    payload: int = 1200
+    # tcp only
+    streams: int = 1
+    direction: str = "down"
+    # Give each tcp or udp client its own 127.0.x.y, so the proxy tells them apart
+    own_sources: bool = False
+    # http only
+    mode: str = MODE_KEEP_ALIVE
+    depth: int = 8
+    # dns only, server is HOST:PORT or "bundled"
+    domains: list[str] = field(default_factory=lambda: ["example.com"])
+    server: str = BUNDLED_DNS
+    timeout: float = 2.0
+    answers: int = 6
+
+
+@dataclass
+class Scenario:
+    name: str
+    workloads: list[Workload]
+    duration: float = 10.0
+    warmup: float = 2.0
+    seed: int = 0
+    # Where local servers listen, it has to be reachable from the proxy
+    serve_on: str = "127.0.0.1"
+    proxy: ProxySpec = field(default_factory=ProxySpec)
+
+    @classmethod
+    def load(cls, path: str) -> Scenario:
+        with open(path, "rb") as f:
+            raw = f.read()
+        if path.endswith(".toml"):
+            if tomllib is None:
+                raise ValueError("TOML scenarios need Python 3.11 or newer, use JSON instead")
+            data = tomllib.loads(raw.decode("utf-8"))
+        else:
+            data = json.loads(raw)
+        return cls.from_dict(data)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> Scenario:
+        scenario = _build(cls, data, "scenario", {
+            "workloads": lambda value, where: [
+                _build(Workload, item, f"{where}[{index}]") for index, item in enumerate(value)
+            ],
+            "proxy": lambda value, where: _build(ProxySpec, value, where),
+        })
+        scenario.validate()
+        return scenario
+
+    def validate(self) -> None:
+        if not self.workloads:
+            raise ValueError("scenario: at least one workload is needed")
+        if self.duration <= 0 or self.warmup < 0:
+            raise ValueError("scenario: duration must be positive and warmup not negative")
+        if self.proxy.address != REFERENCE_PROXY and ":" not in self.proxy.address:
+            raise ValueError(f"proxy.address: expected HOST:PORT or {REFERENCE_PROXY!r}")
+        if self.proxy.client_limit and self.proxy.address != REFERENCE_PROXY:
+            raise ValueError("proxy.client_limit: only the reference proxy can be given a limit")
+        for spec in (self.proxy.impair, self.proxy.impair_down):
+            if spec:
+                LinkProfile.parse(spec)
+
+        names = set()
+        for index, workload in enumerate(self.workloads):
+            where = f"workloads[{index}]"
+            if workload.type not in WORKLOAD_TYPES:
+                raise ValueError(f"{where}.type: expected one of {', '.join(WORKLOAD_TYPES)}")
+            workload.name = workload.name or f"{workload.type}-{index}"
+            if workload.name in names:
+                raise ValueError(f"{where}.name: {workload.name!r} is used twice")
+            names.add(workload.name)
+            if workload.concurrency < 1:
+                raise ValueError(f"{where}.concurrency: must be at least 1")
+            if workload.rate and workload.type in (WORKLOAD_TCP, WORKLOAD_UDP):
+                raise ValueError(f"{where}.rate: {workload.type} workloads run flat out, cap them with client_limit")
+            if self.proxy.user and workload.type in (WORKLOAD_TCP, WORKLOAD_UDP):
+                raise ValueError(f"{where}: {workload.type} workloads do not log in to the proxy")
+            if workload.type == WORKLOAD_HTTP and workload.mode not in (MODE_RECONNECT, MODE_KEEP_ALIVE, MODE_PIPELINE):
+                raise ValueError(f"{where}.mode: expected reconnect, keep-alive or pipeline")
+            if workload.type == WORKLOAD_TCP and workload.direction not in ("up", "down"):
+                raise ValueError(f"{where}.direction: expected up or down")
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _build(cls: type, data: object, where: str, nested: dict | None = None):
+    # Unknown keys are mistakes, a typo must not quietly become a default
+    if not isinstance(data, dict):
+        raise ValueError(f"{where}: expected a table")
+    known = {f.name for f in fields(cls)}
+    unknown = set(data) - known
+    if unknown:
+        raise ValueError(f"{where}: unknown keys {', '.join(sorted(unknown))}")
+    values = dict(data)
+    for name, build in (nested or {}).items():
+        if name in values:
+            values[name] = build(values[name], f"{where}.{name}")
+    try:
+        return cls(**values)
+    except TypeError as e:
+        raise ValueError(f"{where}: {e}") from None
+
+
+def _dns_result(report) -> dict:
+    def path(stats) -> dict:
+        return {
+            "sent": stats.sent,
+            "answered": stats.answered,
+            "timeouts": stats.timeouts,
+            "errors": stats.errors,
+            "queries_per_second": report.qps(stats),
+            "latency_ns": stats.latency.summary(),
+        }
+
+    return {
+        "elapsed_seconds": report.elapsed_seconds,
+        "direct": path(report.direct),
+        "proxy": path(report.proxy),
+        "errors": report.proxy.failed,
+    }
+
+
+def _measure(workload: Workload, context: dict, seconds: float, seed: int) -> dict:
+    proxy = tuple(context["proxy"])
+    if workload.type == WORKLOAD_DNS:
+        from dns_load import run_load
+
+        domains = list(workload.domains)
+        random.Random(seed).shuffle(domains)
+        host, port = context["dns"][workload.name]
+        report = asyncio.run(run_load(
+            domains=domains,
+            queries=0,
+            concurrency=workload.concurrency,
+            remote_host=host,
+            remote_port=port,
+            proxy_server_host=proxy[0],
+            proxy_server_port=proxy[1],
+            user=context["user"],
+            pwd=context["password"],
+            timeout=workload.timeout,
+            rate=workload.rate,
+            duration=seconds,
+        ))
+        return _dns_result(report)
+
+    if workload.type in (WORKLOAD_TCP, WORKLOAD_UDP):
+        from bench_fairness import measure
+
+        sources = loopback_sources(workload.concurrency) if workload.own_sources else []
+        result = measure(
+            workload.type,
+            workload.direction,
+            workload.concurrency,
+            workload.streams,
+            seconds,
+            proxy,
+            tuple(context["targets"][workload.type]),
+            sources,
+            context["client_limit"],
+            None,
+            udp_payload=workload.payload,
+        )
+        return result.to_dict()
+
+    from bench_http_forward import measure
+
+    origin = context["targets"][WORKLOAD_HTTP]
+    url = f"http://{origin[0]}:{origin[1]}/bytes/{workload.payload}"
+    result = measure(
+        proxy,
+        url,
+        workload.mode,
+        workload.concurrency,
+        workload.depth,
+        workload.payload,
+        0,
+        None,
+        seconds=seconds,
+        rate=workload.rate,
+        user=context["user"],
+        pwd=context["password"],
+    )
+    return result.to_dict()
+
+
+def _run_workload(
+    spec: dict,
+    context: dict,
+    seed: int,
+    warmup: float,
+    duration: float,
+    start: multiprocessing.Barrier,
+    results: multiprocessing.Queue,
+) -> None:
+    workload = Workload(**spec)
+    random.seed(seed)
+    try:
+        start.wait(_SPAWN_TIMEOUT)
+        if warmup > 0:
+            _measure(workload, context, warmup, seed)
+        result = _measure(workload, context, duration, seed)
+        results.put((workload.name, result, None))
+    except Exception as e:
+        results.put((workload.name, None, f"{type(e).__name__}: {e}"))
+
+
+def _harness_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            timeout=5,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def environment(app_version: str | None) -> dict:
+    return {
+        "app_version": app_version,
+        "harness_commit": _harness_commit(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run_scenario(
+    scenario: Scenario,
+    scenario_bytes: bytes | None = None,
+    app_version: str | None = None,
+) -> dict:
+    """Runs every workload at once and returns the result bundle."""
+    ctx = multiprocessing.get_context("spawn")
+    children: list = []
+    proxy_process: subprocess.Popen | None = None
+    relay: ImpairmentRelay | None = None
+    serve_on = scenario.serve_on
+    context: dict = {
+        "user": scenario.proxy.user,
+        "password": scenario.proxy.password,
+        "client_limit": scenario.proxy.client_limit,
+        "targets": {},
+        "dns": {},
+    }
+
+    with tempfile.TemporaryDirectory() as scratch:
+        stats_path = os.path.join(scratch, "proxy-stats.json")
+        try:
+            # Whatever the workloads talk to, each on a port of its own
+            types = {workload.type for workload in scenario.workloads}
+            for kind, run_server, sock_type in (
+                (WORKLOAD_TCP, run_sink_source, socket.SOCK_STREAM),
+                (WORKLOAD_UDP, run_echo, socket.SOCK_DGRAM),
+                (WORKLOAD_HTTP, run_origin, socket.SOCK_STREAM),
+            ):
+                if kind not in types:
+                    continue
+                port = free_port(serve_on, sock_type)
+                ready = ctx.Event()
+                server = ctx.Process(target=run_server, args=(serve_on, port, ready), daemon=True)
+                server.start()
+                children.append(server)
+                if not ready.wait(_SPAWN_TIMEOUT):
+                    raise RuntimeError(f"{kind} server did not start")
+                context["targets"][kind] = (serve_on, port)
+
+            for workload in scenario.workloads:
+                if workload.type != WORKLOAD_DNS:
+                    continue
+                if workload.server == BUNDLED_DNS:
+                    address, _ = start_in_thread(
+                        DnsServer(DnsServerConfig(answer_count=workload.answers)),
+                        host=serve_on,
+                        name=f"dns-{workload.name}",
+                    )
+                else:
+                    host, _, port = workload.server.rpartition(":")
+                    address = (socket.gethostbyname(host), int(port))
+                context["dns"][workload.name] = address
+
+            if scenario.proxy.address == REFERENCE_PROXY:
+                arguments = [
+                    "--host",
+                    # Clients with their own 127.0.x.y still need to reach it
+                    "0.0.0.0",
+                    "--client-limit",
+                    str(scenario.proxy.client_limit),
+                    "--stats",
+                    stats_path,
+                ]
+                if scenario.proxy.user:
+                    arguments += ["--user", scenario.proxy.user, "--password", scenario.proxy.password or ""]
+                proxy_process, proxy = spawn_script("reference_proxy.py", *arguments)
+            else:
+                host, _, port = scenario.proxy.address.rpartition(":")
+                proxy = (host, int(port))
+
+            if scenario.proxy.impair:
+                up = LinkProfile.parse(scenario.proxy.impair)
+                down = LinkProfile.parse(scenario.proxy.impair_down) if scenario.proxy.impair_down else None
+                relay = ImpairmentRelay(proxy, up, down, seed=scenario.seed)
+                proxy, _ = start_in_thread(relay, name="impairment-relay")
+            context["proxy"] = proxy
+
+            start = ctx.Barrier(len(scenario.workloads) + 1)
+            queue = ctx.Queue()
+            workers = []
+            for index, workload in enumerate(scenario.workloads):
+                worker = ctx.Process(
+                    target=_run_workload,
+                    args=(asdict(workload), context, scenario.seed + index,
+                          scenario.warmup, scenario.duration, start, queue),
+                    daemon=True,
+                )
+                worker.start()
+                workers.append(worker)
+                children.append(worker)
+
+            start.wait(_SPAWN_TIMEOUT)
+            started_at = datetime.now(timezone.utc)
+            time.sleep(scenario.warmup)
+            proxy_cpu_start = process_cpu_seconds(proxy_process.pid) if proxy_process else None
+
+            # Slack for DNS timeouts and slow teardown on top of the run itself
+            collected: dict[str, tuple[dict | None, str | None]] = {}
+            patience = scenario.duration + 60.0
+            for _ in workers:
+                name, result, error = queue.get(timeout=patience)
+                collected[name] = (result, error)
+            proxy_cpu = None
+            if proxy_cpu_start is not None:
+                proxy_cpu_end = process_cpu_seconds(proxy_process.pid)
+                if proxy_cpu_end is not None:
+                    proxy_cpu = proxy_cpu_end - proxy_cpu_start
+            for worker in workers:
+                worker.join()
+
+            proxy_stats = None
+            if proxy_process is not None:
+                # SIGINT so it shuts down cleanly and writes its stats
+                proxy_process.send_signal(signal.SIGINT)
+                proxy_process.wait(10)
+                proxy_process = None
+                try:
+                    with open(stats_path) as f:
+                        proxy_stats = json.load(f)
+                except (OSError, ValueError):
+                    pass
+        finally:
+            if proxy_process is not None:
+                proxy_process.kill()
+                proxy_process.wait()
+            for child in children:
+                if child.is_alive():
+                    child.terminate()
+                child.join()
+
+    bundle = {
+        "format": BUNDLE_FORMAT,
+        "scenario": scenario.to_dict(),
+        "scenario_sha256": hashlib.sha256(scenario_bytes).hexdigest() if scenario_bytes is not None else None,
+        "environment": environment(app_version),
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "proxy": {
+            "address": scenario.proxy.address,
+            "cpu_seconds": proxy_cpu,
+            "stats": proxy_stats,
+        },
+        "link": None if relay is None else {
+            "up": asdict(relay.up_stats),
+            "down": asdict(relay.down_stats),
+        },
+        "workloads": [
+            {
+                "name": workload.name,
+                "type": workload.type,
+                "result": collected[workload.name][0],
+                "error": collected[workload.name][1],
+            }
+            for workload in scenario.workloads
+        ],
+    }
+    return bundle
+
+
+def print_bundle(bundle: dict) -> None:
+    print(f"SCENARIO: {bundle['scenario']['name']} at {bundle['started_at']}, {bundle['scenario']['duration']:g}s")
+    print(f"{'WORKLOAD':<20}{'TYPE':<6}{'RATE':>14}{'p50':>12}{'p99':>12}{'ERRORS':>8}")
+    for workload in bundle["workloads"]:
+        result = workload["result"]
+        if result is None:
+            print(f"{workload['name']:<20}{workload['type']:<6}  FAILED: {workload['error']}")
+            continue
+        if workload["type"] == WORKLOAD_DNS:
+            rate = f"{result['proxy']['queries_per_second']:.0f} q/s"
+            latency = result["proxy"]["latency_ns"]
+        elif workload["type"] == WORKLOAD_HTTP:
+            rate = f"{result['requests_per_second']:.0f} req/s"
+            latency = result["latency_ns"]
+        else:
+            rate = f"{result['megabytes_per_second']:.2f} MB/s"
+            latency = None
+        p50 = "-" if latency is None else f"{latency['p50'] / 1e6:.3f}ms"
+        p99 = "-" if latency is None else f"{latency['p99'] / 1e6:.3f}ms"
+        print(f"{workload['name']:<20}{workload['type']:<6}{rate:>14}{p50:>12}{p99:>12}{result['errors']:>8}")
+    if bundle["proxy"]["cpu_seconds"] is not None:
+        print(f"PROXY CPU: {bundle['proxy']['cpu_seconds']:.2f}s")
+
+
+def main(args: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Run a benchmark scenario file and write its result bundle")
+    parser.add_argument("scenario", help="Scenario file, .json or .toml")
+    parser.add_argument(
+        "-o",
+        "--out",
+        default="results",
+        help="Directory for the result bundle, named after the scenario and the start time",
+    )
+    parser.add_argument("--app-version", help="Build of the app under test, recorded in the bundle")
+    parser.add_argument("--seed", type=int, help="Override the scenario's seed")
+    options = parser.parse_args(args)
+
+    try:
+        with open(options.scenario, "rb") as f:
+            scenario_bytes = f.read()
+        scenario = Scenario.load(options.scenario)
+    except (OSError, ValueError) as e:
+        print(f"Bad scenario {options.scenario}: {e}")
+        return 1
+    if options.seed is not None:
+        scenario.seed = options.seed
+
+    bundle = run_scenario(scenario, scenario_bytes, options.app_version)
+    print_bundle(bundle)
+
+    os.makedirs(options.out, exist_ok=True)
+    stamp = bundle["started_at"].replace(":", "").replace("+0000", "Z")
+    path = os.path.join(options.out, f"{scenario.name}-{stamp}.json")
+    with open(path, "w") as f:
+        json.dump(bundle, f, indent=2, sort_keys=True)
+    print(f"BUNDLE: {path}")
+
+    failed = any(w["result"] is None or w["result"]["errors"] for w in bundle["workloads"])
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    exit_code = main(sys.argv[1:])
+    sys.exit(exit_code)
@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from dns_load import LoadReport, PathStats
+from histogram import REPORT_PERCENTILES, LatencyHistogram
+from typing import TextIO
+import csv
+import json
+import os
+import sys
+import time
+
+_COUNTERS: tuple[str, ...] = ("sent", "answered", "timeouts", "errors")
+
+
+def count_open_fds() -> tuple[int, int]:
+    """Open file descriptors and how many of them are sockets, from /proc."""
+    fds = 0
+    sockets = 0
+    try:
+        names = os.listdir("/proc/self/fd")
+    except OSError:
+        return 0, 0
+
+    for name in names:
+        try:
+            target = os.readlink(f"/proc/self/fd/{name}")
+        except OSError:
+            # Closed between listdir() and readlink(), or the listdir fd itself
+            continue
+        fds += 1
+        if target.startswith("socket:"):
+            sockets += 1
+    return fds, sockets
+
+
+class SoakRecorder:
+    """Turns the live LoadReport of a long run into one metrics row per interval.
+
+    Pass sample() as the progress callback of run_load(). Each call takes
+    the latencies recorded since the last one out of the report, writes
+    their percentiles and the counter deltas as one row, and folds them into
+    histograms covering the whole run. Rows go straight to the file, so
+    memory stays the same after hours as after seconds."""
+
+    def __init__(self, out: TextIO, fmt: str = "jsonl", echo: bool = True):
+        if fmt not in ("jsonl", "csv"):
+            raise ValueError(f"Unknown metrics format: {fmt}")
+        self.out = out
+        self.fmt = fmt
+        self.echo = echo
+        self.rows: int = 0
+        self.direct_latency = LatencyHistogram()
+        self.proxy_latency = LatencyHistogram()
+
+        self._csv: csv.DictWriter | None = None
+        self._last_elapsed: float = 0.0
+        self._last_counts: dict[str, int] = {}
+
+    @staticmethod
+    def format_for(path: str) -> str:
+        return "csv" if path.endswith(".csv") else "jsonl"
+
+    def _path_fields(self, prefix: str, stats: PathStats, interval: float) -> dict:
+        row = {}
+        for name in _COUNTERS:
+            key = f"{prefix}_{name}"
+            value = getattr(stats, name)
+            row[key] = value - self._last_counts.get(key, 0)
+            self._last_counts[key] = value
+
+        row[f"{prefix}_qps"] = round(row[f"{prefix}_answered"] / interval, 1) if interval > 0 else 0.0
+        latency = stats.latency
+        for p in REPORT_PERCENTILES:
+            row[f"{prefix}_p{p:g}_ns"] = latency.percentile(p)
+        row[f"{prefix}_max_ns"] = latency.max
+        return row
+
+    def sample(self, report: LoadReport) -> None:
+        interval = report.elapsed_seconds - self._last_elapsed
+        self._last_elapsed = report.elapsed_seconds
+        fds, sockets = count_open_fds()
+
+        row = {
+            "time": round(time.time(), 3),
+            "elapsed_seconds": round(report.elapsed_seconds, 3),
+        }
+        row.update(self._path_fields("direct", report.direct, interval))
+        row.update(self._path_fields("proxy", report.proxy, interval))
+        row["open_fds"] = fds
+        row["open_sockets"] = sockets
+
+        # Start the next interval empty, the run totals live here instead
+        for totals, stats in ((self.direct_latency, report.direct), (self.proxy_latency, report.proxy)):
+            totals.merge(stats.latency)
+            stats.latency.reset()
+
+        self._write(row)
+        if self.echo:
+            print(
+                f"  {row['elapsed_seconds']:>9.0f}s direct {row['direct_qps']:>8.1f} qps "
+                f"proxy {row['proxy_qps']:>8.1f} qps "
+                f"failed {row['proxy_timeouts'] + row['proxy_errors']:>5} sockets {sockets:>5}",
+                file=sys.stderr,
+            )
+
+    def _write(self, row: dict) -> None:
+        if self.fmt == "csv":
+            if self._csv is None:
+                self._csv = csv.DictWriter(self.out, fieldnames=list(row))
+                self._csv.writeheader()
+            self._csv.writerow(row)
+        else:
+            self.out.write(json.dumps(row) + "\n")
+        # Flushed every row so a crashed or killed run still leaves its data
+        self.out.flush()
+        self.rows += 1
+
+    def finish(self, report: LoadReport) -> None:
+        """Writes the last partial interval and puts the run totals back into report."""
+        if report.elapsed_seconds > self._last_elapsed:
+            self.sample(report)
+        else:
+            self.direct_latency.merge(report.direct.latency)
+            self.proxy_latency.merge(report.proxy.latency)
+        report.direct.latency = self.direct_latency
+        report.proxy.latency = self.proxy_latency
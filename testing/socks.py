@@ -1,19 +1,43 @@
 # socks.py from PySocks
 
-from base64 import b64encode
 try:
     from collections.abc import Callable
 except ImportError:
     from collections import Callable
-from errno import EOPNOTSUPP, EINVAL, EAGAIN
+from errno import EOPNOTSUPP, EINVAL, EAGAIN, EMSGSIZE
 import functools
-from io import BytesIO
+from itertools import zip_longest
 import logging
 import os
-from os import SEEK_CUR
+import queue
 import socket
-import struct
 import sys
+import threading
+import time
+
+from socks_codec import (
+    CMD_CONNECT,
+    CMD_UDP_ASSOCIATE,
+    DEFAULT_REASSEMBLY_BYTES,
+    DEFAULT_REASSEMBLY_TIMEOUT,
+    GeneralProxyError,
+    HTTPConnectHandshake,
+    HTTPError,
+    ProxyError,
+    SOCKS4Error,
+    SOCKS4Handshake,
+    SOCKS4_ERRORS,
+    SOCKS5AuthError,
+    SOCKS5Error,
+    SOCKS5Handshake,
+    SOCKS5_ERRORS,
+    UDPReassembler,
+    decode_socks5_udp_header,
+    encode_socks5_address,
+    encode_socks5_udp_header,
+    split_socks5_udp_payload,
+)
+from socks_resolver import default_resolver
 
 __version__ = "1.7.1"
 
@@ -56,62 +80,46 @@ def set_self_blocking(function):
     return wrapper
 
 
-class ProxyError(IOError):
-    """Socket_err contains original socket.error exception."""
-    def __init__(self, msg, socket_err=None):
-        self.msg = msg
-        self.socket_err = socket_err
-
-        if socket_err:
-            self.msg += ": {}".format(socket_err)
-
-    def __str__(self):
-        return self.msg
-
-
-class GeneralProxyError(ProxyError):
-    pass
-
-
 class ProxyConnectionError(ProxyError):
     pass
 
 
-class SOCKS5AuthError(ProxyError):
-    pass
+DEFAULT_PORTS = {SOCKS4: 1080, SOCKS5: 1080, HTTP: 8080}
 
+# Encoded SOCKS5 UDP headers are cached per destination. Past this many
+# destinations the cache starts over rather than growing without bound.
+UDP_HEADER_CACHE_SIZE = 1024
 
-class SOCKS5Error(ProxyError):
-    pass
+_has_sendmsg = hasattr(_orgsocket, "sendmsg")
 
+try:
+    _monotonic_ns = time.monotonic_ns
+except AttributeError:
+    def _monotonic_ns():
+        return int(time.monotonic() * 1e9)
 
-class SOCKS4Error(ProxyError):
-    pass
+# How long create_connection() gives one proxy address before it starts
+# racing the next, the Connection Attempt Delay of RFC 8305 section 5
+CONNECTION_ATTEMPT_DELAY = 0.25
 
+# Handshake instrumentation. With a hook set, every proxied connect() and UDP
+# bind() collects (phase, monotonic ns) marks and hands them to
+# hook(sock, marks, error) once the handshake is over. The first mark is
+# "connect" or "bind", each later one ends the phase it names. Without a hook
+# the cost is a None check per phase.
+_handshake_hook = None
 
-class HTTPError(ProxyError):
-    pass
 
-SOCKS4_ERRORS = {
-    0x5B: "Request rejected or failed",
-    0x5C: ("Request rejected because SOCKS server cannot connect to identd on"
-           " the client"),
-    0x5D: ("Request rejected because the client program and identd report"
-           " different user-ids")
-}
-
-SOCKS5_ERRORS = {
-    0x01: "General SOCKS server failure",
-    0x02: "Connection not allowed by ruleset",
-    0x03: "Network unreachable",
-    0x04: "Host unreachable",
-    0x05: "Connection refused",
-    0x06: "TTL expired",
-    0x07: "Command not supported, or protocol error",
-    0x08: "Address type not supported"
-}
+def set_handshake_hook(hook):
+    """Sets the function called with every finished handshake's phase
+    marks. Pass None to turn instrumentation off again."""
+    global _handshake_hook
+    _handshake_hook = hook
 
-DEFAULT_PORTS = {SOCKS4: 1080, SOCKS5: 1080, HTTP: 8080}
+
+def get_handshake_hook():
+    """Returns the current handshake hook, None when disabled."""
+    return _handshake_hook
 
 
 def set_default_proxy(proxy_type=None, addr=None, port=None, rdns=True,
@@ -157,7 +165,8 @@ def create_connection(dest_pair,
                       proxy_type=None, proxy_addr=None,
                       proxy_port=None, proxy_rdns=True,
                       proxy_username=None, proxy_password=None,
-                      socket_options=None):
+                      socket_options=None,
+                      attempt_delay=CONNECTION_ATTEMPT_DELAY):
     """create_connection(dest_pair, *[, timeout], **proxy_args) -> socket object
 
     Like socket.create_connection(), but connects to proxy
@@ -167,7 +176,9 @@ def create_connection(dest_pair,
     **proxy_args - Same args passed to socksocket.set_proxy() if present.
     timeout - Optional socket timeout value, in seconds.
     source_address - tuple (host, port) for the socket to bind to as its source
-    address before connecting (only for compatibility)
+    address before connecting to the proxy, which sees it as the client address
+    attempt_delay - Seconds before the next proxy address joins the race
+    when the proxy resolves to more than one (RFC 8305 Happy Eyeballs)
     """
     # Remove IPv6 brackets on the remote address and proxy address.
     remote_host, remote_port = dest_pair
@@ -176,15 +187,17 @@ def create_connection(dest_pair,
     if proxy_addr and proxy_addr.startswith("["):
         proxy_addr = proxy_addr.strip("[]")
 
-    err = None
+    # Without a proxy the destination itself is what gets raced
+    if proxy_type:
+        connect_host = proxy_addr
+        connect_port = proxy_port or DEFAULT_PORTS.get(proxy_type)
+    else:
+        connect_host, connect_port = remote_host, remote_port
 
-    # Allow the SOCKS proxy to be on IPv4 or IPv6 addresses.
-    for r in socket.getaddrinfo(proxy_addr, proxy_port, 0, socket.SOCK_STREAM):
-        family, socket_type, proto, canonname, sa = r
-        sock = None
+    def attempt(addrinfo):
+        family, socket_type, proto, canonname, sa = addrinfo
+        sock = socksocket(family, socket_type, proto)
         try:
-            sock = socksocket(family, socket_type, proto)
-
             if socket_options:
                 for opt in socket_options:
                     sock.setsockopt(*opt)
@@ -192,25 +205,102 @@ def create_connection(dest_pair,
             if isinstance(timeout, (int, float)):
                 sock.settimeout(timeout)
 
-            if proxy_type:
-                sock.set_proxy(proxy_type, proxy_addr, proxy_port, proxy_rdns,
-                               proxy_username, proxy_password)
             if source_address:
                 sock.bind(source_address)
 
-            sock.connect((remote_host, remote_port))
+            if proxy_type:
+                # Pin the address this attempt is racing
+                sock.set_proxy(proxy_type, sa[0], proxy_port, proxy_rdns,
+                               proxy_username, proxy_password)
+                sock.connect((remote_host, remote_port))
+            else:
+                sock.connect(sa)
             return sock
+        except BaseException:
+            sock.close()
+            raise
+
+    # Allow the SOCKS proxy to be on IPv4 or IPv6 addresses.
+    addrinfos = socket.getaddrinfo(connect_host, connect_port, 0,
+                                   socket.SOCK_STREAM)
+    if not addrinfos:
+        raise socket.error("gai returned empty list.")
+    if len(addrinfos) == 1:
+        return attempt(addrinfos[0])
+    return _race_connections(attempt, _interleave_families(addrinfos),
+                             attempt_delay)
+
+
+def _interleave_families(addrinfos):
+    """Orders getaddrinfo() results the way RFC 8305 section 4 does, taking
+    turns between address families starting with the first one returned."""
+    by_family = {}
+    for addrinfo in addrinfos:
+        by_family.setdefault(addrinfo[0], []).append(addrinfo)
+    return [addrinfo
+            for turn in zip_longest(*by_family.values())
+            for addrinfo in turn
+            if addrinfo is not None]
+
+
+def _race_connections(attempt, candidates, delay):
+    """Runs attempt(candidate) on its own thread for each candidate in turn.
+
+    The next candidate starts as soon as the one before it fails, or once it
+    has had `delay` seconds. The first socket to connect is returned and any
+    that finish after it are closed. If every attempt fails the last error
+    is raised."""
+    results = queue.Queue()
+
+    def run(candidate):
+        # Every attempt has to report back, or the caller waits on it forever
+        try:
+            results.put((attempt(candidate), None))
+        except Exception as e:
+            results.put((None, e))
 
-        except (socket.error, ProxyError) as e:
-            err = e
+    def close_losers(pending):
+        for _ in range(pending):
+            sock, _ = results.get()
             if sock:
                 sock.close()
-                sock = None
 
-    if err:
-        raise err
+    err = None
+    pending = 0
+    candidates = iter(candidates)
+    candidate = next(candidates, None)
+    while candidate is not None or pending:
+        if candidate is not None:
+            threading.Thread(target=run, args=(candidate,),
+                             name="socks-connect", daemon=True).start()
+            pending += 1
+            candidate = next(candidates, None)
+
+        try:
+            if candidate is not None:
+                sock, error = results.get(timeout=delay)
+            else:
+                sock, error = results.get()
+        except queue.Empty:
+            continue
+
+        pending -= 1
+        if sock:
+            if pending:
+                threading.Thread(target=close_losers, args=(pending,),
+                                 name="socks-connect", daemon=True).start()
+            return sock
+        err = error
+
+    raise err
 
-    raise socket.error("gai returned empty list.")
+
+def _is_ipv6_literal(host):
+    try:
+        socket.inet_pton(socket.AF_INET6, host)
+    except (socket.error, TypeError):
+        return False
+    return True
 
 
 class _BaseSocket(socket.socket):
@@ -251,6 +341,10 @@ class socksocket(_BaseSocket):
 
     default_proxy = None
 
+    # Local name lookups (rdns=False, SOCKS4 and HTTP without remote
+    # resolving, UDP connect) go through this socks_resolver.ResolverCache
+    resolver = default_resolver
+
     def __init__(self, family=socket.AF_INET, type=socket.SOCK_STREAM,
                  proto=0, *args, **kwargs):
         if type not in (socket.SOCK_STREAM, socket.SOCK_DGRAM):
@@ -268,18 +362,11 @@ class socksocket(_BaseSocket):
         self.proxy_peername = None
 
         self._timeout = None
-
-    def _readall(self, file, count):
-        """Receive EXACTLY the number of bytes requested from the file object.
-
-        Blocks until the required number of bytes have been received."""
-        data = b""
-        while len(data) < count:
-            d = file.read(count - len(data))
-            if not d:
-                raise GeneralProxyError("Connection closed unexpectedly")
-            data += d
-        return data
+        self._udp_headers = {}
+        self._handshake_marks = None
+        self._socks5_pipelined = False
+        self._udp_fragment_size = None
+        self._reassembler = None
 
     def settimeout(self, timeout):
         self._timeout = timeout
@@ -319,6 +406,37 @@ class socksocket(_BaseSocket):
         self.proxy = (proxy_type, addr, port, rdns,
                       username.encode() if username else None,
                       password.encode() if password else None)
+        # rdns decides how destinations are encoded
+        self._udp_headers.clear()
+
+    def set_socks5_pipelining(self, enabled=True):
+        """Sends the SOCKS5 greeting, credentials and request in one write.
+
+        Saves one round trip, two with username/password auth, but only
+        offers a single auth method: USERNAME/PASSWORD when credentials are
+        set, otherwise none. A server that picks anything else has already
+        received bytes it did not ask for, so the handshake fails rather
+        than falling back."""
+        self._socks5_pipelined = enabled
+
+    def set_udp_fragmentation(self, fragment_size=None,
+                              reassembly_timeout=DEFAULT_REASSEMBLY_TIMEOUT,
+                              max_reassembly_bytes=DEFAULT_REASSEMBLY_BYTES):
+        """Configures RFC 1928 UDP fragmentation.
+
+        fragment_size -        Datagrams with a larger payload are sent as
+                                up to 127 fragments of this many bytes. None
+                                sends every datagram whole.
+        reassembly_timeout -   Seconds a partly received datagram waits for
+                                its next fragment before it is dropped.
+        max_reassembly_bytes - Most bytes queued for one partly received
+                                datagram.
+
+        Fragments are reassembled whether or not this is called, many
+        relays (TetherFi included) drop them on the way up though."""
+        self._udp_fragment_size = fragment_size
+        self._reassembler = UDPReassembler(reassembly_timeout,
+                                           max_reassembly_bytes)
 
     def setproxy(self, *args, **kwargs):
         if "proxytype" in kwargs:
@@ -344,23 +462,42 @@ class socksocket(_BaseSocket):
         # Need to specify actual local port because
         # some relays drop packets if a port of zero is specified.
         # Avoid specifying host address in case of NAT though.
-        _, port = self.getsockname()
+        host, port = self.getsockname()[:2]
         dst = ("0", port)
 
-        self._proxyconn = _orig_socket()
-        proxy = self._proxy_addr()
-        self._proxyconn.connect(proxy)
-
-        UDP_ASSOCIATE = b"\x03"
-        _, relay = self._SOCKS5_request(self._proxyconn, UDP_ASSOCIATE, dst)
-
-        # The relay is most likely on the same host as the SOCKS proxy,
-        # but some proxies return a private IP address (10.x.y.z)
-        host, _ = proxy
-        _, port = relay
-        super(socksocket, self).connect((host, port))
-        super(socksocket, self).settimeout(self._timeout)
-        self.proxy_sockname = ("0.0.0.0", 0)  # Unknown
+        if _handshake_hook is not None:
+            self._handshake_marks = [("bind", _monotonic_ns())]
+        try:
+            self._proxyconn = _orig_socket(self.family, socket.SOCK_STREAM)
+            # The handshake gets the same timeout as the socket asking for it
+            self._proxyconn.settimeout(self._timeout)
+            # The proxy only takes datagrams from the host that asked for the
+            # relay, so a socket bound to one address asks from that address
+            if host not in ("0.0.0.0", "::"):
+                self._proxyconn.bind((host, 0))
+            proxy = self._proxy_addr()
+            self._proxyconn.connect(proxy)
+            if self._handshake_marks is not None:
+                self._mark_phase("proxy_connect")
+
+            _, relay = self._SOCKS5_request(self._proxyconn,
+                                            CMD_UDP_ASSOCIATE, dst)
+
+            # The relay is most likely on the same host as the SOCKS proxy,
+            # but some proxies return a private IP address (10.x.y.z)
+            host, _ = proxy
+            _, port = relay
+            super(socksocket, self).connect((host, port))
+            super(socksocket, self).settimeout(self._timeout)
+            self.proxy_sockname = ("0.0.0.0", 0)  # Unknown
+            if self._handshake_marks is not None:
+                self._mark_phase("udp_relay")
+        except BaseException as error:
+            if self._handshake_marks is not None:
+                self._end_handshake(error)
+            raise
+        if self._handshake_marks is not None:
+            self._end_handshake(None)
 
     def sendto(self, bytes, *args, **kwargs):
         if self.type != socket.SOCK_DGRAM:
@@ -371,16 +508,73 @@ class socksocket(_BaseSocket):
         address = args[-1]
         flags = args[:-1]
 
-        header = BytesIO()
-        RSV = b"\x00\x00"
-        header.write(RSV)
-        STANDALONE = b"\x00"
-        header.write(STANDALONE)
-        self._write_SOCKS5_address(address, header)
+        header = (self._udp_headers.get(address)
+                  or self._SOCKS5_udp_header(address))
+        if (self._udp_fragment_size
+                and len(bytes) > self._udp_fragment_size):
+            return self._send_fragments(header, bytes, *flags)
+        if _has_sendmsg:
+            # Header and payload go out as separate buffers, the payload is
+            # never copied
+            sent = _orig_socket.sendmsg(self, (header, bytes), (), *flags)
+        else:
+            sent = super(socksocket, self).send(header + bytes, *flags,
+                                                **kwargs)
+        return sent - len(header)
+
+    def sendto_many(self, datagrams, flags=0):
+        """Sends a batch of (bytes, (host, port)) datagrams.
+
+        Each destination's header is encoded once and reused. Returns the
+        number of payload bytes sent for each datagram."""
+        if self.type != socket.SOCK_DGRAM:
+            raise socket.error(EOPNOTSUPP, "sendto_many needs a UDP socket")
+        if not self._proxyconn:
+            self.bind(("", 0))
+
+        headers = self._udp_headers
+        header_for = self._SOCKS5_udp_header
+        sendmsg = _orig_socket.sendmsg if _has_sendmsg else None
+        fragment_size = self._udp_fragment_size
+        results = []
+        for payload, address in datagrams:
+            header = headers.get(address) or header_for(address)
+            if fragment_size and len(payload) > fragment_size:
+                results.append(
+                    self._send_fragments(header, payload, flags))
+                continue
+            if sendmsg:
+                sent = sendmsg(self, (header, payload), (), flags)
+            else:
+                sent = super(socksocket, self).send(header + payload, flags)
+            results.append(sent - len(header))
+        return results
+
+    def _send_fragments(self, header, payload, flags=0):
+        """Sends payload as a sequence of fragments, returns its length."""
+        try:
+            fragments = split_socks5_udp_payload(header, payload,
+                                                 self._udp_fragment_size)
+        except ValueError as e:
+            raise socket.error(EMSGSIZE, str(e))
+        for fragment_header, chunk in fragments:
+            if _has_sendmsg:
+                _orig_socket.sendmsg(self, (fragment_header, chunk), (), flags)
+            else:
+                super(socksocket, self).send(fragment_header + chunk, flags)
+        return len(payload)
+
+    def _SOCKS5_udp_header(self, address):
+        """Returns the RSV/FRAG/ATYP/ADDR/PORT header for a destination."""
+        header = self._udp_headers.get(address)
+        if header is None:
+            header = encode_socks5_udp_header(
+                *self._resolve_SOCKS5_address(address))
 
-        sent = super(socksocket, self).send(header.getvalue() + bytes, *flags,
-                                            **kwargs)
-        return sent - header.tell()
+            if len(self._udp_headers) >= UDP_HEADER_CACHE_SIZE:
+                self._udp_headers.clear()
+            self._udp_headers[address] = header
+        return header
 
     def send(self, bytes, flags=0, **kwargs):
         if self.type == socket.SOCK_DGRAM:
@@ -394,19 +588,77 @@ class socksocket(_BaseSocket):
         if not self._proxyconn:
             self.bind(("", 0))
 
-        buf = BytesIO(super(socksocket, self).recv(bufsize + 1024, flags))
-        buf.seek(2, SEEK_CUR)
-        frag = buf.read(1)
-        if ord(frag):
-            raise NotImplementedError("Received UDP packet fragment")
-        fromhost, fromport = self._read_SOCKS5_address(buf)
+        while True:
+            data = super(socksocket, self).recv(bufsize + 1024, flags)
+            view = memoryview(data)
+            frag, offset, fromhost, fromport = self._parse_SOCKS5_udp_header(
+                view, len(data))
+            if not frag:
+                return (data[offset:offset + bufsize], (fromhost, fromport))
+
+            payload = self._reassemble((fromhost, fromport), frag,
+                                       view[offset:])
+            if payload is not None:
+                return (payload[:bufsize], (fromhost, fromport))
+
+    def recvfrom_payload_into(self, buffer, nbytes=0, flags=0):
+        """Receives a SOCKS5 UDP datagram into a caller-supplied buffer.
+
+        Nothing is allocated for the packet: the header is parsed where it
+        lies and the payload is left in place. Returns a tuple of
+        (payload_offset, payload_length, (fromhost, fromport)), the payload
+        being buffer[payload_offset:payload_offset + payload_length].
+        Fragmented datagrams are the exception, they are reassembled and
+        copied to the front of buffer."""
+        if self.type != socket.SOCK_DGRAM:
+            received, address = super(socksocket, self).recvfrom_into(
+                buffer, nbytes, flags)
+            return 0, received, address
+        if not self._proxyconn:
+            self.bind(("", 0))
+
+        view = memoryview(buffer)
+        while True:
+            received = super(socksocket, self).recv_into(buffer, nbytes, flags)
+            frag, offset, fromhost, fromport = self._parse_SOCKS5_udp_header(
+                view, received)
+            if not frag:
+                return offset, received - offset, (fromhost, fromport)
+
+            payload = self._reassemble((fromhost, fromport), frag,
+                                       view[offset:received])
+            if payload is not None:
+                # Reassembled datagrams are copied to the front of buffer
+                length = min(len(payload), nbytes or len(view))
+                view[:length] = payload[:length]
+                return 0, length, (fromhost, fromport)
+
+    def _parse_SOCKS5_udp_header(self, view, length):
+        """Parses RSV/FRAG/ATYP/ADDR/PORT from the front of a UDP datagram.
+
+        Returns (frag, payload_offset, fromhost, fromport) and applies the
+        same peer filter as recvfrom()."""
+        frag, fromhost, fromport, offset = decode_socks5_udp_header(view,
+                                                                   length)
 
         if self.proxy_peername:
             peerhost, peerport = self.proxy_peername
             if fromhost != peerhost or peerport not in (0, fromport):
                 raise socket.error(EAGAIN, "Packet filtered")
 
-        return (buf.read(bufsize), (fromhost, fromport))
+        return frag, offset, fromhost, fromport
+
+    def _reassemble(self, source, frag, chunk):
+        """Queues a fragment, returns the datagram once it is complete.
+
+        Blocking sockets go on to wait for the next fragment, a
+        non-blocking one is told to try again."""
+        if self._reassembler is None:
+            self._reassembler = UDPReassembler()
+        payload = self._reassembler.feed(source, frag, chunk, time.monotonic())
+        if payload is None and self._timeout == 0:
+            raise socket.error(EAGAIN, "Fragment queued for reassembly")
+        return payload
 
     def recv(self, *pos, **kw):
         bytes, _ = self.recvfrom(*pos, **kw)
@@ -417,6 +669,15 @@ class socksocket(_BaseSocket):
             self._proxyconn.close()
         return super(socksocket, self).close()
 
+    def _mark_phase(self, phase):
+        self._handshake_marks.append((phase, _monotonic_ns()))
+
+    def _end_handshake(self, error):
+        marks, self._handshake_marks = self._handshake_marks, None
+        hook = _handshake_hook
+        if hook is not None:
+            hook(self, marks, error)
+
     def get_proxy_sockname(self):
         """Returns the bound IP address and port number at the proxy."""
         return self.proxy_sockname
@@ -441,9 +702,34 @@ class socksocket(_BaseSocket):
 
     def _negotiate_SOCKS5(self, *dest_addr):
         """Negotiates a stream connection through a SOCKS5 server."""
-        CONNECT = b"\x01"
         self.proxy_peername, self.proxy_sockname = self._SOCKS5_request(
-            self, CONNECT, dest_addr)
+            self, CMD_CONNECT, dest_addr)
+
+    def _run_handshake(self, conn, handshake):
+        """Drives a socks_codec handshake to the end on a blocking socket.
+
+        Reads land straight in the handshake's buffer and never go past
+        its reply."""
+        conn.sendall(handshake.data_to_send())
+        while not handshake.done:
+            buffer = handshake.recv_buffer()
+            if handshake.delimiter is not None:
+                # Look at what has arrived and take it up to the delimiter
+                peeked = conn.recv(len(buffer), socket.MSG_PEEK)
+                if not peeked:
+                    raise GeneralProxyError("Connection closed unexpectedly")
+                buffer = buffer[:handshake.scan(peeked)]
+            received = conn.recv_into(buffer)
+            if not received:
+                raise GeneralProxyError("Connection closed unexpectedly")
+            phase = handshake.received(received)
+            if phase is not None:
+                if self._handshake_marks is not None:
+                    self._mark_phase(phase)
+                outgoing = handshake.data_to_send()
+                if outgoing:
+                    conn.sendall(outgoing)
+        return handshake
 
     def _SOCKS5_request(self, conn, cmd, dst):
         """
@@ -452,105 +738,22 @@ class socksocket(_BaseSocket):
         """
         proxy_type, addr, port, rdns, username, password = self.proxy
 
-        writer = conn.makefile("wb")
-        reader = conn.makefile("rb", 0)  # buffering=0 renamed in Python 3
-        try:
-            # First we'll send the authentication packages we support.
-            if username and password:
-                # The username/password details were supplied to the
-                # set_proxy method so we support the USERNAME/PASSWORD
-                # authentication (in addition to the standard none).
-                writer.write(b"\x05\x02\x00\x02")
-            else:
-                # No username/password were entered, therefore we
-                # only support connections with no authentication.
-                writer.write(b"\x05\x01\x00")
-
-            # We'll receive the server's response to determine which
-            # method was selected
-            writer.flush()
-            chosen_auth = self._readall(reader, 2)
-
-            if chosen_auth[0:1] != b"\x05":
-                # Note: string[i:i+1] is used because indexing of a bytestring
-                # via bytestring[i] yields an integer in Python 3
-                raise GeneralProxyError(
-                    "SOCKS5 proxy server sent invalid data")
-
-            # Check the chosen authentication method
-
-            if chosen_auth[1:2] == b"\x02":
-                # Okay, we need to perform a basic username/password
-                # authentication.
-                if not (username and password):
-                    # Although we said we don't support authentication, the
-                    # server may still request basic username/password
-                    # authentication
-                    raise SOCKS5AuthError("No username/password supplied. "
-                                          "Server requested username/password"
-                                          " authentication")
-
-                writer.write(b"\x01" + chr(len(username)).encode()
-                             + username
-                             + chr(len(password)).encode()
-                             + password)
-                writer.flush()
-                auth_status = self._readall(reader, 2)
-                if auth_status[0:1] != b"\x01":
-                    # Bad response
-                    raise GeneralProxyError(
-                        "SOCKS5 proxy server sent invalid data")
-                if auth_status[1:2] != b"\x00":
-                    # Authentication failed
-                    raise SOCKS5AuthError("SOCKS5 authentication failed")
-
-                # Otherwise, authentication succeeded
-
-            # No authentication is required if 0x00
-            elif chosen_auth[1:2] != b"\x00":
-                # Reaching here is always bad
-                if chosen_auth[1:2] == b"\xFF":
-                    raise SOCKS5AuthError(
-                        "All offered SOCKS5 authentication methods were"
-                        " rejected")
-                else:
-                    raise GeneralProxyError(
-                        "SOCKS5 proxy server sent invalid data")
-
-            # Now we can request the actual connection
-            writer.write(b"\x05" + cmd + b"\x00")
-            resolved = self._write_SOCKS5_address(dst, writer)
-            writer.flush()
-
-            # Get the response
-            resp = self._readall(reader, 3)
-            if resp[0:1] != b"\x05":
-                raise GeneralProxyError(
-                    "SOCKS5 proxy server sent invalid data")
+        resolved = self._resolve_SOCKS5_address(dst)
+        handshake = self._run_handshake(conn, SOCKS5Handshake(
+            cmd, resolved[0], resolved[1], username, password,
+            self._socks5_pipelined))
 
-            status = ord(resp[1:2])
-            if status != 0x00:
-                # Connection failed: server returned an error
-                error = SOCKS5_ERRORS.get(status, "Unknown error")
-                raise SOCKS5Error("{:#04x}: {}".format(status, error))
-
-            # Get the bound address/port
-            bnd = self._read_SOCKS5_address(reader)
-
-            super(socksocket, self).settimeout(self._timeout)
-            return (resolved, bnd)
-        finally:
-            reader.close()
-            writer.close()
+        super(socksocket, self).settimeout(self._timeout)
+        return (resolved, handshake.bound)
 
-    def _write_SOCKS5_address(self, addr, file):
+    def _resolve_SOCKS5_address(self, addr):
         """
-        Return the host and port packed for the SOCKS5 protocol,
-        and the resolved address as a tuple object.
+        Return the host and port as they should go on the wire: IP
+        addresses normalized, names left for the proxy when rdns is set
+        and resolved here otherwise.
         """
         host, port = addr
         proxy_type, _, _, rdns, username, password = self.proxy
-        family_to_byte = {socket.AF_INET: b"\x01", socket.AF_INET6: b"\x04"}
 
         # If the given destination address is an IP address, we'll
         # use the IP address request even if remote resolving was specified.
@@ -558,168 +761,81 @@ class socksocket(_BaseSocket):
         for family in (socket.AF_INET, socket.AF_INET6):
             try:
                 addr_bytes = socket.inet_pton(family, host)
-                file.write(family_to_byte[family] + addr_bytes)
-                host = socket.inet_ntop(family, addr_bytes)
-                file.write(struct.pack(">H", port))
-                return host, port
+                return socket.inet_ntop(family, addr_bytes), port
             except socket.error:
                 continue
 
         # Well it's not an IP number, so it's probably a DNS name.
         if rdns:
             # Resolve remotely
-            host_bytes = host.encode("idna")
-            file.write(b"\x03" + chr(len(host_bytes)).encode() + host_bytes)
-        else:
-            # Resolve locally
-            addresses = socket.getaddrinfo(host, port, socket.AF_UNSPEC,
-                                           socket.SOCK_STREAM,
-                                           socket.IPPROTO_TCP,
-                                           socket.AI_ADDRCONFIG)
-            # We can't really work out what IP is reachable, so just pick the
-            # first.
-            target_addr = addresses[0]
-            family = target_addr[0]
-            host = target_addr[4][0]
-
-            addr_bytes = socket.inet_pton(family, host)
-            file.write(family_to_byte[family] + addr_bytes)
-            host = socket.inet_ntop(family, addr_bytes)
-        file.write(struct.pack(">H", port))
-        return host, port
+            return host, port
+
+        # Resolve locally
+        addresses = self.resolver.getaddrinfo(host, port, socket.AF_UNSPEC,
+                                              socket.SOCK_STREAM,
+                                              socket.IPPROTO_TCP,
+                                              socket.AI_ADDRCONFIG)
+        # We can't really work out what IP is reachable, so just pick the
+        # first.
+        target_addr = addresses[0]
+        return target_addr[4][0], port
 
-    def _read_SOCKS5_address(self, file):
-        atyp = self._readall(file, 1)
-        if atyp == b"\x01":
-            addr = socket.inet_ntoa(self._readall(file, 4))
-        elif atyp == b"\x03":
-            length = self._readall(file, 1)
-            addr = self._readall(file, ord(length))
-        elif atyp == b"\x04":
-            addr = socket.inet_ntop(socket.AF_INET6, self._readall(file, 16))
-        else:
-            raise GeneralProxyError("SOCKS5 proxy server sent invalid data")
-
-        port = struct.unpack(">H", self._readall(file, 2))[0]
-        return addr, port
+    def _write_SOCKS5_address(self, addr, file):
+        """
+        Return the host and port packed for the SOCKS5 protocol,
+        and the resolved address as a tuple object.
+        """
+        host, port = self._resolve_SOCKS5_address(addr)
+        file.write(encode_socks5_address(host, port))
+        return host, port
 
     def _negotiate_SOCKS4(self, dest_addr, dest_port):
         """Negotiates a connection through a SOCKS4 server."""
         proxy_type, addr, port, rdns, username, password = self.proxy
 
-        writer = self.makefile("wb")
-        reader = self.makefile("rb", 0)  # buffering=0 renamed in Python 3
-        try:
-            # Check if the destination address provided is an IP address
-            remote_resolve = False
+        if _is_ipv6_literal(dest_addr):
+            raise GeneralProxyError("SOCKS4 cannot carry IPv6 destinations")
+
+        # Names are sent as SOCKS4a when the proxy should resolve them
+        host = dest_addr
+        if not rdns:
             try:
-                addr_bytes = socket.inet_aton(dest_addr)
+                socket.inet_aton(dest_addr)
             except socket.error:
-                # It's a DNS name. Check where it should be resolved.
-                if rdns:
-                    addr_bytes = b"\x00\x00\x00\x01"
-                    remote_resolve = True
-                else:
-                    addr_bytes = socket.inet_aton(
-                        socket.gethostbyname(dest_addr))
-
-            # Construct the request packet
-            writer.write(struct.pack(">BBH", 0x04, 0x01, dest_port))
-            writer.write(addr_bytes)
-
-            # The username parameter is considered userid for SOCKS4
-            if username:
-                writer.write(username)
-            writer.write(b"\x00")
-
-            # DNS name if remote resolving is required
-            # NOTE: This is actually an extension to the SOCKS4 protocol
-            # called SOCKS4A and may not be supported in all cases.
-            if remote_resolve:
-                writer.write(dest_addr.encode("idna") + b"\x00")
-            writer.flush()
-
-            # Get the response from the server
-            resp = self._readall(reader, 8)
-            if resp[0:1] != b"\x00":
-                # Bad data
-                raise GeneralProxyError(
-                    "SOCKS4 proxy server sent invalid data")
-
-            status = ord(resp[1:2])
-            if status != 0x5A:
-                # Connection failed: server returned an error
-                error = SOCKS4_ERRORS.get(status, "Unknown error")
-                raise SOCKS4Error("{:#04x}: {}".format(status, error))
-
-            # Get the bound address/port
-            self.proxy_sockname = (socket.inet_ntoa(resp[4:]),
-                                   struct.unpack(">H", resp[2:4])[0])
-            if remote_resolve:
-                self.proxy_peername = socket.inet_ntoa(addr_bytes), dest_port
-            else:
-                self.proxy_peername = dest_addr, dest_port
-        finally:
-            reader.close()
-            writer.close()
+                host = self.resolver.gethostbyname(dest_addr)
+                if self._handshake_marks is not None:
+                    self._mark_phase("resolve")
+
+        # The username parameter is considered userid for SOCKS4
+        handshake = self._run_handshake(
+            self, SOCKS4Handshake(host, dest_port, username))
+
+        # Get the bound address/port
+        self.proxy_sockname = handshake.bound
+        if handshake.remote_resolve:
+            self.proxy_peername = handshake.request_addr, dest_port
+        else:
+            self.proxy_peername = dest_addr, dest_port
 
     def _negotiate_HTTP(self, dest_addr, dest_port):
         """Negotiates a connection through an HTTP server.
 
-        NOTE: This currently only supports HTTP CONNECT-style proxies."""
+        NOTE: This currently only supports HTTP CONNECT-style proxies. Plain
+        requests with an absolute URL go through http_forward instead."""
         proxy_type, addr, port, rdns, username, password = self.proxy
 
         # If we need to resolve locally, we do this now
-        addr = dest_addr if rdns else socket.gethostbyname(dest_addr)
-
-        http_headers = [
-            (b"CONNECT " + addr.encode("idna") + b":"
-             + str(dest_port).encode() + b" HTTP/1.1"),
-            b"Host: " + dest_addr.encode("idna")
-        ]
-
-        if username and password:
-            http_headers.append(b"Proxy-Authorization: basic "
-                                + b64encode(username + b":" + password))
-
-        http_headers.append(b"\r\n")
-
-        self.sendall(b"\r\n".join(http_headers))
-
-        # We just need the first line to check if the connection was successful
-        fobj = self.makefile()
-        status_line = fobj.readline()
-        fobj.close()
-
-        if not status_line:
-            raise GeneralProxyError("Connection closed unexpectedly")
-
-        try:
-            proto, status_code, status_msg = status_line.split(" ", 2)
-        except ValueError:
-            raise GeneralProxyError("HTTP proxy server sent invalid response")
+        if rdns or _is_ipv6_literal(dest_addr):
+            addr = dest_addr
+        else:
+            addr = self.resolver.gethostbyname(dest_addr)
+            if self._handshake_marks is not None:
+                self._mark_phase("resolve")
 
-        if not proto.startswith("HTTP/"):
-            raise GeneralProxyError(
-                "Proxy server does not appear to be an HTTP proxy")
+        handshake = self._run_handshake(self, HTTPConnectHandshake(
+            addr, dest_port, dest_addr, username, password))
 
-        try:
-            status_code = int(status_code)
-        except ValueError:
-            raise HTTPError(
-                "HTTP proxy server did not return a valid HTTP status")
-
-        if status_code != 200:
-            error = "{}: {}".format(status_code, status_msg)
-            if status_code in (400, 403, 405):
-                # It's likely that the HTTP proxy server does not support the
-                # CONNECT tunneling method
-                error += ("\n[*] Note: The HTTP proxy server may not be"
-                          " supported by PySocks (must be a CONNECT tunnel"
-                          " proxy)")
-            raise HTTPError(error)
-
-        self.proxy_sockname = (b"0.0.0.0", 0)
+        self.proxy_sockname = handshake.bound
         self.proxy_peername = addr, dest_port
 
     _proxy_negotiators = {
@@ -735,25 +851,35 @@ class socksocket(_BaseSocket):
         Uses the same API as socket's connect().
         To select the proxy server, use set_proxy().
 
-        dest_pair - 2-tuple of (IP/hostname, port).
+        dest_pair - 2-tuple of (IP/hostname, port). IPv6 addresses may also
+        be bracketed, or a 4-tuple as returned by getaddrinfo().
         """
-        if len(dest_pair) != 2 or dest_pair[0].startswith("["):
-            # Probably IPv6, not supported -- raise an error, and hope
-            # Happy Eyeballs (RFC6555) makes sure at least the IPv4
-            # connection works...
-            raise socket.error("PySocks doesn't support IPv6: %s"
-                               % str(dest_pair))
+        sockaddr = dest_pair
+        if isinstance(dest_pair, (list, tuple)):
+            if len(dest_pair) == 4:
+                # (host, port, flowinfo, scope_id), only a direct
+                # connection can use the last two
+                dest_pair = tuple(dest_pair[:2])
+            if (len(dest_pair) == 2 and isinstance(dest_pair[0], str)
+                    and dest_pair[0].startswith("[")):
+                dest_pair = (dest_pair[0].strip("[]"), dest_pair[1])
+                sockaddr = dest_pair
+
+        if len(dest_pair) != 2:
+            raise GeneralProxyError(
+                "Invalid destination-connection (host, port) pair")
 
         dest_addr, dest_port = dest_pair
 
         if self.type == socket.SOCK_DGRAM:
             if not self._proxyconn:
                 self.bind(("", 0))
-            dest_addr = socket.gethostbyname(dest_addr)
+            if not _is_ipv6_literal(dest_addr):
+                dest_addr = self.resolver.gethostbyname(dest_addr)
 
             # If the host address is INADDR_ANY or similar, reset the peer
             # address so that packets are received from any peer
-            if dest_addr == "0.0.0.0" and not dest_port:
+            if dest_addr in ("0.0.0.0", "::") and not dest_port:
                 self.proxy_peername = None
             else:
                 self.proxy_peername = (dest_addr, dest_port)
@@ -779,10 +905,12 @@ class socksocket(_BaseSocket):
             # Treat like regular socket object
             self.proxy_peername = dest_pair
             super(socksocket, self).settimeout(self._timeout)
-            super(socksocket, self).connect((dest_addr, dest_port))
+            super(socksocket, self).connect(sockaddr)
             return
 
         proxy_addr = self._proxy_addr()
+        if _handshake_hook is not None:
+            self._handshake_marks = [("connect", _monotonic_ns())]
 
         try:
             # Initial connection to proxy server.
@@ -790,6 +918,8 @@ class socksocket(_BaseSocket):
 
         except socket.error as error:
             # Error while connecting to proxy
+            if self._handshake_marks is not None:
+                self._end_handshake(error)
             self.close()
             if not catch_errors:
                 proxy_addr, proxy_port = proxy_addr
@@ -804,22 +934,31 @@ class socksocket(_BaseSocket):
                 raise error
 
         else:
+            if self._handshake_marks is not None:
+                self._mark_phase("proxy_connect")
+
             # Connected to proxy server, now negotiate
             try:
                 # Calls negotiate_{SOCKS4, SOCKS5, HTTP}
                 negotiate = self._proxy_negotiators[proxy_type]
                 negotiate(self, dest_addr, dest_port)
             except socket.error as error:
+                if self._handshake_marks is not None:
+                    self._end_handshake(error)
                 if not catch_errors:
                     # Wrap socket errors
                     self.close()
                     raise GeneralProxyError("Socket error", error)
                 else:
                     raise error
-            except ProxyError:
+            except ProxyError as error:
                 # Protocol error while negotiating with proxy
+                if self._handshake_marks is not None:
+                    self._end_handshake(error)
                 self.close()
                 raise
+            if self._handshake_marks is not None:
+                self._end_handshake(None)
                 
     @set_self_blocking
     def connect_ex(self, dest_pair):
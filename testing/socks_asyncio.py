@@ -0,0 +1,269 @@
+#!/usr/bin/python3
+
+# socks_asyncio.py - non-blocking SOCKS5 UDP ASSOCIATE client.
+#
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from collections.abc import Callable
+import asyncio
+import socket
+
+from socks import UDP_HEADER_CACHE_SIZE, GeneralProxyError
+from socks_codec import (
+    CMD_UDP_ASSOCIATE,
+    ClientHandshake,
+    SOCKS5Handshake,
+    decode_socks5_udp_header,
+    encode_socks5_udp_header,
+)
+
+DatagramHandler = Callable[[bytes, tuple[str, int]], None]
+
+# A big receive buffer keeps the kernel from dropping replies when thousands
+# of datagrams are in flight at once
+DEFAULT_RCVBUF: int = 4 * 1024 * 1024
+
+
+async def run_handshake(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    handshake: ClientHandshake,
+) -> ClientHandshake:
+    """Drives a socks_codec handshake to the end on a stream.
+
+    Only the handshake's own bytes are taken off the reader, whatever the
+    server sends next is left for the caller."""
+    writer.write(handshake.data_to_send())
+    await writer.drain()
+    while not handshake.done:
+        if handshake.delimiter is not None:
+            data = await reader.readuntil(handshake.delimiter)
+        else:
+            data = await reader.readexactly(handshake.needed)
+        if handshake.receive(data) is not None:
+            outgoing = handshake.data_to_send()
+            if outgoing:
+                writer.write(outgoing)
+                await writer.drain()
+    return handshake
+
+
+async def socks5_handshake(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    cmd: int,
+    dst: tuple[str, int],
+    user: str | None = None,
+    pwd: str | None = None,
+    pipelined: bool = False,
+) -> tuple[str, int]:
+    """Runs the SOCKS5 greeting, optional auth and request on a stream.
+
+    Returns the bound (host, port) from the server reply."""
+    handshake = SOCKS5Handshake(
+        cmd,
+        dst[0],
+        dst[1],
+        user.encode() if user else None,
+        pwd.encode() if pwd else None,
+        pipelined,
+    )
+    await run_handshake(reader, writer, handshake)
+    return handshake.bound
+
+
+class _RelayProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, association: SOCKS5UDPAssociation):
+        self._association = association
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        self._association._datagram_received(data, addr)
+
+    def error_received(self, exc: Exception) -> None:
+        self._association.errors += 1
+
+
+class SOCKS5UDPAssociation:
+    """A live SOCKS5 UDP association.
+
+    The TCP control connection is held open for as long as the association
+    lives, as required by RFC 1928. Datagrams are sent without waiting and
+    replies are handed to on_datagram as they arrive, so any number of
+    requests can be in flight at once."""
+
+    def __init__(
+        self,
+        on_datagram: DatagramHandler | None = None,
+    ):
+        self.on_datagram = on_datagram
+
+        self.relay_addr: tuple[str, int] | None = None
+        self.sent: int = 0
+        self.received: int = 0
+        self.dropped: int = 0
+        self.errors: int = 0
+
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._transport: asyncio.DatagramTransport | None = None
+        self._watcher: asyncio.Task | None = None
+        self._headers: dict[tuple[str, int], bytes] = {}
+        self._closed: asyncio.Future | None = None
+
+    async def open(
+        self,
+        proxy_host: str,
+        proxy_port: int,
+        user: str | None = None,
+        pwd: str | None = None,
+        local_host: str = "",
+        timeout: float | None = None,
+    ) -> SOCKS5UDPAssociation:
+        loop = asyncio.get_running_loop()
+        self._closed = loop.create_future()
+
+        # Bind the UDP side first, some relays drop packets if the
+        # associate request carries a port of zero.
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, DEFAULT_RCVBUF)
+        except OSError:
+            pass
+        sock.bind((local_host, 0))
+        _, local_port = sock.getsockname()
+
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _RelayProtocol(self),
+            sock=sock,
+        )
+
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    proxy_host,
+                    proxy_port,
+                    local_addr=(local_host, 0) if local_host else None,
+                ),
+                timeout,
+            )
+            relay_host, relay_port = await asyncio.wait_for(
+                socks5_handshake(
+                    self._reader,
+                    self._writer,
+                    CMD_UDP_ASSOCIATE,
+                    ("0.0.0.0", local_port),
+                    user,
+                    pwd,
+                ),
+                timeout,
+            )
+        except BaseException:
+            self.close()
+            raise
+
+        # The relay is where the server says it is. A wildcard address means
+        # the host we reached the proxy on, already resolved by the connect
+        if relay_host in ("0.0.0.0", "::"):
+            relay_host = self._writer.get_extra_info("peername")[0]
+        self.relay_addr = (relay_host, relay_port)
+
+        self._watcher = loop.create_task(self._watch_control())
+        return self
+
+    async def _watch_control(self) -> None:
+        # The server never sends anything on the control connection after the
+        # reply, so any read returning means the association is gone.
+        try:
+            while await self._reader.read(1024):
+                pass
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            return
+        self.close()
+
+    def _datagram_received(self, data: bytes, addr: tuple) -> None:
+        if addr[:2] != self.relay_addr:
+            self.dropped += 1
+            return
+
+        try:
+            frag, host, port, offset = decode_socks5_udp_header(data, len(data))
+        except GeneralProxyError:
+            self.dropped += 1
+            return
+        if frag:
+            self.dropped += 1
+            return
+
+        self.received += 1
+        if self.on_datagram:
+            self.on_datagram(data[offset:], (host, port))
+
+    def _header_for(self, address: tuple[str, int]) -> bytes:
+        header = self._headers.get(address)
+        if header is None:
+            header = encode_socks5_udp_header(*address)
+            if len(self._headers) >= UDP_HEADER_CACHE_SIZE:
+                self._headers.clear()
+            self._headers[address] = header
+        return header
+
+    def sendto(self, payload: bytes, address: tuple[str, int]) -> None:
+        if not self.is_open:
+            raise GeneralProxyError("UDP association is closed")
+        self._transport.sendto(self._header_for(address) + payload, self.relay_addr)
+        self.sent += 1
+
+    @property
+    def is_open(self) -> bool:
+        return self._closed is not None and not self._closed.done()
+
+    async def wait_closed(self) -> None:
+        if self._closed is not None:
+            await asyncio.shield(self._closed)
+
+    def close(self) -> None:
+        if self._watcher and self._watcher is not asyncio.current_task():
+            self._watcher.cancel()
+        if self._writer:
+            self._writer.close()
+        if self._transport:
+            self._transport.close()
+        if self._closed is not None and not self._closed.done():
+            self._closed.set_result(None)
+
+
+async def open_udp_association(
+    proxy_host: str,
+    proxy_port: int,
+    user: str | None = None,
+    pwd: str | None = None,
+    on_datagram: DatagramHandler | None = None,
+    local_host: str = "",
+    timeout: float | None = None,
+) -> SOCKS5UDPAssociation:
+    association = SOCKS5UDPAssociation(on_datagram=on_datagram)
+    return await association.open(
+        proxy_host=proxy_host,
+        proxy_port=proxy_port,
+        user=user,
+        pwd=pwd,
+        local_host=local_host,
+        timeout=timeout,
+    )
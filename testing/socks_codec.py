@@ -0,0 +1,626 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# SOCKS4/4a/5 and HTTP CONNECT wire formats without any I/O.
+#
+# The client handshakes are state machines over one preallocated buffer. A
+# driver sends data_to_send(), then reads exactly `needed` bytes into
+# recv_buffer() (or hands them to receive()) until `done`. While `delimiter`
+# is set, needed is only an upper bound and reads stop at the delimiter
+# instead, found with scan() or readuntil(). Either way nothing the server
+# sends after its reply is swallowed, and the same machine runs under a
+# blocking socket or an asyncio stream.
+
+from __future__ import annotations
+from base64 import b64encode
+from struct import pack, unpack_from
+from struct import error as StructError
+import socket
+
+SOCKS4_VERSION: int = 0x04
+SOCKS5_VERSION: int = 0x05
+
+CMD_CONNECT: int = 0x01
+CMD_BIND: int = 0x02
+CMD_UDP_ASSOCIATE: int = 0x03
+
+ATYP_IPV4: int = 0x01
+ATYP_DOMAIN: int = 0x03
+ATYP_IPV6: int = 0x04
+
+METHOD_NO_AUTH: int = 0x00
+METHOD_USERNAME_PASSWORD: int = 0x02
+METHOD_NO_ACCEPTABLE: int = 0xFF
+
+SOCKS4_GRANTED: int = 0x5A
+
+
+class ProxyError(IOError):
+    """Socket_err contains original socket.error exception."""
+    def __init__(self, msg, socket_err=None):
+        self.msg = msg
+        self.socket_err = socket_err
+
+        if socket_err:
+            self.msg += ": {}".format(socket_err)
+
+    def __str__(self):
+        return self.msg
+
+
+class GeneralProxyError(ProxyError):
+    pass
+
+
+class SOCKS5AuthError(ProxyError):
+    pass
+
+
+class SOCKS5Error(ProxyError):
+    pass
+
+
+class SOCKS4Error(ProxyError):
+    pass
+
+
+class HTTPError(ProxyError):
+    pass
+
+SOCKS4_ERRORS = {
+    0x5B: "Request rejected or failed",
+    0x5C: ("Request rejected because SOCKS server cannot connect to identd on"
+           " the client"),
+    0x5D: ("Request rejected because the client program and identd report"
+           " different user-ids")
+}
+
+SOCKS5_ERRORS = {
+    0x01: "General SOCKS server failure",
+    0x02: "Connection not allowed by ruleset",
+    0x03: "Network unreachable",
+    0x04: "Host unreachable",
+    0x05: "Connection refused",
+    0x06: "TTL expired",
+    0x07: "Command not supported, or protocol error",
+    0x08: "Address type not supported"
+}
+
+
+def _invalid_socks5() -> GeneralProxyError:
+    return GeneralProxyError("SOCKS5 proxy server sent invalid data")
+
+
+# SOCKS5 addresses
+
+def encode_socks5_address(host: str, port: int) -> bytes:
+    # Literal IPs are sent as-is, everything else is resolved by the proxy
+    try:
+        return bytes([ATYP_IPV4]) + socket.inet_pton(socket.AF_INET, host) + pack(">H", port)
+    except OSError:
+        pass
+    try:
+        return bytes([ATYP_IPV6]) + socket.inet_pton(socket.AF_INET6, host) + pack(">H", port)
+    except OSError:
+        pass
+
+    host_bytes = host.encode("idna")
+    if len(host_bytes) > 255:
+        raise GeneralProxyError("Domain name too long for SOCKS5")
+    return bytes([ATYP_DOMAIN, len(host_bytes)]) + host_bytes + pack(">H", port)
+
+
+def decode_socks5_address(data: bytes | bytearray | memoryview, offset: int) -> tuple[str, int, int]:
+    # Returns (host, port, offset past the address)
+    try:
+        atyp = data[offset]
+        offset += 1
+        if atyp == ATYP_IPV4:
+            host = socket.inet_ntop(socket.AF_INET, data[offset:offset + 4])
+            offset += 4
+        elif atyp == ATYP_IPV6:
+            host = socket.inet_ntop(socket.AF_INET6, data[offset:offset + 16])
+            offset += 16
+        elif atyp == ATYP_DOMAIN:
+            length = data[offset]
+            offset += 1
+            host = bytes(data[offset:offset + length]).decode("idna")
+            offset += length
+        else:
+            raise _invalid_socks5()
+        (port,) = unpack_from(">H", data, offset)
+    except (IndexError, ValueError, StructError) as e:
+        raise _invalid_socks5() from e
+    return host, port, offset + 2
+
+
+# SOCKS5 UDP
+
+def encode_socks5_udp_header(host: str, port: int, frag: int = 0) -> bytes:
+    """RSV(2) FRAG(1) then the destination address."""
+    return bytes((0, 0, frag)) + encode_socks5_address(host, port)
+
+
+def decode_socks5_udp_header(
+    data: bytes | bytearray | memoryview,
+    length: int,
+) -> tuple[int, str, int, int]:
+    """Parses the header at the front of a relayed datagram.
+
+    Returns (frag, host, port, payload offset). Only the first `length` bytes
+    of data are treated as received."""
+    if length < 4:
+        raise _invalid_socks5()
+    frag = data[2]
+    host, port, offset = decode_socks5_address(data, 3)
+    if offset > length:
+        raise _invalid_socks5()
+    return frag, host, port, offset
+
+
+# SOCKS5 UDP fragmentation, RFC 1928 section 7. FRAG 1-127 is the position
+# of a fragment in its sequence and the high bit marks the last one.
+
+FRAG_END: int = 0x80
+MAX_FRAGMENTS: int = 0x7F
+
+# The RFC wants the reassembly timer to be no less than 5 seconds
+DEFAULT_REASSEMBLY_TIMEOUT: float = 5.0
+DEFAULT_REASSEMBLY_BYTES: int = 256 * 1024
+DEFAULT_REASSEMBLY_QUEUES: int = 16
+
+
+def split_socks5_udp_payload(
+    header: bytes,
+    payload: bytes | bytearray | memoryview,
+    fragment_size: int,
+) -> list[tuple[bytes, memoryview]]:
+    """Splits payload into (header, chunk) pairs of at most fragment_size bytes.
+
+    header is a FRAG 0 header from encode_socks5_udp_header(), each pair gets
+    a copy with its own FRAG byte. Chunks are views into payload."""
+    if fragment_size <= 0:
+        raise ValueError("fragment_size must be positive")
+    view = memoryview(payload)
+    count = max(1, -(-len(view) // fragment_size))
+    if count > MAX_FRAGMENTS:
+        raise ValueError(
+            f"{len(view)} bytes need {count} fragments of {fragment_size}, at most {MAX_FRAGMENTS} fit")
+
+    prefix, suffix = header[:2], header[3:]
+    fragments = []
+    for position in range(1, count + 1):
+        frag = position | FRAG_END if position == count else position
+        start = (position - 1) * fragment_size
+        fragments.append((prefix + bytes((frag,)) + suffix, view[start:start + fragment_size]))
+    return fragments
+
+
+class _FragmentQueue:
+
+    __slots__ = ("chunks", "size", "highest", "deadline")
+
+    def __init__(self):
+        self.chunks: dict[int, bytes] = {}
+        self.size: int = 0
+        self.highest: int = 0
+        self.deadline: float = 0.0
+
+
+class UDPReassembler:
+    """Reassembly queues for fragmented SOCKS5 UDP datagrams, one per source.
+
+    Follows RFC 1928: a fragment whose position is below the highest seen so
+    far starts a new sequence, and a queue is dropped once timeout seconds
+    pass without a fragment for it. Every queue is capped at max_bytes and
+    at most max_queues sources are tracked, the stalest queue going first,
+    so a flood of fragments that never complete cannot grow memory."""
+
+    def __init__(
+        self,
+        timeout: float = DEFAULT_REASSEMBLY_TIMEOUT,
+        max_bytes: int = DEFAULT_REASSEMBLY_BYTES,
+        max_queues: int = DEFAULT_REASSEMBLY_QUEUES,
+    ):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_queues = max_queues
+        self.completed: int = 0
+        self.abandoned: int = 0
+        self._queues: dict[tuple, _FragmentQueue] = {}
+
+    def feed(
+        self,
+        source: tuple,
+        frag: int,
+        chunk: bytes | bytearray | memoryview,
+        now: float,
+    ) -> bytes | None:
+        """Queues one fragment. Returns the whole datagram once its last one is in."""
+        self.expire(now)
+        position = frag & MAX_FRAGMENTS
+        if not position:
+            raise ValueError("FRAG 0 is a standalone datagram, not a fragment")
+
+        queue = self._queues.get(source)
+        if queue is not None and position < queue.highest:
+            self._drop(source)
+            queue = None
+        if queue is None:
+            if len(self._queues) >= self.max_queues:
+                self._drop(min(self._queues, key=lambda key: self._queues[key].deadline))
+            queue = self._queues[source] = _FragmentQueue()
+
+        previous = queue.chunks.get(position)
+        queue.size += len(chunk) - (len(previous) if previous is not None else 0)
+        if queue.size > self.max_bytes:
+            self._drop(source)
+            return None
+        queue.chunks[position] = bytes(chunk)
+        queue.highest = position
+        queue.deadline = now + self.timeout
+
+        if not frag & FRAG_END:
+            return None
+
+        del self._queues[source]
+        if len(queue.chunks) != position:
+            # A fragment went missing in between
+            self.abandoned += 1
+            return None
+        self.completed += 1
+        return b"".join(queue.chunks[i] for i in range(1, position + 1))
+
+    def expire(self, now: float) -> None:
+        expired = [source for source, queue in self._queues.items() if queue.deadline <= now]
+        for source in expired:
+            self._drop(source)
+
+    def _drop(self, source: tuple) -> None:
+        del self._queues[source]
+        self.abandoned += 1
+
+    def __len__(self) -> int:
+        return len(self._queues)
+
+
+# Handshakes
+
+class ClientHandshake:
+    """Client side of one proxy handshake, driven by the caller's I/O."""
+
+    # Largest reply a handshake ever has to hold at once
+    capacity: int = 512
+
+    def __init__(self):
+        self.done: bool = False
+        self.needed: int = 0
+        self.bound: tuple[str, int] | None = None
+        # Set while a reply ends at a delimiter rather than after a known
+        # length. needed is then only the most that may come, and a driver
+        # reads up to the delimiter, see scan()
+        self.delimiter: bytes | None = None
+
+        self._buffer = bytearray(self.capacity)
+        self._view = memoryview(self._buffer)
+        self._filled = 0
+        self._outgoing = b""
+
+    def data_to_send(self) -> bytes:
+        outgoing, self._outgoing = self._outgoing, b""
+        return outgoing
+
+    def recv_buffer(self) -> memoryview:
+        """Where the next `needed` bytes should be read to."""
+        return self._view[self._filled:self._filled + self.needed]
+
+    def received(self, count: int) -> str | None:
+        """Accepts count bytes read into recv_buffer().
+
+        Returns the name of the phase this completed, if any. New data to
+        send only ever appears when a phase completes."""
+        if count > self.needed:
+            raise ValueError("Received more than the handshake asked for")
+        self._filled += count
+        self.needed -= count
+        if self.needed and self.delimiter is None:
+            return None
+        return self._step()
+
+    def scan(self, data: bytes | bytearray | memoryview) -> int:
+        """How many bytes from the front of data belong to the handshake.
+
+        For drivers that can look at bytes before taking them off the
+        connection (MSG_PEEK), so a read never goes past the reply."""
+        count = min(len(data), self.needed)
+        if self.delimiter is None:
+            return count
+        # The delimiter may have begun in what is already buffered
+        kept = min(self._filled, len(self.delimiter) - 1)
+        window = bytes(self._view[self._filled - kept:self._filled]) + bytes(data[:count])
+        end = window.find(self.delimiter)
+        if end < 0:
+            return count
+        return end + len(self.delimiter) - kept
+
+    def receive(self, data: bytes | bytearray | memoryview) -> str | None:
+        """Copying variant of received(), for drivers that get bytes back."""
+        count = len(data)
+        if count > self.needed:
+            raise ValueError("Received more than the handshake asked for")
+        self._view[self._filled:self._filled + count] = data
+        return self.received(count)
+
+    def _expect(self, needed: int) -> None:
+        # Starts a new message at the front of the buffer
+        self._filled = 0
+        self.needed = needed
+
+    def _step(self) -> str | None:
+        raise NotImplementedError
+
+
+class SOCKS5Handshake(ClientHandshake):
+    """Greeting, optional username/password auth and one request.
+
+    host must already be what goes on the wire: an IP literal, or a name
+    the proxy should resolve. With pipelined the whole client side is sent
+    up front and only the one auth method the credentials call for is
+    offered."""
+
+    _METHOD, _AUTH, _REPLY, _REPLY_ADDRESS = range(4)
+
+    def __init__(
+        self,
+        cmd: int,
+        host: str,
+        port: int,
+        username: bytes | None = None,
+        password: bytes | None = None,
+        pipelined: bool = False,
+    ):
+        super().__init__()
+        self.pipelined = pipelined
+        self._credentials = bool(username and password)
+        self._request = bytes((SOCKS5_VERSION, cmd, 0x00)) + encode_socks5_address(host, port)
+        self._auth = (
+            bytes((0x01, len(username))) + username + bytes((len(password),)) + password
+            if self._credentials
+            else b""
+        )
+
+        if pipelined:
+            method = METHOD_USERNAME_PASSWORD if self._credentials else METHOD_NO_AUTH
+            self._offered = (method,)
+            self._outgoing = bytes((SOCKS5_VERSION, 1, method)) + self._auth + self._request
+        elif self._credentials:
+            # Username/password in addition to the standard none
+            self._offered = (METHOD_NO_AUTH, METHOD_USERNAME_PASSWORD)
+            self._outgoing = bytes((SOCKS5_VERSION, 2, METHOD_NO_AUTH, METHOD_USERNAME_PASSWORD))
+        else:
+            self._offered = (METHOD_NO_AUTH,)
+            self._outgoing = bytes((SOCKS5_VERSION, 1, METHOD_NO_AUTH))
+
+        self._state = self._METHOD
+        self._expect(2)
+
+    def _step(self) -> str | None:
+        buffer = self._buffer
+        state = self._state
+
+        if state == self._METHOD:
+            if buffer[0] != SOCKS5_VERSION:
+                raise _invalid_socks5()
+            chosen = buffer[1]
+            if chosen == METHOD_NO_ACCEPTABLE:
+                raise SOCKS5AuthError("All offered SOCKS5 authentication methods were rejected")
+            if chosen == METHOD_USERNAME_PASSWORD and not self._credentials:
+                # Although we said we don't support authentication, the
+                # server may still request basic username/password
+                raise SOCKS5AuthError("No username/password supplied. "
+                                      "Server requested username/password"
+                                      " authentication")
+            if chosen not in self._offered:
+                raise _invalid_socks5()
+
+            if chosen == METHOD_USERNAME_PASSWORD:
+                if not self.pipelined:
+                    self._outgoing = self._auth
+                self._state = self._AUTH
+                self._expect(2)
+            else:
+                if not self.pipelined:
+                    self._outgoing = self._request
+                self._state = self._REPLY
+                self._expect(3)
+            return "socks5_method"
+
+        if state == self._AUTH:
+            if buffer[0] != 0x01:
+                raise _invalid_socks5()
+            if buffer[1] != 0x00:
+                raise SOCKS5AuthError("SOCKS5 authentication failed")
+            if not self.pipelined:
+                self._outgoing = self._request
+            self._state = self._REPLY
+            self._expect(3)
+            return "socks5_auth"
+
+        if state == self._REPLY:
+            if buffer[0] != SOCKS5_VERSION:
+                raise _invalid_socks5()
+            status = buffer[1]
+            if status != 0x00:
+                # Connection failed: server returned an error
+                error = SOCKS5_ERRORS.get(status, "Unknown error")
+                raise SOCKS5Error("{:#04x}: {}".format(status, error))
+            # ATYP and the first address byte, which for a name is its length
+            self._state = self._REPLY_ADDRESS
+            self.needed = 2
+            return None
+
+        # _REPLY_ADDRESS
+        if self._filled == 5:
+            atyp = buffer[3]
+            if atyp == ATYP_IPV4:
+                rest = 4 + 2 - 1
+            elif atyp == ATYP_IPV6:
+                rest = 16 + 2 - 1
+            elif atyp == ATYP_DOMAIN:
+                rest = buffer[4] + 2
+            else:
+                raise _invalid_socks5()
+            self.needed = rest
+            return None
+
+        host, port, _ = decode_socks5_address(self._view, 3)
+        self.bound = (host, port)
+        self.done = True
+        return "socks5_request"
+
+
+class SOCKS4Handshake(ClientHandshake):
+    """A SOCKS4 CONNECT, or SOCKS4a when host is a name for the proxy."""
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        userid: bytes | None = None,
+    ):
+        super().__init__()
+        try:
+            addr_bytes = socket.inet_aton(host)
+            self.remote_resolve = False
+        except OSError:
+            # NOTE: This is actually an extension to the SOCKS4 protocol
+            # called SOCKS4A and may not be supported in all cases.
+            addr_bytes = b"\x00\x00\x00\x01"
+            self.remote_resolve = True
+
+        self.request_addr = socket.inet_ntoa(addr_bytes)
+        self._outgoing = (
+            pack(">BBH", SOCKS4_VERSION, CMD_CONNECT, port)
+            + addr_bytes
+            + (userid or b"")
+            + b"\x00"
+            + (host.encode("idna") + b"\x00" if self.remote_resolve else b"")
+        )
+        self._expect(8)
+
+    def _step(self) -> str | None:
+        buffer = self._buffer
+        if buffer[0] != 0x00:
+            raise GeneralProxyError("SOCKS4 proxy server sent invalid data")
+
+        status = buffer[1]
+        if status != SOCKS4_GRANTED:
+            # Connection failed: server returned an error
+            error = SOCKS4_ERRORS.get(status, "Unknown error")
+            raise SOCKS4Error("{:#04x}: {}".format(status, error))
+
+        (port,) = unpack_from(">H", buffer, 2)
+        self.bound = (socket.inet_ntoa(buffer[4:8]), port)
+        self.done = True
+        return "socks4_request"
+
+
+def _http_authority(host: str) -> str:
+    # IPv6 literals are bracketed in request targets and Host headers
+    return f"[{host}]" if ":" in host else host
+
+
+_HEADER_END: bytes = b"\r\n\r\n"
+_HTTP_STATUS_PREFIX: int = len("HTTP/1.1 200")
+
+
+class HTTPConnectHandshake(ClientHandshake):
+    """An HTTP CONNECT request and the response headers.
+
+    After the status line prefix the headers end at a delimiter, so reads
+    stop exactly at the blank line only if the driver honours it."""
+
+    capacity = 8192
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        host_header: str | None = None,
+        username: bytes | None = None,
+        password: bytes | None = None,
+    ):
+        super().__init__()
+        http_headers = [
+            (b"CONNECT " + _http_authority(host).encode("idna") + b":"
+             + str(port).encode() + b" HTTP/1.1"),
+            b"Host: " + _http_authority(host_header or host).encode("idna")
+        ]
+        if username and password:
+            http_headers.append(b"Proxy-Authorization: basic "
+                                + b64encode(username + b":" + password))
+        http_headers.append(b"\r\n")
+
+        self._outgoing = b"\r\n".join(http_headers)
+        self.status_code: int | None = None
+        self._expect(_HTTP_STATUS_PREFIX)
+
+    def _step(self) -> str | None:
+        buffer = self._buffer
+        filled = self._filled
+        if self.delimiter is None and (b"\r" in buffer[:filled] or b"\n" in buffer[:filled]):
+            # No valid status line breaks before its code, and with the
+            # prefix clean the terminator can only come after it
+            raise GeneralProxyError("HTTP proxy server sent invalid response")
+        if buffer[filled - 4:filled] != _HEADER_END:
+            self.delimiter = _HEADER_END
+            self.needed = self.capacity - filled
+            if not self.needed:
+                raise GeneralProxyError("HTTP proxy server sent invalid response")
+            return None
+        self.delimiter = None
+        self.needed = 0
+
+        status_line = bytes(buffer[:buffer.index(b"\r\n")]).decode("iso-8859-1")
+        try:
+            proto, status_code, status_msg = status_line.split(" ", 2)
+        except ValueError:
+            raise GeneralProxyError("HTTP proxy server sent invalid response")
+
+        if not proto.startswith("HTTP/"):
+            raise GeneralProxyError(
+                "Proxy server does not appear to be an HTTP proxy")
+
+        try:
+            status_code = int(status_code)
+        except ValueError:
+            raise HTTPError(
+                "HTTP proxy server did not return a valid HTTP status")
+
+        self.status_code = status_code
+        if status_code != 200:
+            error = "{}: {}".format(status_code, status_msg)
+            if status_code in (400, 403, 405):
+                # It's likely that the HTTP proxy server does not support the
+                # CONNECT tunneling method
+                error += ("\n[*] Note: The HTTP proxy server may not be"
+                          " supported by PySocks (must be a CONNECT tunnel"
+                          " proxy)")
+            raise HTTPError(error)
+
+        self.bound = (b"0.0.0.0", 0)
+        self.done = True
+        return "http_status"
@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from collections import OrderedDict
+from collections.abc import Callable
+import socket
+import threading
+import time
+
+# The stub resolver never tells us the record TTLs, so entries live for a
+# fixed time. Failures are kept for much less, a name that did not resolve
+# is often just a flaky network.
+DEFAULT_TTL: float = 60.0
+DEFAULT_NEGATIVE_TTL: float = 5.0
+DEFAULT_MAX_ENTRIES: int = 1024
+
+
+class _Lookup:
+    """One getaddrinfo() call that other threads can wait on."""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: list | None = None
+        self.error: Exception | None = None
+
+
+def _with_port(addrinfos: list, port: int | None) -> list:
+    # Results are cached without a port so every port shares one entry
+    if not port:
+        return addrinfos
+    return [
+        (family, type, proto, canonname, (sockaddr[0], port, *sockaddr[2:]))
+        for family, type, proto, canonname, sockaddr in addrinfos
+    ]
+
+
+class ResolverCache:
+    """Thread-safe getaddrinfo() cache.
+
+    Entries expire after ttl seconds (negative_ttl for failed lookups) and
+    the least recently used one is evicted past max_entries. Threads asking
+    for a name that is already being looked up wait for that lookup instead
+    of starting their own."""
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl: float = DEFAULT_TTL,
+        negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+        resolve: Callable[..., list] = socket.getaddrinfo,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits: int = 0
+        self.misses: int = 0
+        self.coalesced: int = 0
+        self.evictions: int = 0
+
+        self._resolve = resolve
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (expires, addrinfos or None, error or None)
+        self._entries: OrderedDict[tuple, tuple[float, list | None, Exception | None]] = OrderedDict()
+        self._inflight: dict[tuple, _Lookup] = {}
+
+    def getaddrinfo(
+        self,
+        host: str,
+        port: int | None,
+        family: int = 0,
+        type: int = 0,
+        proto: int = 0,
+        flags: int = 0,
+    ) -> list:
+        """Same arguments and results as socket.getaddrinfo()."""
+        key = (host, family, type, proto, flags)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, addrinfos, error = entry
+                if expires > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    if error is not None:
+                        raise error.__class__(*error.args)
+                    return _with_port(addrinfos, port)
+                del self._entries[key]
+
+            lookup = self._inflight.get(key)
+            if lookup is None:
+                lookup = self._inflight[key] = _Lookup()
+                owner = True
+                self.misses += 1
+            else:
+                owner = False
+                self.coalesced += 1
+
+        if owner:
+            self._run(key, lookup)
+        else:
+            lookup.done.wait()
+
+        if lookup.error is not None:
+            raise lookup.error.__class__(*lookup.error.args)
+        return _with_port(lookup.result, port)
+
+    def gethostbyname(self, host: str) -> str:
+        """IPv4 address for host, like socket.gethostbyname()."""
+        if not host:
+            return "0.0.0.0"
+        return self.getaddrinfo(host, None, socket.AF_INET, socket.SOCK_STREAM)[0][4][0]
+
+    def _run(self, key: tuple, lookup: _Lookup) -> None:
+        host, family, type, proto, flags = key
+        ttl = 0.0
+        try:
+            lookup.result = self._resolve(host, None, family, type, proto, flags)
+            ttl = self.ttl
+        except OSError as e:
+            lookup.error = e
+            ttl = self.negative_ttl
+        except Exception as e:
+            # e.g. a name idna cannot encode, passed on but not cached
+            lookup.error = e
+        finally:
+            with self._lock:
+                del self._inflight[key]
+                if ttl > 0:
+                    self._entries[key] = (self._clock() + ttl, lookup.result, lookup.error)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self.evictions += 1
+            lookup.done.set()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Shared by every socksocket unless one is given its own
+default_resolver: ResolverCache = ResolverCache()
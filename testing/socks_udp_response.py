@@ -6,52 +6,303 @@
 #
 # Copyright (C) 2025 pyamsoft
 # Copyright (C) 2016-2025 Zhuofei Wang <semigodking@gmail.com>
-# 
+#
 # Licensed under the Apache License, Version 2.0 (the "License"); you may not
 # use this file except in compliance with the License.  You may obtain a copy
 # of the License at
-# 
+#
 #     http://www.apache.org/licenses/LICENSE-2.0
-# 
+#
 # Unless required by applicable law or agreed to in writing, software
 # distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import selectors
 import socket
 import socks
+import threading
 from traceback import print_exc
+from udp_retry import UdpPath
 
 FAILED_RESP: bytes = bytes([])
 
-def proxy_udp_request(
-    request: bytes,
-    remote_host: str,
-    remote_port: int,
-    proxy_server_host: str, 
-    proxy_server_port: int, 
-    user: str | None = None, 
-    pwd: str | None = None,
-) -> bytes:
-    s = socks.socksocket(socket.AF_INET, socket.SOCK_DGRAM)
+# How often the reader thread wakes up to check the association is still wanted
+_POLL_INTERVAL_SECONDS: float = 1.0
+
+# How long connecting to the proxy and the UDP ASSOCIATE handshake may take
+_ASSOCIATE_TIMEOUT_SECONDS: float = 10.0
+
+# Largest datagram the reader thread accepts, SOCKS5 header included
+_RECV_BUFFER_SIZE: int = 4096 + 1024
+
+# Transaction IDs remembered after their reply, or after giving up on one,
+# so late copies can be told apart from stray packets
+_ANSWERED_HISTORY: int = 1024
+
+# Shared by every proxied request, so the RTT estimate carries over
+proxy_path = UdpPath("proxy")
+
+
+class _PendingReply:
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.response: bytes | None = None
+
+
+def _remember(history: dict[int, UdpPath], transaction_id: int, path: UdpPath) -> None:
+    # Called with the lock held, oldest IDs are forgotten first
+    history.pop(transaction_id, None)
+    history[transaction_id] = path
+    if len(history) > _ANSWERED_HISTORY:
+        del history[next(iter(history))]
+
+
+class ProxyUdpAssociation:
+    """One long-lived SOCKS5 UDP association.
+
+    Replies are matched to callers by DNS transaction ID, so many requests can
+    share the same relay. When the TCP control connection drops, everyone
+    waiting is failed and the next request negotiates a fresh association."""
+
+    def __init__(
+        self,
+        proxy_server_host: str,
+        proxy_server_port: int,
+        user: str | None = None,
+        pwd: str | None = None,
+    ):
+        self._proxy = (proxy_server_host, proxy_server_port, user, pwd)
+        self._lock = threading.Lock()
+        # Held while a new association is negotiated, never together with
+        # _lock, so the reader thread and _drop() carry on meanwhile
+        self._associate_lock = threading.Lock()
+        self._sock: socks.socksocket | None = None
+        self._pending: dict[int, _PendingReply] = {}
+        self._answered: dict[int, UdpPath] = {}
+        self._lost: dict[int, UdpPath] = {}
+        self.associations: int = 0
+        self.unmatched: int = 0
+
+    def _current(self) -> socks.socksocket:
+        s = self._sock
+        if s is not None:
+            return s
+        # Only one caller negotiates, the rest wait for it and share the result
+        with self._associate_lock:
+            s = self._sock
+            if s is None:
+                s = self._associate()
+        return s
+
+    def _associate(self) -> socks.socksocket:
+        # Called with _associate_lock held
+        proxy_server_host, proxy_server_port, user, pwd = self._proxy
+        s = socks.socksocket(socket.AF_INET, socket.SOCK_DGRAM)
+        # A dead proxy fails the request instead of hanging it
+        s.settimeout(_ASSOCIATE_TIMEOUT_SECONDS)
 
-    try:
         # The SOCKS server resolves DNS for us
         rdns=True
 
         s.set_proxy(
-            socks.SOCKS5, 
+            socks.SOCKS5,
             proxy_server_host,
             proxy_server_port,
             rdns,
             user,
             pwd,
         )
+        try:
+            s.bind(("", 0))
+        except BaseException:
+            s.close()
+            raise
+
+        with self._lock:
+            self.associations += 1
+            self._sock = s
+        threading.Thread(
+            target=self._read_loop,
+            args=(s,),
+            name=f"proxy-udp-{proxy_server_host}:{proxy_server_port}",
+            daemon=True,
+        ).start()
+        return s
+
+    def _read_loop(self, s: socks.socksocket) -> None:
+        selector = selectors.DefaultSelector()
+        selector.register(s, selectors.EVENT_READ)
+        selector.register(s._proxyconn, selectors.EVENT_READ)
+
+        # One buffer for the life of the association, replies are parsed in place
+        buffer = bytearray(_RECV_BUFFER_SIZE)
+        view = memoryview(buffer)
+        try:
+            while self._sock is s:
+                for key, _ in selector.select(_POLL_INTERVAL_SECONDS):
+                    if key.fileobj is s:
+                        (offset, length, _) = s.recvfrom_payload_into(buffer)
+                        self._deliver(view[offset:offset + length])
+                    elif not s._proxyconn.recv(1024):
+                        # Server closed the control connection, the relay is gone
+                        return
+        except (socks.ProxyError, socket.error, ValueError):
+            if self._sock is s:
+                print_exc()
+        finally:
+            selector.close()
+            self._drop(s)
 
-        s.sendto(request, (remote_host,  remote_port))
-        (resp, _)= s.recvfrom(4096)
+    def _deliver(self, resp: memoryview) -> None:
+        if len(resp) < 2:
+            return
+
+        transaction_id = int.from_bytes(resp[:2], "big")
+        late = False
+        with self._lock:
+            pending = self._pending.pop(transaction_id, None)
+            path = None if pending else self._answered.get(transaction_id)
+            if not pending and not path:
+                path = self._lost.pop(transaction_id, None)
+                if path:
+                    # Any more copies are duplicates of this one
+                    late = True
+                    _remember(self._answered, transaction_id, path)
+                else:
+                    self.unmatched += 1
+        if late:
+            # The request already counted as lost, the reply was just too slow
+            path.count_late()
+        elif path:
+            # A retransmitted request answered twice, the caller already has one
+            path.count_duplicate()
+        if pending:
+            # Only replies somebody is waiting for get copied out of the buffer
+            pending.response = bytes(resp)
+            pending.event.set()
+
+    def _drop(self, s: socks.socksocket) -> None:
+        with self._lock:
+            if self._sock is s:
+                self._sock = None
+            waiting = list(self._pending.values())
+            self._pending.clear()
+        s.close()
+
+        # Wake everyone up, they were waiting on a relay that no longer exists
+        for pending in waiting:
+            pending.event.set()
+
+    def request(
+        self,
+        request: bytes,
+        remote_host: str,
+        remote_port: int,
+        timeout: float | None = None,
+        path: UdpPath | None = None,
+    ) -> bytes:
+        """Sends request and waits for the reply with the same transaction ID.
+
+        With a path, the wait is the path's adaptive timeout and the request
+        is retransmitted as many times as the path allows, otherwise it is
+        sent once and waits up to timeout."""
+        transaction_id = int.from_bytes(request[:2], "big")
+        pending = _PendingReply()
+
+        s = self._current()
+        with self._lock:
+            if transaction_id in self._pending:
+                raise socks.GeneralProxyError(
+                    f"Transaction {transaction_id:#06x} already in flight")
+            self._pending[transaction_id] = pending
+
+        def wait(wait_timeout: float | None) -> bytes | None:
+            if not pending.event.wait(wait_timeout):
+                return None
+            if pending.response is None:
+                raise socks.GeneralProxyError("UDP association closed by proxy")
+            return pending.response
+
+        # Stays None when the send fails or the association drops mid-wait
+        resp = None
+        try:
+            if path is None:
+                s.sendto(request, (remote_host, remote_port))
+                resp = wait(timeout)
+            else:
+                resp = path.exchange(lambda: s.sendto(request, (remote_host, remote_port)), wait)
+        finally:
+            with self._lock:
+                if self._pending.get(transaction_id) is pending:
+                    del self._pending[transaction_id]
+                if path is not None:
+                    _remember(self._answered if resp is not None else self._lost, transaction_id, path)
+
+        if resp is None:
+            raise socket.timeout(f"No reply for transaction {transaction_id:#06x}")
         return resp
+
+    def close(self) -> None:
+        with self._lock:
+            s = self._sock
+        if s:
+            self._drop(s)
+
+
+_associations: dict[tuple, ProxyUdpAssociation] = {}
+_associations_lock = threading.Lock()
+
+
+def get_association(
+    proxy_server_host: str,
+    proxy_server_port: int,
+    user: str | None = None,
+    pwd: str | None = None,
+) -> ProxyUdpAssociation:
+    key = (proxy_server_host, proxy_server_port, user, pwd)
+    with _associations_lock:
+        association = _associations.get(key)
+        if not association:
+            association = ProxyUdpAssociation(*key)
+            _associations[key] = association
+        return association
+
+
+def close_associations() -> None:
+    with _associations_lock:
+        associations = list(_associations.values())
+        _associations.clear()
+    for association in associations:
+        association.close()
+
+
+def proxy_udp_request(
+    request: bytes,
+    remote_host: str,
+    remote_port: int,
+    proxy_server_host: str,
+    proxy_server_port: int,
+    user: str | None = None,
+    pwd: str | None = None,
+    timeout: float | None = None,
+    path: UdpPath | None = None,
+) -> bytes:
+    """One proxied request and its reply, FAILED_RESP if there was none.
+
+    Adaptive timeouts and retransmits come from path, proxy_path by default.
+    A fixed timeout sends the request once and waits that long instead."""
+    association = get_association(proxy_server_host, proxy_server_port, user, pwd)
+    if timeout is None:
+        path = path or proxy_path
+
+    try:
+        return association.request(request, remote_host, remote_port, timeout, path)
+    except socket.timeout:
+        # Already counted as lost on the path, not worth a traceback
+        pass
     except socks.ProxyError:
         print_exc()
     except socket.error:
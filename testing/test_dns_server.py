@@ -0,0 +1,59 @@
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from dns_server import DnsServer, DnsServerConfig, build_dns_reply
+from dns_wire import TYPE_A, build_dns_request, parse_dns_response
+from struct import pack, unpack
+import asyncio
+
+
+def test_replies_are_the_same_every_time():
+    config = DnsServerConfig(answer_count=3, ttl=42)
+    request = build_dns_request(0x4242, "example.com")
+
+    reply = parse_dns_response(build_dns_reply(request, config))
+
+    assert reply.transaction_id == 0x4242
+    assert reply.response_code == 0
+    assert [(r.dns_type, r.ttl) for r in reply.results] == [(TYPE_A, 42)] * 3
+    assert all(r.address.startswith("198.1") for r in reply.results)
+    assert build_dns_reply(request, config) == build_dns_reply(request, config)
+
+
+def test_a_malformed_question_gets_formerr():
+    reply = parse_dns_response(build_dns_reply(b"\x12\x34\x01", DnsServerConfig()))
+
+    assert reply.transaction_id == 0x1234
+    assert reply.response_code == 1
+
+
+def test_stop_closes_open_tcp_clients():
+    async def run() -> bytes:
+        server = DnsServer()
+        host, port = await server.start()
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            request = build_dns_request(7, "example.com")
+            writer.write(pack(">H", len(request)) + request)
+            (length,) = unpack(">H", await reader.readexactly(2))
+            assert parse_dns_response(await reader.readexactly(length)).transaction_id == 7
+
+            # The client is still connected, stopping must not wait for it
+            await asyncio.wait_for(server.stop(), 5)
+            return await asyncio.wait_for(reader.read(), 5)
+        finally:
+            writer.close()
+
+    assert asyncio.run(run()) == b""
@@ -0,0 +1,163 @@
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from dns_wire import (
+    TYPE_A,
+    TYPE_AAAA,
+    TYPE_CNAME,
+    TYPE_MX,
+    TYPE_SOA,
+    DNSParseError,
+    _read_name,
+    build_dns_request,
+    parse_dns_question,
+    parse_dns_response,
+    parse_dns_responses,
+)
+from struct import pack
+import pytest
+
+# example.com as it sits in the question, right after the 12 byte header
+_QNAME = b"\x07example\x03com\x00"
+# Compression pointer to that name
+_QNAME_POINTER = b"\xc0\x0c"
+
+
+def _response(answers: list[bytes], authorities: list[bytes] = (), flags: int = 0x8180) -> bytes:
+    header = pack(">HHHHHH", 0xBEEF, flags, 1, len(answers), len(authorities), 0)
+    question = _QNAME + pack(">HH", TYPE_A, 1)
+    return header + question + b"".join(answers) + b"".join(authorities)
+
+
+def _record(dns_type: int, rdata: bytes, owner: bytes = _QNAME_POINTER, ttl: int = 300) -> bytes:
+    return owner + pack(">HHIH", dns_type, 1, ttl, len(rdata)) + rdata
+
+
+def test_request_round_trips_through_the_question_parser():
+    request = build_dns_request(0x1234, "example.com")
+
+    assert request[:12] == pack(">HHHHHH", 0x1234, 0x0100, 1, 0, 0, 0)
+    assert request[12:] == _QNAME + pack(">HH", TYPE_A, 1)
+    assert parse_dns_question(request) == (0x1234, 0x0100, "example.com", TYPE_A, 1, len(request))
+
+
+def test_header_fields_and_address_records():
+    response = parse_dns_response(_response([
+        _record(TYPE_A, bytes((93, 184, 216, 34))),
+        _record(TYPE_AAAA, bytes.fromhex("26062800022000010248189325c81946"), ttl=60),
+    ]))
+
+    assert response.transaction_id == 0xBEEF
+    assert response.query_or_response == 1
+    assert response.opcode == 0
+    assert response.recursion_desired_bit == 1
+    assert response.recursion_available_bit == 1
+    assert response.response_code == 0
+    assert (response.question_count, response.answer_count) == (1, 2)
+    assert [(r.dns_type, r.dns_class, r.ttl, r.address) for r in response.results] == [
+        (TYPE_A, 1, 300, "93.184.216.34"),
+        (TYPE_AAAA, 1, 60, "2606:2800:220:1:248:1893:25c8:1946"),
+    ]
+
+
+def test_response_code_and_truncation_bit():
+    response = parse_dns_response(_response([], flags=0x8383))
+
+    assert response.truncation_bit == 1
+    assert response.response_code == 3
+    assert response.results == []
+
+
+def test_names_follow_compression_pointers():
+    # The CNAME target is "www" then a pointer back to the question name
+    cname = _record(TYPE_CNAME, b"\x03www" + _QNAME_POINTER)
+    # The MX exchange points into the CNAME target, at "www.example.com"
+    cname_offset = 12 + len(_QNAME) + 4
+    target_offset = cname_offset + 2 + 10
+    mx = _record(TYPE_MX, pack(">H", 10) + pack(">H", 0xC000 | target_offset))
+
+    response = parse_dns_response(_response([cname, mx]))
+
+    assert [r.address for r in response.results] == ["www.example.com", "10 www.example.com"]
+
+
+def test_soa_in_the_authority_section():
+    soa = _record(
+        TYPE_SOA,
+        b"\x02ns" + _QNAME_POINTER + b"\x05admin" + _QNAME_POINTER + pack(">IIIII", 1, 7200, 3600, 1209600, 300),
+    )
+
+    response = parse_dns_response(_response([], [soa], flags=0x8183))
+
+    assert response.authority_count == 1
+    assert response.authorities[0].address == "ns.example.com admin.example.com 1 7200 3600 1209600 300"
+
+
+def test_unknown_types_keep_their_rdata_in_rfc3597_form():
+    response = parse_dns_response(_response([_record(99, b"\x01\x02\xff")]))
+
+    assert response.results[0].dns_type == 99
+    assert response.results[0].address == "\\# 3 0102ff"
+
+
+def test_read_name_remembers_every_suffix():
+    message = memoryview(b"\x00" * 4 + b"\x01a\x01b\x01c\x00" + b"\x01d" + pack(">H", 0xC000 | 6))
+    names: dict[int, str] = {}
+
+    assert _read_name(message, 4, names) == ("a.b.c", 11)
+    assert names == {4: "a.b.c", 6: "b.c", 8: "c"}
+    # A pointer into the middle is answered from the cache
+    assert _read_name(message, 11, names) == ("d.b.c", 15)
+
+
+def test_pointer_loop_raises():
+    # The CNAME target points at itself
+    cname_offset = 12 + len(_QNAME) + 4
+    rdata_offset = cname_offset + 2 + 10
+    looping = _record(TYPE_CNAME, pack(">H", 0xC000 | rdata_offset))
+
+    with pytest.raises(DNSParseError, match="loop"):
+        parse_dns_response(_response([looping]))
+
+
+def test_two_pointers_chasing_each_other_raise():
+    message = memoryview(pack(">HH", 0xC002, 0xC000))
+
+    with pytest.raises(DNSParseError):
+        _read_name(message, 0, {})
+
+
+@pytest.mark.parametrize("cut", [5, 12 + 3, 12 + len(_QNAME) + 4 + 6])
+def test_truncated_messages_raise(cut: int):
+    message = _response([_record(TYPE_A, bytes((10, 0, 0, 1)))])
+
+    with pytest.raises(DNSParseError):
+        parse_dns_response(message[:cut])
+
+
+def test_rdlength_past_the_end_raises():
+    message = _response([_QNAME_POINTER + pack(">HHIH", TYPE_A, 1, 300, 40) + bytes(4)])
+
+    with pytest.raises(DNSParseError, match="past the end"):
+        parse_dns_response(message)
+
+
+def test_batches_skip_and_count_malformed_responses():
+    good = _response([_record(TYPE_A, bytes((10, 0, 0, 1)))])
+
+    parsed, malformed = parse_dns_responses([good, good[:20], good])
+
+    assert malformed == 1
+    assert [r.results[0].address for r in parsed] == ["10.0.0.1", "10.0.0.1"]
@@ -0,0 +1,149 @@
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from array import array
+from histogram import LatencyHistogram, format_ns
+import pytest
+
+
+def _filled(values) -> LatencyHistogram:
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    return histogram
+
+
+def test_empty_histogram_reports_zeros():
+    histogram = LatencyHistogram()
+
+    assert histogram.percentile(99) == 0
+    assert histogram.mean() == 0.0
+    assert histogram.summary() == {"p50": 0, "p90": 0, "p99": 0, "p99.9": 0, "max": 0}
+
+
+def test_small_values_are_exact():
+    histogram = _filled(range(1, 101))
+
+    assert histogram.percentile(50) == 50
+    assert histogram.percentile(90) == 90
+    assert histogram.percentile(99) == 99
+    assert histogram.percentile(100) == 100
+    assert (histogram.min, histogram.max, histogram.total) == (1, 100, 100)
+    assert histogram.mean() == 50.5
+
+
+@pytest.mark.parametrize("value", [257, 1_000, 123_456, 5_000_000, 2_000_000_000])
+def test_large_values_stay_within_one_percent(value: int):
+    # Two values so the percentile can't just fall back to the max
+    histogram = _filled([value, value * 4])
+
+    reported = histogram.percentile(50)
+
+    assert value <= reported <= value * 1.01
+
+
+def test_percentile_uses_the_nearest_rank():
+    # 1 to 10 once each: p25 is the 3rd value (2.5 rounds up), p95 the 10th
+    histogram = _filled(range(1, 11))
+
+    assert histogram.percentile(25) == 3
+    assert histogram.percentile(95) == 10
+
+
+def test_percentile_never_passes_the_max():
+    histogram = _filled([1_000_001])
+
+    assert histogram.percentile(50) == 1_000_001
+
+
+def test_negative_values_count_as_zero_and_huge_ones_are_clamped():
+    histogram = LatencyHistogram(highest_bits=20)
+    histogram.record(-5)
+    histogram.record(1 << 30)
+
+    assert histogram.min == 0
+    assert histogram.max == 1 << 30
+    assert histogram.percentile(50) == 0
+    # Percentiles top out at the highest trackable value, max stays exact
+    assert histogram.percentile(100) == (1 << 20) - 1
+
+
+def test_record_with_a_count():
+    histogram = LatencyHistogram()
+    histogram.record(10, count=9)
+    histogram.record(1_000)
+
+    assert histogram.total == 10
+    assert histogram.sum == 1_090
+    assert histogram.percentile(90) == 10
+    assert histogram.percentile(99) == 1_000
+
+
+def test_merge_is_the_same_as_recording_everything_in_one():
+    left = _filled(range(0, 5_000, 7))
+    right = _filled(range(3, 900_000, 311))
+    both = _filled([*range(0, 5_000, 7), *range(3, 900_000, 311)])
+
+    left.merge(right)
+
+    assert left.counts == both.counts
+    assert (left.total, left.min, left.max, left.sum) == (both.total, both.min, both.max, both.sum)
+    assert left.summary() == both.summary()
+
+
+def test_merge_into_an_empty_histogram_takes_the_min():
+    histogram = LatencyHistogram()
+    histogram.merge(_filled([40, 50]))
+    histogram.merge(LatencyHistogram())
+
+    assert (histogram.min, histogram.max, histogram.total) == (40, 50, 2)
+
+
+def test_merge_refuses_a_different_range():
+    with pytest.raises(ValueError):
+        LatencyHistogram().merge(LatencyHistogram(highest_bits=30))
+
+
+def test_words_carry_a_histogram_between_processes():
+    source = _filled([3, 3_000, 3_000_000])
+    words = array("Q", bytes(8 * source.word_count))
+    source.write_words(memoryview(words))
+
+    target = _filled([1])
+    target.merge_words(memoryview(words))
+
+    assert target.total == 4
+    assert (target.min, target.max) == (1, 3_000_000)
+    assert target.sum == 3_003_004
+    assert target.percentile(100) == 3_000_000
+
+
+def test_reset_forgets_everything():
+    histogram = _filled([5, 500])
+    histogram.reset()
+
+    assert histogram.total == 0
+    assert not any(histogram.counts)
+    assert histogram.percentile(50) == 0
+
+
+@pytest.mark.parametrize("value_ns, text", [
+    (1_500, "1.5us"),
+    (2_345_678, "2.346ms"),
+    (3_000_000_000, "3.000s"),
+    (-2_000_000, "-2.000ms"),
+])
+def test_format_ns(value_ns: int, text: str):
+    assert format_ns(value_ns) == text
@@ -0,0 +1,79 @@
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from reference_proxy import BandwidthLimiter
+import asyncio
+import reference_proxy
+
+
+class _FakeTime:
+    """Stands in for the time module, sleeping only moves the clock."""
+
+    def __init__(self):
+        self.now = 100.0
+        self.slept: list[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def _limiter(monkeypatch, limit: int) -> tuple[BandwidthLimiter, _FakeTime]:
+    clock = _FakeTime()
+    monkeypatch.setattr(reference_proxy, "time", clock)
+
+    async def sleep(delay: float) -> None:
+        clock.slept.append(delay)
+        clock.now += delay
+    monkeypatch.setattr(reference_proxy.asyncio, "sleep", sleep)
+    return BandwidthLimiter(limit), clock
+
+
+def test_going_over_waits_out_the_second(monkeypatch):
+    limiter, clock = _limiter(monkeypatch, 1_000)
+
+    async def run() -> None:
+        await limiter.enforce(600)
+        clock.now += 0.25
+        await limiter.enforce(600)
+    asyncio.run(run())
+
+    assert clock.slept == [0.75]
+    assert limiter.waits == 1
+
+
+def test_an_idle_client_gets_its_whole_allowance_back(monkeypatch):
+    limiter, clock = _limiter(monkeypatch, 1_000)
+
+    async def run() -> None:
+        # Three seconds over in one read, then quiet for longer than that
+        await limiter.enforce(4_000)
+        clock.now += 5.0
+        await limiter.enforce(1_000)
+    asyncio.run(run())
+
+    assert clock.slept == [1.0]
+    assert limiter.waits == 1
+
+
+def test_the_overshoot_counts_against_the_next_second(monkeypatch):
+    limiter, clock = _limiter(monkeypatch, 1_000)
+
+    async def run() -> None:
+        await limiter.enforce(1_500)
+        await limiter.enforce(600)
+    asyncio.run(run())
+
+    # 500 left over plus 600 is over again, so the second read waits too
+    assert clock.slept == [1.0, 1.0]
@@ -0,0 +1,338 @@
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from socks_codec import (
+    CMD_CONNECT,
+    CMD_UDP_ASSOCIATE,
+    FRAG_END,
+    ClientHandshake,
+    GeneralProxyError,
+    HTTPConnectHandshake,
+    HTTPError,
+    SOCKS4Error,
+    SOCKS4Handshake,
+    SOCKS5AuthError,
+    SOCKS5Error,
+    SOCKS5Handshake,
+    UDPReassembler,
+    decode_socks5_address,
+    decode_socks5_udp_header,
+    encode_socks5_address,
+    encode_socks5_udp_header,
+    split_socks5_udp_payload,
+)
+import pytest
+
+
+def _drive(handshake: ClientHandshake, replies: list[bytes]) -> tuple[bytes, bytes, list[str]]:
+    """Plays the server side, one reply per write the server would make.
+
+    Returns everything the client sent, what was left unread and the phases
+    seen, the way a driver peeking at a socket would see them."""
+    sent = handshake.data_to_send()
+    phases: list[str] = []
+    incoming = b""
+    for reply in replies:
+        incoming += reply
+        while incoming and not handshake.done:
+            count = handshake.scan(incoming)
+            handshake.recv_buffer()[:count] = incoming[:count]
+            incoming = incoming[count:]
+            phase = handshake.received(count)
+            if phase is not None:
+                phases.append(phase)
+                sent += handshake.data_to_send()
+    return sent, incoming, phases
+
+
+# SOCKS5 addresses and UDP headers
+
+@pytest.mark.parametrize("host, port, wire", [
+    ("10.1.2.3", 53, bytes.fromhex("010a0102030035")),
+    ("::1", 443, bytes.fromhex("04" + "00" * 15 + "01" + "01bb")),
+    ("example.com", 80, b"\x03\x0bexample.com\x00\x50"),
+])
+def test_socks5_addresses(host: str, port: int, wire: bytes):
+    assert encode_socks5_address(host, port) == wire
+    assert decode_socks5_address(b"xx" + wire, 2) == (host, port, 2 + len(wire))
+
+
+@pytest.mark.parametrize("wire", [b"\x09\x00\x00", b"\x01\x0a\x01", b"\x03\x0bexample"])
+def test_bad_socks5_addresses_raise(wire: bytes):
+    with pytest.raises(GeneralProxyError):
+        decode_socks5_address(wire, 0)
+
+
+def test_udp_header_round_trip():
+    header = encode_socks5_udp_header("10.0.0.1", 53, frag=2)
+
+    assert header == bytes.fromhex("000002010a0000010035")
+    assert decode_socks5_udp_header(header + b"payload", len(header) + 7) == (2, "10.0.0.1", 53, len(header))
+
+
+def test_udp_header_longer_than_the_datagram_raises():
+    header = encode_socks5_udp_header("example.com", 53)
+
+    with pytest.raises(GeneralProxyError):
+        decode_socks5_udp_header(header, len(header) - 1)
+    with pytest.raises(GeneralProxyError):
+        decode_socks5_udp_header(b"\x00\x00\x00", 3)
+
+
+# SOCKS5 handshake
+
+def test_socks5_connect_without_auth():
+    handshake = SOCKS5Handshake(CMD_CONNECT, "example.com", 443)
+
+    sent, left, phases = _drive(handshake, [b"\x05\x00", b"\x05\x00\x00\x01\x7f\x00\x00\x01\x1f\x90early"])
+
+    assert sent == b"\x05\x01\x00" + b"\x05\x01\x00\x03\x0bexample.com\x01\xbb"
+    assert phases == ["socks5_method", "socks5_request"]
+    assert handshake.done
+    assert handshake.bound == ("127.0.0.1", 8080)
+    # Data the server sent after its reply is not the handshake's
+    assert left == b"early"
+
+
+def test_socks5_username_password():
+    handshake = SOCKS5Handshake(CMD_UDP_ASSOCIATE, "0.0.0.0", 5000, b"user", b"pass")
+
+    sent, _, phases = _drive(handshake, [
+        b"\x05\x02",
+        b"\x01\x00",
+        b"\x05\x00\x00\x03\x05relay\x13\x88",
+    ])
+
+    assert sent == (
+        b"\x05\x02\x00\x02"
+        + b"\x01\x04user\x04pass"
+        + b"\x05\x03\x00\x01\x00\x00\x00\x00\x13\x88"
+    )
+    assert phases == ["socks5_method", "socks5_auth", "socks5_request"]
+    assert handshake.bound == ("relay", 5000)
+
+
+def test_socks5_pipelined_sends_everything_up_front():
+    handshake = SOCKS5Handshake(CMD_CONNECT, "10.0.0.1", 80, b"u", b"p", pipelined=True)
+
+    assert handshake.data_to_send() == (
+        b"\x05\x01\x02" + b"\x01\x01u\x01p" + b"\x05\x01\x00\x01\x0a\x00\x00\x01\x00\x50"
+    )
+    # All three replies arrive in one segment
+    sent, left, _ = _drive(handshake, [b"\x05\x02" + b"\x01\x00" + b"\x05\x00\x00\x01" + bytes(6)])
+    assert sent == b""
+    assert left == b""
+    assert handshake.bound == ("0.0.0.0", 0)
+
+
+def test_socks5_reply_read_a_byte_at_a_time():
+    handshake = SOCKS5Handshake(CMD_CONNECT, "::1", 22)
+    reply = b"\x05\x00" + b"\x05\x00\x00\x04" + bytes(15) + b"\x01\x00\x16"
+
+    _drive(handshake, [bytes((b,)) for b in reply])
+
+    assert handshake.bound == ("::1", 22)
+
+
+@pytest.mark.parametrize("replies, error", [
+    ([b"\x05\xff"], SOCKS5AuthError),
+    ([b"\x05\x02"], SOCKS5AuthError),
+    ([b"\x04\x00"], GeneralProxyError),
+    ([b"\x05\x00", b"\x05\x05\x00"], SOCKS5Error),
+    ([b"\x05\x00", b"\x05\x00\x00\x09\x00"], GeneralProxyError),
+])
+def test_socks5_failures_raise(replies: list[bytes], error: type):
+    with pytest.raises(error):
+        _drive(SOCKS5Handshake(CMD_CONNECT, "example.com", 443), replies)
+
+
+def test_socks5_rejected_credentials_raise():
+    with pytest.raises(SOCKS5AuthError, match="authentication failed"):
+        _drive(SOCKS5Handshake(CMD_CONNECT, "example.com", 443, b"u", b"p"), [b"\x05\x02", b"\x01\x01"])
+
+
+def test_receiving_more_than_needed_raises():
+    handshake = SOCKS5Handshake(CMD_CONNECT, "example.com", 443)
+
+    with pytest.raises(ValueError):
+        handshake.receive(b"\x05\x00\x05")
+
+
+# SOCKS4 and SOCKS4a
+
+def test_socks4_connect():
+    handshake = SOCKS4Handshake("10.0.0.1", 80, b"me")
+
+    sent, left, phases = _drive(handshake, [b"\x00\x5a\x00\x50\x0a\x00\x00\x01", b"data"])
+
+    assert sent == b"\x04\x01\x00\x50\x0a\x00\x00\x01me\x00"
+    assert not handshake.remote_resolve
+    assert phases == ["socks4_request"]
+    assert handshake.bound == ("10.0.0.1", 80)
+    assert left == b"data"
+
+
+def test_socks4a_sends_the_name_after_the_user_id():
+    handshake = SOCKS4Handshake("example.com", 80)
+
+    assert handshake.remote_resolve
+    assert handshake.data_to_send() == b"\x04\x01\x00\x50\x00\x00\x00\x01\x00example.com\x00"
+
+
+def test_socks4_rejection_raises():
+    with pytest.raises(SOCKS4Error, match="0x5b"):
+        _drive(SOCKS4Handshake("10.0.0.1", 80), [b"\x00\x5b" + bytes(6)])
+
+
+# HTTP CONNECT
+
+def test_http_connect_stops_at_the_blank_line():
+    handshake = HTTPConnectHandshake("example.com", 443, username=b"u", password=b"p")
+
+    sent, left, phases = _drive(handshake, [
+        b"HTTP/1.1 200 Connection established\r\n",
+        b"Via: proxy\r\n\r",
+        b"\n\x16\x03\x01",
+    ])
+
+    assert sent == (
+        b"CONNECT example.com:443 HTTP/1.1\r\n"
+        b"Host: example.com\r\n"
+        b"Proxy-Authorization: basic dTpw\r\n\r\n"
+    )
+    assert phases == ["http_status"]
+    assert handshake.status_code == 200
+    assert handshake.delimiter is None
+    assert left == b"\x16\x03\x01"
+
+
+def test_http_connect_headers_come_in_big_reads():
+    handshake = HTTPConnectHandshake("example.com", 443)
+    handshake.data_to_send()
+    headers = b"HTTP/1.1 200 OK\r\n" + b"X-Filler: " + b"x" * 1000 + b"\r\n\r\n"
+
+    handshake.receive(headers[:handshake.needed])
+    assert handshake.delimiter == b"\r\n\r\n"
+    # All the rest fits in one read, and scan() stops at the end of it
+    rest = headers[12:]
+    assert handshake.needed > len(rest)
+    assert handshake.scan(rest + b"tunnel") == len(rest)
+
+
+def test_http_connect_ipv6_target_is_bracketed():
+    handshake = HTTPConnectHandshake("2001:db8::1", 443)
+
+    assert handshake.data_to_send().startswith(b"CONNECT [2001:db8::1]:443 HTTP/1.1\r\nHost: [2001:db8::1]\r\n")
+
+
+@pytest.mark.parametrize("reply, error", [
+    (b"HTTP/1.1 407 Proxy Authentication Required\r\n\r\n", HTTPError),
+    (b"HTTP/1.1 abc Bad\r\n\r\n", HTTPError),
+    (b"SSH-2.0-OpenSSH_9.6 x\r\n\r\n", GeneralProxyError),
+    (b"HTTP/1\r\n\r\nHTTP/1.1 200 OK\r\n\r\n", GeneralProxyError),
+])
+def test_http_connect_failures_raise(reply: bytes, error: type):
+    with pytest.raises(error):
+        _drive(HTTPConnectHandshake("example.com", 443), [reply])
+
+
+def test_http_connect_headers_past_capacity_raise():
+    handshake = HTTPConnectHandshake("example.com", 443)
+
+    with pytest.raises(GeneralProxyError):
+        _drive(handshake, [b"HTTP/1.1 200 OK\r\n" + b"x" * handshake.capacity])
+
+
+# UDP fragmentation
+
+def test_split_numbers_fragments_and_marks_the_last():
+    header = encode_socks5_udp_header("10.0.0.1", 53)
+
+    fragments = split_socks5_udp_payload(header, b"abcdefghij", 4)
+
+    assert [(h[2], bytes(chunk)) for h, chunk in fragments] == [(1, b"abcd"), (2, b"efgh"), (3 | FRAG_END, b"ij")]
+    assert all(h[3:] == header[3:] for h, _ in fragments)
+
+
+def test_split_refuses_more_than_127_fragments():
+    with pytest.raises(ValueError):
+        split_socks5_udp_payload(encode_socks5_udp_header("10.0.0.1", 53), bytes(128), 1)
+
+
+def test_reassembly_in_order():
+    reassembler = UDPReassembler()
+    header = encode_socks5_udp_header("10.0.0.1", 53)
+    source = ("10.0.0.1", 53)
+
+    results = [
+        reassembler.feed(source, h[2], chunk, now=0.0)
+        for h, chunk in split_socks5_udp_payload(header, b"abcdefghij", 4)
+    ]
+
+    assert results == [None, None, b"abcdefghij"]
+    assert reassembler.completed == 1
+    assert len(reassembler) == 0
+
+
+def test_lower_position_restarts_the_sequence():
+    reassembler = UDPReassembler()
+
+    reassembler.feed("s", 1, b"old1", 0.0)
+    reassembler.feed("s", 2, b"old2", 0.0)
+    reassembler.feed("s", 1, b"new1", 0.0)
+
+    assert reassembler.feed("s", 2 | FRAG_END, b"new2", 0.0) == b"new1new2"
+    assert reassembler.abandoned == 1
+
+
+def test_missing_fragment_abandons_the_datagram():
+    reassembler = UDPReassembler()
+
+    reassembler.feed("s", 1, b"a", 0.0)
+
+    assert reassembler.feed("s", 3 | FRAG_END, b"c", 0.0) is None
+    assert reassembler.abandoned == 1
+    assert reassembler.completed == 0
+
+
+def test_stale_queues_expire():
+    reassembler = UDPReassembler(timeout=5.0)
+    reassembler.feed("s", 1, b"a", 0.0)
+
+    reassembler.expire(4.9)
+    assert len(reassembler) == 1
+    reassembler.expire(5.0)
+    assert len(reassembler) == 0
+    assert reassembler.abandoned == 1
+
+
+def test_queues_are_capped_in_bytes_and_count():
+    reassembler = UDPReassembler(max_bytes=4, max_queues=2)
+
+    assert reassembler.feed("big", 1, b"abcde", 0.0) is None
+    assert len(reassembler) == 0
+
+    reassembler.feed("a", 1, b"x", 1.0)
+    reassembler.feed("b", 1, b"x", 2.0)
+    reassembler.feed("c", 1, b"x", 3.0)
+    # The stalest queue made room
+    assert reassembler.abandoned == 2
+    assert reassembler.feed("b", 2 | FRAG_END, b"y", 3.0) == b"xy"
+    assert reassembler.feed("c", 2 | FRAG_END, b"z", 3.0) == b"xz"
+
+
+def test_frag_zero_is_not_a_fragment():
+    with pytest.raises(ValueError):
+        UDPReassembler().feed("s", 0, b"a", 0.0)
@@ -0,0 +1,147 @@
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from socks_resolver import ResolverCache
+import socket
+import threading
+import pytest
+
+
+class _FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class _FakeResolver:
+    """Answers from a table, counting the calls, failing for unknown names."""
+
+    def __init__(self, table: dict[str, str]):
+        self.table = table
+        self.calls: list[str] = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, host, port, family=0, type=0, proto=0, flags=0) -> list:
+        self.calls.append(host)
+        self.release.wait(5)
+        if host not in self.table:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (self.table[host], 0))]
+
+
+def _cache(table: dict[str, str], **kwargs) -> tuple[ResolverCache, _FakeResolver, _FakeClock]:
+    resolver = _FakeResolver(table)
+    clock = _FakeClock()
+    return ResolverCache(resolve=resolver, clock=clock, **kwargs), resolver, clock
+
+
+def test_hits_share_one_lookup_and_get_their_own_port():
+    cache, resolver, _ = _cache({"a.test": "10.0.0.1"})
+
+    first = cache.getaddrinfo("a.test", 80)
+    second = cache.getaddrinfo("a.test", 443)
+
+    assert first[0][4] == ("10.0.0.1", 80)
+    assert second[0][4] == ("10.0.0.1", 443)
+    assert resolver.calls == ["a.test"]
+    assert (cache.misses, cache.hits) == (1, 1)
+
+
+def test_entries_expire_after_the_ttl():
+    cache, resolver, clock = _cache({"a.test": "10.0.0.1"}, ttl=60.0)
+    cache.getaddrinfo("a.test", 80)
+
+    clock.now += 59.9
+    cache.getaddrinfo("a.test", 80)
+    assert resolver.calls == ["a.test"]
+
+    clock.now += 0.1
+    cache.getaddrinfo("a.test", 80)
+    assert resolver.calls == ["a.test", "a.test"]
+
+
+def test_failures_are_cached_for_the_negative_ttl():
+    cache, resolver, clock = _cache({}, negative_ttl=5.0)
+
+    for _ in range(2):
+        with pytest.raises(socket.gaierror):
+            cache.getaddrinfo("missing.test", 80)
+    assert resolver.calls == ["missing.test"]
+
+    resolver.table["missing.test"] = "10.0.0.9"
+    clock.now += 5.0
+    assert cache.gethostbyname("missing.test") == "10.0.0.9"
+    assert resolver.calls == ["missing.test", "missing.test"]
+
+
+def test_errors_that_are_not_lookup_failures_are_not_cached():
+    cache, resolver, _ = _cache({})
+    resolver.table = None
+
+    for _ in range(2):
+        with pytest.raises(TypeError):
+            cache.getaddrinfo("a.test", 80)
+    assert resolver.calls == ["a.test", "a.test"]
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache, resolver, _ = _cache({"a": "10.0.0.1", "b": "10.0.0.2", "c": "10.0.0.3"}, max_entries=2)
+
+    cache.gethostbyname("a")
+    cache.gethostbyname("b")
+    # Touching a makes b the oldest
+    cache.gethostbyname("a")
+    cache.gethostbyname("c")
+
+    assert cache.evictions == 1
+    assert len(cache) == 2
+    cache.gethostbyname("a")
+    cache.gethostbyname("b")
+    assert resolver.calls == ["a", "b", "c", "b"]
+
+
+def test_concurrent_lookups_for_one_name_are_coalesced():
+    cache, resolver, _ = _cache({"slow.test": "10.0.0.1"})
+    resolver.release.clear()
+    results: list[str] = []
+
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.gethostbyname("slow.test")))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    # Wait for the one lookup to start and the rest to queue behind it
+    while cache.misses + cache.coalesced < 4:
+        threading.Event().wait(0.01)
+    resolver.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ["10.0.0.1"] * 4
+    assert resolver.calls == ["slow.test"]
+    assert (cache.misses, cache.coalesced) == (1, 3)
+
+
+def test_empty_host_is_the_wildcard_address():
+    cache, resolver, _ = _cache({})
+
+    assert cache.gethostbyname("") == "0.0.0.0"
+    assert resolver.calls == []
@@ -0,0 +1,119 @@
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from socks_udp_response import ProxyUdpAssociation
+from udp_retry import RttEstimator, UdpPath
+import socket
+import socks
+import socks_udp_response
+import threading
+import time
+import pytest
+
+_REQUEST: bytes = b"\x12\x34rest of the query"
+
+
+class _FakeRelay:
+    """Stands in for the associated socket, the control connection is never used."""
+
+    def __init__(self, on_send=None):
+        self.on_send = on_send
+        self.sent: list[bytes] = []
+        self.closed = False
+
+    def sendto(self, data: bytes, address: tuple) -> int:
+        if self.on_send:
+            self.on_send()
+        self.sent.append(data)
+        return len(data)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def _associated(relay: _FakeRelay) -> ProxyUdpAssociation:
+    association = ProxyUdpAssociation("127.0.0.1", 1)
+    association._sock = relay
+    return association
+
+
+def _path() -> UdpPath:
+    return UdpPath("test", retries=1, estimator=RttEstimator(initial=2.0))
+
+
+@pytest.mark.parametrize("path", [None, _path()], ids=["fixed", "adaptive"])
+def test_a_failed_send_raises_the_send_error(path: UdpPath | None):
+    def refuse():
+        raise ConnectionRefusedError("relay gone")
+    association = _associated(_FakeRelay(on_send=refuse))
+
+    with pytest.raises(ConnectionRefusedError):
+        association.request(_REQUEST, "10.0.0.1", 53, timeout=1.0, path=path)
+    assert association._pending == {}
+
+
+@pytest.mark.parametrize("path", [None, _path()], ids=["fixed", "adaptive"])
+def test_a_dropped_association_fails_the_waiting_request(path: UdpPath | None):
+    relay = _FakeRelay()
+    association = _associated(relay)
+    # The control connection goes away while the request waits for its reply
+    relay.on_send = lambda: threading.Timer(0.05, association._drop, (relay,)).start()
+
+    with pytest.raises(socks.GeneralProxyError, match="closed by proxy"):
+        association.request(_REQUEST, "10.0.0.1", 53, timeout=5.0, path=path)
+    assert relay.closed
+    assert association._sock is None
+    if path is not None:
+        # Never answered, so a reply that still turns up counts as late
+        assert 0x1234 in association._lost
+
+
+def test_a_reply_reaches_its_request():
+    relay = _FakeRelay()
+    association = _associated(relay)
+    relay.on_send = lambda: threading.Timer(0.05, association._deliver, (memoryview(b"\x12\x34answer"),)).start()
+    path = _path()
+
+    assert association.request(_REQUEST, "10.0.0.1", 53, path=path) == b"\x12\x34answer"
+    assert path.counters.answered == 1
+    assert 0x1234 in association._answered
+
+
+def test_a_silent_proxy_times_out_without_holding_the_lock(monkeypatch):
+    monkeypatch.setattr(socks_udp_response, "_ASSOCIATE_TIMEOUT_SECONDS", 0.5)
+    # Accepts the control connection and never answers the greeting
+    silent = socket.create_server(("127.0.0.1", 0))
+    association = ProxyUdpAssociation(*silent.getsockname())
+    errors: list[Exception] = []
+
+    def ask():
+        try:
+            association.request(_REQUEST, "10.0.0.1", 53, timeout=1.0)
+        except OSError as e:
+            errors.append(e)
+    thread = threading.Thread(target=ask)
+    thread.start()
+    try:
+        time.sleep(0.1)
+        # Replies and drops can still get the lock mid-handshake
+        assert association._lock.acquire(timeout=0.1)
+        association._lock.release()
+        thread.join(5)
+    finally:
+        silent.close()
+
+    assert not thread.is_alive()
+    assert len(errors) == 1
+    assert association._sock is None
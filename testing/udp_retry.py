@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2025 pyamsoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+from collections.abc import Callable
+from dataclasses import dataclass
+from histogram import format_ns
+import threading
+import time
+
+# RFC 6298 constants. The 1 second floor is meant for TCP over the internet,
+# DNS on a tethered LAN answers in milliseconds so the floor is far lower.
+_ALPHA: float = 1 / 8
+_BETA: float = 1 / 4
+_K: int = 4
+DEFAULT_INITIAL_RTO: float = 1.0
+DEFAULT_MIN_RTO: float = 0.05
+DEFAULT_MAX_RTO: float = 10.0
+DEFAULT_RETRIES: int = 2
+
+
+class RttEstimator:
+    """Retransmission timeout from smoothed RTT samples, as in RFC 6298."""
+
+    def __init__(
+        self,
+        initial: float = DEFAULT_INITIAL_RTO,
+        minimum: float = DEFAULT_MIN_RTO,
+        maximum: float = DEFAULT_MAX_RTO,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.srtt: float | None = None
+        self.rttvar: float = 0.0
+        self.rto: float = initial
+
+    def sample(self, rtt: float) -> None:
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - _BETA) * self.rttvar + _BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - _ALPHA) * self.srtt + _ALPHA * rtt
+        self.rto = min(self.maximum, max(self.minimum, self.srtt + _K * self.rttvar))
+
+    def backoff(self) -> None:
+        # Stays backed off until a reply to an unretransmitted request
+        self.rto = min(self.maximum, self.rto * 2)
+
+
+@dataclass
+class PathCounters:
+    requests: int = 0
+    answered: int = 0
+    # Attempts that got no reply in time, each one was retransmitted or lost
+    timeouts: int = 0
+    retransmits: int = 0
+    # Requests that never got a reply, retries included
+    lost: int = 0
+    # Replies to a request that was already answered
+    duplicates: int = 0
+    # Replies to a request that had already counted as lost
+    late: int = 0
+
+    @property
+    def loss_percent(self) -> float:
+        return 100.0 * self.lost / self.requests if self.requests else 0.0
+
+
+class UdpPath:
+    """Adaptive timeout, retry budget and loss counters for one way to a server.
+
+    One is shared by every request over the same path, so the RTT estimate
+    carries over from one request to the next. Thread-safe."""
+
+    def __init__(
+        self,
+        name: str,
+        retries: int = DEFAULT_RETRIES,
+        estimator: RttEstimator | None = None,
+    ):
+        self.name = name
+        self.retries = retries
+        self.estimator = estimator or RttEstimator()
+        self.counters = PathCounters()
+        self._lock = threading.Lock()
+
+    def exchange(
+        self,
+        send: Callable[[], None],
+        wait: Callable[[float], bytes | None],
+    ) -> bytes | None:
+        """Sends until wait() returns a reply or the retries run out.
+
+        wait(timeout) returns the reply, or None if nothing came in time.
+        Returns None once the request counts as lost."""
+        with self._lock:
+            self.counters.requests += 1
+
+        for attempt in range(self.retries + 1):
+            with self._lock:
+                timeout = self.estimator.rto
+                if attempt:
+                    self.counters.retransmits += 1
+
+            start = time.monotonic()
+            send()
+            resp = wait(timeout)
+            with self._lock:
+                if resp is not None:
+                    # Karn: a reply after a retransmit could answer any of
+                    # the copies, so it says nothing about the RTT
+                    if not attempt:
+                        self.estimator.sample(time.monotonic() - start)
+                    self.counters.answered += 1
+                    return resp
+                self.counters.timeouts += 1
+                self.estimator.backoff()
+
+        with self._lock:
+            self.counters.lost += 1
+        return None
+
+    def count_duplicate(self) -> None:
+        with self._lock:
+            self.counters.duplicates += 1
+
+    def count_late(self) -> None:
+        with self._lock:
+            self.counters.late += 1
+
+
+def print_path_stats(*paths: UdpPath) -> None:
+    print(
+        f"UDP: {'PATH':<8}{'REQUESTS':>10}{'ANSWERED':>10}{'RETRANSMITS':>13}"
+        f"{'LOST':>7}{'LOSS':>8}{'DUPLICATES':>12}{'LATE':>7}{'SRTT':>12}{'RTO':>12}"
+    )
+    for path in paths:
+        counters = path.counters
+        srtt = path.estimator.srtt
+        print(
+            f"     {path.name:<8}{counters.requests:>10}{counters.answered:>10}"
+            f"{counters.retransmits:>13}{counters.lost:>7}{counters.loss_percent:>7.1f}%"
+            f"{counters.duplicates:>12}{counters.late:>7}"
+            f"{'-' if srtt is None else format_ns(srtt * 1e9):>12}"
+            f"{format_ns(path.estimator.rto * 1e9):>12}"
+        )